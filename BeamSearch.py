@@ -0,0 +1,140 @@
+import numpy as np
+
+from CostEngine import CostEngine
+
+
+class BeamSearch:
+    """
+    A class encapsulating a beam search that grows species signatures one
+    species at a time.
+
+    Generation 0 evaluates the signature with all species (like the genetic
+    algorithm). Generation k keeps the `beam_width` best signatures of size k.
+    Each generation scores all one-species extensions of the current beams in a
+    single batched evaluation, so a generation costs at most
+    `beam_width * len(soi_list)` evaluations.
+
+    Parameters
+    ----------
+    beam_width : int
+        Number of partial signatures kept at every size.
+    num_generations : int
+        Maximum signature size.
+    """
+
+    def __init__(
+            self
+    ):
+        self.search_abundance = None
+        self.search_presence = None
+        self.metadata = None
+        self.positive_label = None
+        self.soi_list = None
+        self.species_classes = None
+        self.output_column = None
+
+        self.beam_width = 10
+        self.num_generations = 50
+        self.objective_function = "Mann-Whitney U-test"
+        self.hypothesis_selection = 'two-sided'
+        self.signature_type = 'positive'
+        self.output_label_categories = None
+        self.stop_strategy = True
+        self.improvement_patience = 3
+        self.random_seed = 42
+
+        self.cost_engine = CostEngine()
+        self.beams = []
+        self._seen_signatures = set()
+        self.current_best_solution = []
+        self.current_best_score = float('inf')
+        self.no_improvement_counter = 0
+        self.current_generation = -1
+        self.tracking_generations = {}
+        self.evaluations = 0
+
+    def reinit_ga_data(self):
+        self.beams = []
+        self._seen_signatures = set()
+        self.current_best_solution = []
+        self.current_best_score = float('inf')
+        self.no_improvement_counter = 0
+        self.current_generation = -1
+        self.tracking_generations = {}
+        self.evaluations = 0
+
+    def evaluation_budget(self):
+        """
+        Upper bound of the number of evaluations for a full run.
+        """
+        return 1 + self.num_generations * self.beam_width * len(self.soi_list)
+
+    def get_species_name(self, signature):
+        """
+        Given a tuple of species indices, returns the names of the species.
+        A species standing for a presence class is expanded to the whole class.
+        """
+        if self.species_classes:
+            return [name for i in signature for name in self.species_classes[self.soi_list[i]]]
+        return [self.soi_list[i] for i in signature]
+
+    def _extend_beams(self, num_items):
+        """
+        Builds all one-species extensions of the current beams. Equivalent
+        subsets reached from different beams are only kept once.
+        """
+        candidates = []
+        for beam in self.beams:
+            for i in range(num_items):
+                if i in beam:
+                    continue
+                candidate = tuple(sorted(beam + (i,)))
+                if candidate in self._seen_signatures:
+                    continue
+                self._seen_signatures.add(candidate)
+                candidates.append(candidate)
+        return candidates
+
+    def run_one_iteration(self):
+        num_items = len(self.soi_list)
+        self.current_generation += 1
+
+        if self.current_generation == 0:
+            self.cost_engine.configure(self)
+            candidates = [tuple(range(num_items))]
+        else:
+            if self.current_generation == 1:
+                self.beams = [()]
+            candidates = self._extend_beams(num_items)
+
+        if candidates:
+            genomes = np.zeros((len(candidates), num_items), dtype=np.float32)
+            for row, candidate in enumerate(candidates):
+                genomes[row, list(candidate)] = 1
+            scores = self.cost_engine.evaluate_batch(genomes)
+
+            # NaN p-values are sorted to the end
+            order = np.argsort(scores, kind='stable')[:self.beam_width]
+            if self.current_generation > 0:
+                self.beams = [candidates[i] for i in order]
+            this_gen_best_score = float(scores[order[0]])
+            this_gen_best_solution = self.get_species_name(candidates[order[0]])
+        else:
+            # All species are already in the signatures
+            this_gen_best_score = self.current_best_score
+            this_gen_best_solution = self.current_best_solution
+
+        # Cumulative, as in the genetic algorithm; the candidates are never evaluated twice
+        self.evaluations += len(candidates)
+        self.tracking_generations[self.current_generation] = {
+            'best_score': this_gen_best_score,
+            'best_solution': this_gen_best_solution,
+            'evaluations': self.evaluations
+        }
+
+        if this_gen_best_score < self.current_best_score:
+            self.current_best_score = this_gen_best_score
+            self.current_best_solution = this_gen_best_solution
+            self.no_improvement_counter = 0
+        else:
+            self.no_improvement_counter += 1
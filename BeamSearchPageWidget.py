@@ -0,0 +1,20 @@
+import DataProcessing
+from BeamSearch import BeamSearch
+from GeneticAlgorithmPageWidget import GeneticAlgorithmPageWidget
+
+
+class BeamSearchPageWidget(GeneticAlgorithmPageWidget):
+    """
+    Search page of the beam search. The beam search reports one generation per
+    signature size, so it reuses the genetic algorithm page and worker.
+    """
+    page_title = 'Beam Search'
+    generations_label_text = "Signature size:"
+    default_export_file_name = "beam_search_result.xlsx"
+
+    def __init__(self, data: DataProcessing.DataFile, bs_data: BeamSearch, parent=None):
+        super().__init__(data=data, ga_data=bs_data, parent=parent)
+
+    def evaluations_text(self):
+        """The beam search has no elite polishing or surrogate screening."""
+        return ""
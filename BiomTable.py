@@ -0,0 +1,158 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from SparseAbundance import SparseAbundance
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+
+class BiomTable:
+    """
+    A BIOM 2.x (HDF5) table, read lazily.
+
+    Opening the table reads only the sample and observation (feature) ids and
+    the row pointers of the observation-major matrix. Sample metadata is read
+    one requested column at a time, group statistics a block of observations at
+    a time, and `subset` reads the selected features only, so neither a dense
+    nor a full sparse table is built. It has the interface of `SparseAbundance`
+    and is used as the sparse abundance store of a DataFile.
+
+    Parameters
+    ----------
+    source : str or file object
+        Path or binary file object of the .biom file.
+    """
+
+    block_values = 1 << 22
+
+    def __init__(self, source):
+        if h5py is None:
+            raise ImportError("Reading BIOM files requires the h5py package.")
+        self.source = source
+        self.file = h5py.File(source, 'r')
+        self.feature_names = self._values(self.file['observation/ids'])
+        self.sample_index = pd.Index(self._values(self.file['sample/ids']))
+        self._feature_positions = {name: i for i, name in enumerate(self.feature_names)}
+        self._indptr = self.file['observation/matrix/indptr'][:]
+        self._packed = None
+
+    @staticmethod
+    def _values(dataset):
+        if h5py.check_string_dtype(dataset.dtype) is not None:
+            return list(dataset.asstr()[:])
+        return list(dataset[:])
+
+    @property
+    def shape(self):
+        return len(self.sample_index), len(self.feature_names)
+
+    @property
+    def memory_bytes(self):
+        return int(self._indptr.nbytes)
+
+    @property
+    def nnz(self):
+        return int(self._indptr[-1])
+
+    @property
+    def metadata_columns(self):
+        if 'sample/metadata' not in self.file:
+            return []
+        return list(self.file['sample/metadata'].keys())
+
+    def sample_metadata(self, columns=None):
+        """
+        Reads the sample metadata `columns` (all if None) into a DataFrame
+        indexed by sample id; text columns become categoricals.
+        """
+        columns = self.metadata_columns if columns is None else list(columns)
+        metadata = pd.DataFrame(index=self.sample_index)
+        for col in columns:
+            dataset = self.file['sample/metadata'][col]
+            values = self._values(dataset)
+            if h5py.check_string_dtype(dataset.dtype) is not None:
+                metadata[col] = pd.Categorical(values)
+            else:
+                metadata[col] = values
+        return metadata
+
+    def feature_indices(self, features):
+        return np.array([self._feature_positions[name] for name in features], dtype=np.int64)
+
+    def _read_observations(self, indices):
+        """
+        Reads the observations `indices` (ascending) into a float32 CSR
+        (observations x samples) matrix, one read per run of consecutive indices.
+        """
+        data, columns, row_lengths = [], [], []
+        runs = np.split(indices, np.flatnonzero(np.diff(indices) != 1) + 1) if len(indices) else []
+        for run in runs:
+            start, end = self._indptr[run[0]], self._indptr[run[-1] + 1]
+            data.append(self.file['observation/matrix/data'][start:end])
+            columns.append(self.file['observation/matrix/indices'][start:end])
+            row_lengths.append(np.diff(self._indptr[run[0]:run[-1] + 2]))
+        indptr = np.concatenate([[0], np.cumsum(np.concatenate(row_lengths))]) if runs else np.zeros(1)
+        return sparse.csr_matrix(
+            (np.concatenate(data).astype(np.float32) if runs else np.zeros(0, dtype=np.float32),
+             np.concatenate(columns) if runs else np.zeros(0, dtype=np.int64),
+             indptr.astype(np.int64)),
+            shape=(len(indices), self.shape[0]))
+
+    def subset(self, features):
+        """
+        Reads only `features` into a SparseAbundance, in the given order.
+        """
+        features = list(features)
+        indices = self.feature_indices(features)
+        order = np.argsort(indices, kind='stable')
+        rows = self._read_observations(indices[order])
+        # Back to the requested order; the transpose of a CSR matrix is CSC
+        rows = rows[np.argsort(order, kind='stable')]
+        return SparseAbundance(rows.T, features, self.sample_index)
+
+    def _observation_blocks(self):
+        """
+        Yields (start, end) ranges of observations with about `block_values`
+        stored values each.
+        """
+        start = 0
+        while start < self.shape[1]:
+            end = int(np.searchsorted(self._indptr, self._indptr[start] + self.block_values, side='right')) - 1
+            end = min(max(end, start + 1), self.shape[1])
+            yield start, end
+            start = end
+
+    def group_statistics(self, labels):
+        """
+        Returns {category: (sum, valid count, nonzero count)} of every feature
+        over the samples of each category of `labels`, read a block of
+        observations at a time.
+        """
+        blocks = []
+        for start, end in self._observation_blocks():
+            indices = np.arange(start, end)
+            block = SparseAbundance(self._read_observations(indices).T, self.feature_names[start:end], self.sample_index)
+            blocks.append(block.group_statistics(labels))
+        categories = blocks[0].keys() if blocks else []
+        return {
+            category: tuple(np.concatenate([block[category][i] for block in blocks]) for i in range(3))
+            for category in categories
+        }
+
+    @property
+    def packed(self):
+        """
+        Presence bits of all features, read once.
+        """
+        if self._packed is None:
+            self._packed = self.subset(self.feature_names).packed
+        return self._packed
+
+    def close(self):
+        self.file.close()
+        if not isinstance(self.source, str):
+            self.source.close()
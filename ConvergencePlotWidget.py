@@ -0,0 +1,219 @@
+import time
+
+import numpy as np
+from PyQt5.QtWidgets import QWidget, QVBoxLayout
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+
+class ConvergencePlotWidget(QWidget):
+    """
+    Live convergence plot of a search: -log10 of the best score so far and of
+    the current score per generation, and the log10 temperature of simulated
+    annealing on a second axis.
+
+    The progress is appended to growing NumPy columns and drawn at most
+    `max_fps` times a second, however often progress arrives. The lines are
+    animated artists drawn straight onto the canvas (blitting): a redraw
+    only draws the segment appended since the previous one on top of what is
+    already shown and blits it, so its cost depends on the new points and not
+    on the length of the run. The figure is drawn in full only when a point
+    falls outside the axes limits, which grow geometrically, so that happens a
+    logarithmic number of times over a run (and on resize). Points
+    are reduced to the minimum and maximum of every pixel column before
+    drawing, so a full redraw costs the same on runs of any length.
+
+    Parameters
+    ----------
+    show_temperature : bool
+        Whether to plot the temperature (simulated annealing).
+    generations : int or None
+        Expected number of generations of the run, the initial x axis limit.
+    """
+
+    max_fps = 4
+    initial_capacity = 1024
+
+    def __init__(self, show_temperature=False, generations=None, parent=None):
+        super().__init__(parent)
+        self.show_temperature = show_temperature
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(layout)
+        self.figure = Figure(figsize=(5, 2))
+        self.canvas = FigureCanvas(self.figure)
+        layout.addWidget(self.canvas)
+
+        self.score_axes = self.figure.add_subplot(1, 1, 1)
+        self.score_axes.set_xlabel('Generation')
+        self.score_axes.set_ylabel('-log10 score')
+        self.best_line, = self.score_axes.plot([], [], color='tab:blue', label='Best', animated=True)
+        self.current_line, = self.score_axes.plot([], [], color='tab:orange', linewidth=0.8, label='Current',
+                                                  animated=True)
+        self.lines = [(self.score_axes, self.best_line, '_best'), (self.score_axes, self.current_line, '_current')]
+        self.temperature_axes = None
+        if self.show_temperature:
+            self.temperature_axes = self.score_axes.twinx()
+            self.temperature_axes.set_ylabel('log10 temperature')
+            temperature_line, = self.temperature_axes.plot([], [], color='tab:green', linewidth=0.8,
+                                                           label='Temperature', animated=True)
+            self.lines.append((self.temperature_axes, temperature_line, '_temperature'))
+        self.score_axes.legend([line for _, line, _ in self.lines], [line.get_label() for _, line, _ in self.lines],
+                               loc='upper left', fontsize='small')
+        self.figure.tight_layout(pad=0.5)
+
+        self._last_draw = 0.0
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.clear(generations)
+
+    def clear(self, generations=None):
+        """
+        Removes the progress, for a new run of `generations` generations.
+        """
+        self._generations = np.zeros(self.initial_capacity)
+        self._best = np.zeros(self.initial_capacity)
+        self._current = np.zeros(self.initial_capacity)
+        self._temperature = np.zeros(self.initial_capacity)
+        self._size = 0
+        # Points already drawn on the canvas, and points within the limits
+        self._drawn = 0
+        self._limited = 0
+        self._limits = (None if generations is None else (0.0, float(max(1, generations))), None, None)
+        self.score_axes.set_xlim(*(self._limits[0] or (0, 1)))
+        self.score_axes.set_ylim(0, 1)
+        if self.temperature_axes is not None:
+            self.temperature_axes.set_ylim(0, 1)
+        self.canvas.draw_idle()
+
+    @staticmethod
+    def _log_scores(values, negate):
+        """
+        log10 (or -log10) of positive values; zeros are clipped to the smallest
+        float and infinite or undefined results become NaN (not drawn).
+        """
+        values = np.array(values, dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logs = np.log10(np.clip(values, np.finfo(np.float64).tiny, None))
+        if negate:
+            logs = -logs
+        logs[~np.isfinite(logs)] = np.nan
+        return logs
+
+    def _reserve(self, size):
+        capacity = len(self._generations)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('_generations', '_best', '_current', '_temperature'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def append(self, generations, best_scores, current_scores, temperatures=None):
+        """
+        Adds the progress of some generations, and draws it unless the plot
+        was drawn less than 1 / `max_fps` seconds ago.
+        """
+        end = self._size + len(generations)
+        self._reserve(end)
+        self._generations[self._size:end] = generations
+        self._best[self._size:end] = self._log_scores(best_scores, negate=True)
+        self._current[self._size:end] = self._log_scores(current_scores, negate=True)
+        if temperatures is not None:
+            self._temperature[self._size:end] = self._log_scores(
+                [np.nan if value is None else value for value in temperatures], negate=False)
+        else:
+            self._temperature[self._size:end] = np.nan
+        self._size = end
+        if time.perf_counter() - self._last_draw >= 1 / self.max_fps:
+            self.flush()
+
+    @staticmethod
+    def _grown_limits(limits, values, from_zero=False):
+        """
+        Returns `limits` when they cover the finite `values`, otherwise limits
+        covering them, widened by at least their span on the side they are
+        exceeded, so a line drifting away widens them only a logarithmic
+        number of times.
+        """
+        finite = values[np.isfinite(values)]
+        if not len(finite):
+            return limits
+        low, high = float(finite.min()), float(finite.max())
+        if limits is not None and limits[0] <= low and high <= limits[1]:
+            return limits
+        if from_zero:
+            return 0.0, 2 * max(high, 0.5)
+        if limits is None:
+            margin = max(0.5, 0.1 * (high - low))
+            return low - margin, high + margin
+        span = limits[1] - limits[0]
+        if low < limits[0]:
+            low = min(low, limits[0] - span)
+        if high > limits[1]:
+            high = max(high, limits[1] + span)
+        return min(low, limits[0]), max(high, limits[1])
+
+    def _pixel_envelope(self, start, values):
+        """
+        Returns (x, y) of the points from `start` on, reduced to their minimum
+        and maximum in every pixel column of the axes.
+        """
+        x, y = self._generations[start:self._size], values[start:self._size]
+        x_low, x_high = self.score_axes.get_xlim()
+        width = max(1.0, self.score_axes.bbox.width)
+        columns = np.floor((x - x_low) / (x_high - x_low) * width)
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(columns)) + 1]) if len(x) else np.zeros(0, dtype=int)
+        if 2 * len(starts) >= len(x):
+            return x, y
+        low, high = np.fmin.reduceat(y, starts), np.fmax.reduceat(y, starts)
+        ends = np.append(starts[1:], len(x)) - 1
+        return np.column_stack([x[starts], x[ends]]).ravel(), np.column_stack([low, high]).ravel()
+
+    def _draw_lines(self, start):
+        """
+        Draws the lines from point `start` on onto the canvas.
+        """
+        for axes, line, name in self.lines:
+            line.set_data(*self._pixel_envelope(start, getattr(self, name)))
+            axes.draw_artist(line)
+        self._drawn = self._size
+
+    def flush(self):
+        """
+        Draws the progress appended since the last draw.
+        """
+        if self._drawn == self._size:
+            return
+        self._last_draw = time.perf_counter()
+
+        # The limits only grow, so only the new points can widen them
+        new = slice(self._limited, self._size)
+        self._limited = self._size
+        limits = (self._grown_limits(self._limits[0], self._generations[new], from_zero=True),
+                  self._grown_limits(self._limits[1], np.concatenate([self._best[new], self._current[new]])),
+                  self._grown_limits(self._limits[2], self._temperature[new]))
+        if limits != self._limits:
+            self._limits = limits
+            if limits[0] is not None:
+                self.score_axes.set_xlim(*limits[0])
+            if limits[1] is not None:
+                self.score_axes.set_ylim(*limits[1])
+            if self.temperature_axes is not None and limits[2] is not None:
+                self.temperature_axes.set_ylim(*limits[2])
+            # A full draw, which draws all the points through _on_draw
+            self.canvas.draw()
+            return
+
+        # The new segment, from the last point drawn so that it connects
+        self._draw_lines(max(0, self._drawn - 1))
+        self.canvas.blit(self.score_axes.bbox)
+
+    def _on_draw(self, event):
+        """
+        Draws all the points on every full draw of the figure (also on resize).
+        """
+        self._draw_lines(0)
@@ -0,0 +1,272 @@
+import numpy as np
+from scipy import sparse
+from scipy.special import ndtr
+from scipy.stats import mannwhitneyu, ttest_ind, f_oneway, kruskal
+
+import Kernels
+from PresenceMatrix import PresenceMatrix
+
+
+class CostEngine:
+    """
+    Batched evaluation of species combinations.
+
+    The binarized search abundance is stored once as a (samples x species)
+    presence matrix, so the richness of a whole batch of combinations is a
+    single matrix product and the statistical test runs vectorized over it.
+
+    With the 'packed' backend every sample's presence is stored as bits packed
+    in uint64 words (2,000 species become 32 words) and the richness of a genome
+    is popcount(sample_bits & genome_bits), which moves 8-64x less memory than
+    the float matrix product.
+
+    The loops that do not vectorize (rank sums with ties, popcounts and single
+    flip updates) run through `Kernels`, compiled with Numba when installed.
+
+    With the 'sparse' backend the presence is a CSC matrix and the richness is
+    a sparse-dense product, whose cost scales with the nonzero values.
+
+    When the search runs over classes of species (`species_classes`, species
+    with identical presence or clusters of co-occurring species), every species
+    of `soi_list` stands for its whole class and the richness counts every
+    member present in a sample: the presence columns are the member counts of
+    the classes, for the 'packed' backend split into one bit plane per binary
+    digit of the counts.
+
+    Parameters
+    ----------
+    backend : str
+        Richness kernel, 'matmul', 'packed' or 'sparse'. Set before `configure`.
+    presence : np.ndarray or scipy.sparse.csc_matrix
+        Presence (1/0) matrix, samples as rows and `soi_list` species as columns.
+    packed_presence : np.ndarray
+        Presence bits of the samples packed into uint64 words ('packed' backend
+        without classes).
+    presence_planes : list of (int, np.ndarray)
+        Place value and packed bits of every binary digit of the presence
+        counts ('packed' backend), the single plane `packed_presence` without classes.
+    group_masks : list of np.ndarray
+        Boolean sample masks, one for each compared group.
+    objective_function : str
+        Name of the statistical test, as chosen on the search selection page.
+    hypothesis_selection : str
+        'two-sided' or 'one-sided'.
+    signature_type : str
+        'positive' or 'negative', only used for one-sided tests.
+    """
+
+    backends = ('matmul', 'packed', 'sparse')
+
+    def __init__(self):
+        self.backend = 'matmul'
+        self.presence = None
+        self.packed_presence = None
+        self.presence_planes = []
+        self.group_masks = []
+        self.objective_function = "Mann-Whitney U-test"
+        self.hypothesis_selection = 'two-sided'
+        self.signature_type = 'positive'
+
+    def configure(self, search):
+        """
+        Builds the presence matrix and group masks from a search instance
+        (GeneticAlgorithm, SimulatedAnnealing or BeamSearch). A streamed, sparse
+        or memory-mapped `search_presence` is used as is, without a dense
+        abundance table; memory-mapped layouts are not copied.
+        """
+        counts = self._class_counts(search)
+        if counts is not None:
+            self.packed_presence = None
+            if self.backend == 'packed':
+                self.presence_planes = self._count_planes(counts)
+                self.presence = None
+            elif self.backend == 'sparse':
+                self.presence = counts
+            else:
+                self.presence = counts.toarray()
+        elif search.search_presence is not None:
+            matrix = search.search_presence
+            if matrix.feature_names != list(search.soi_list):
+                matrix = matrix.subset(search.soi_list)
+            if self.backend == 'packed':
+                self.packed_presence = matrix.packed
+                self.presence = None
+            elif self.backend == 'sparse':
+                self.presence = matrix.sparse_presence()
+                self.packed_presence = None
+            else:
+                self.presence = matrix.float_presence()
+                self.packed_presence = None
+        else:
+            presence = search.search_abundance[search.soi_list].to_numpy() > 0
+            if self.backend == 'packed':
+                self.packed_presence = self.pack_bits(presence)
+                self.presence = None
+            elif self.backend == 'sparse':
+                self.presence = sparse.csc_matrix(presence.astype(np.float32))
+                self.packed_presence = None
+            else:
+                self.presence = presence.astype(np.float32)
+                self.packed_presence = None
+        if self.packed_presence is not None:
+            self.presence_planes = [(1, self.packed_presence)]
+
+        labels = search.metadata[search.output_column].to_numpy()
+        categories = list(search.output_label_categories)
+        if len(categories) == 2:
+            if search.hypothesis_selection == 'one-sided':
+                positive_label = search.positive_label
+            else:
+                positive_label = categories[0]
+            self.group_masks = [labels == positive_label, labels != positive_label]
+        else:
+            self.group_masks = [labels == category for category in categories]
+
+        self.objective_function = search.objective_function
+        self.hypothesis_selection = search.hypothesis_selection
+        self.signature_type = search.signature_type
+
+    @staticmethod
+    def _class_counts(search):
+        """
+        Member counts (samples x `soi_list`) of the searched classes as a
+        float32 CSC matrix, or None when every searched species stands for
+        itself only.
+        """
+        if not search.species_classes:
+            return None
+        classes = [search.species_classes.get(name, [name]) for name in search.soi_list]
+        if all(len(members) == 1 for members in classes):
+            return None
+        members = [name for class_members in classes for name in class_members]
+        matrix = search.search_presence
+        if matrix is None:
+            matrix = PresenceMatrix.from_frame(search.search_abundance, members)
+        membership = sparse.csr_matrix(
+            (np.ones(len(members), dtype=np.float32),
+             (matrix.feature_indices(members), np.repeat(np.arange(len(classes)), [len(m) for m in classes]))),
+            shape=(matrix.shape[1], len(classes)))
+        return sparse.csc_matrix(matrix.sparse_presence() @ membership)
+
+    @staticmethod
+    def _count_planes(counts):
+        """
+        Splits the member counts into one packed bit plane per binary digit,
+        a block of classes at a time. Returns [(place value, packed bits)].
+        """
+        n_samples, n_classes = counts.shape
+        max_count = int(counts.max()) if counts.nnz else 1
+        planes = [np.zeros((n_samples, max(1, -(-n_classes // 64))), dtype=np.uint64)
+                  for _ in range(max_count.bit_length())]
+        block_classes = max(64, PresenceMatrix.block_cells // max(1, n_samples) // 64 * 64)
+        for start in range(0, n_classes, block_classes):
+            block = counts[:, start:start + block_classes].toarray().astype(np.int64)
+            for digit, plane in enumerate(planes):
+                bits = PresenceMatrix.pack_rows((block >> digit) & 1)
+                plane[:, start // 64:start // 64 + bits.shape[1]] = bits
+        return [(1 << digit, plane) for digit, plane in enumerate(planes)]
+
+    def _alternative(self):
+        if self.hypothesis_selection == 'one-sided':
+            return 'greater' if self.signature_type == 'positive' else 'less'
+        return 'two-sided'
+
+    @staticmethod
+    def pack_bits(bits):
+        """
+        Packs the rows of a binary matrix into uint64 words.
+        """
+        return PresenceMatrix.pack_rows(bits)
+
+    def richness(self, genomes):
+        """
+        Richness of every sample for a batch of binary genomes.
+        Returns a (genomes x samples) array.
+        """
+        genomes = np.atleast_2d(np.asarray(genomes, dtype=np.float32))
+        if self.backend == 'packed':
+            packed_genomes = self.pack_bits(genomes)
+            richness = 0
+            for place_value, plane in self.presence_planes:
+                richness = richness + place_value * Kernels.packed_richness(packed_genomes, plane)
+            return richness
+        if self.backend == 'sparse':
+            return np.asarray(self.presence @ genomes.T, dtype=np.float64).T
+        return (genomes @ self.presence.T).astype(np.float64)
+
+    def flip_richness(self, richness, index, sign):
+        """
+        Incremental richness after flipping a single species of a genome,
+        sign is +1 when the species is added and -1 when it is removed.
+        """
+        if self.backend == 'packed':
+            for place_value, plane in self.presence_planes:
+                richness = Kernels.flip_update(richness, plane, index, sign * place_value)
+            return richness
+        if self.backend == 'sparse':
+            return richness + sign * self.presence[:, [index]].toarray().ravel()
+        return richness + sign * self.presence[:, index]
+
+    def _mann_whitney_asymptotic(self, richness):
+        """
+        Mann-Whitney U p-values with the normal approximation, continuity and
+        tie correction, as scipy's 'asymptotic' method.
+        """
+        first_group = self.group_masks[0]
+        n1 = int(first_group.sum())
+        n2 = richness.shape[1] - n1
+        n = n1 + n2
+
+        rank_sum, tie_term = Kernels.rank_sum_ties(richness, first_group)
+        u1 = rank_sum - n1 * (n1 + 1) / 2
+        u2 = n1 * n2 - u1
+
+        alternative = self._alternative()
+        if alternative == 'greater':
+            u, factor = u1, 1
+        elif alternative == 'less':
+            u, factor = u2, 1
+        else:
+            u, factor = np.maximum(u1, u2), 2
+
+        sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            z = (u - n1 * n2 / 2 - 0.5) / sigma
+        return np.clip(factor * ndtr(-z), 0, 1)
+
+    def _p_values(self, richness):
+        if self.objective_function == 'Mann-Whitney U-test' and min(mask.sum() for mask in self.group_masks) > 8:
+            # scipy's 'auto' method is the asymptotic one when both groups are larger than 8
+            return self._mann_whitney_asymptotic(richness)
+
+        groups = [richness[:, mask] for mask in self.group_masks]
+
+        if self.objective_function == 'Mann-Whitney U-test':
+            return mannwhitneyu(groups[0], groups[1], alternative=self._alternative(), axis=1).pvalue
+        if self.objective_function == "Welch's T-test":
+            return ttest_ind(groups[0], groups[1], equal_var=False, alternative=self._alternative(), axis=1).pvalue
+        if self.objective_function == "One Way-ANOVA":
+            return f_oneway(*groups, axis=1).pvalue
+        if self.objective_function == "Kruskal-Wallis H-test":
+            return kruskal(*groups, axis=1).pvalue
+
+        raise ValueError(f"Unknown objective function: {self.objective_function}")
+
+    def evaluate_batch(self, genomes):
+        """
+        Returns the p-values of a batch of binary genomes (one per row).
+        Empty genomes get a p-value of 1.0, like the single evaluations.
+        """
+        genomes = np.atleast_2d(np.asarray(genomes, dtype=np.float32))
+        p_values = np.ones(len(genomes))
+        non_empty = genomes.any(axis=1)
+        if non_empty.any():
+            richness = self.richness(genomes[non_empty])
+            p_values[non_empty] = self._p_values(richness)
+        return p_values
+
+    def evaluate_richness(self, richness):
+        """
+        Returns the p-values of precomputed (genomes x samples) richness rows.
+        """
+        return self._p_values(np.atleast_2d(richness))
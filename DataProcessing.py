@@ -1,6 +1,99 @@
+import contextlib
+import gzip
+import hashlib
+import io
 import os
+import time
+import numpy as np
 import pandas as pd
 from pandas import CategoricalDtype
+from scipy import sparse
+
+from BiomTable import BiomTable
+from DatasetCache import DatasetCache
+from Normalization import Normalization
+from PresenceFile import PresenceFile
+from PreprocessingEngine import PreprocessingEngine
+from PreprocessingPipeline import PreprocessingPipeline
+from PresenceMatrix import PresenceMatrix
+from SparseAbundance import SparseAbundance
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def table_format(file_path):
+    """
+    Returns (kind, delimiter, compression) of an input file from its name:
+    kind is 'delimited', 'excel', 'biom' or None, compression 'gzip', 'zstd' or None.
+    """
+    name = file_path.lower()
+    compression = None
+    for suffix, codec in (('.gz', 'gzip'), ('.zst', 'zstd'), ('.zstd', 'zstd')):
+        if name.endswith(suffix):
+            name, compression = name[:-len(suffix)], codec
+            break
+    if name.endswith('.csv'):
+        return 'delimited', ',', compression
+    if name.endswith('.tsv'):
+        return 'delimited', '\t', compression
+    if compression is None and name.endswith(('.xlsx', '.xls')):
+        return 'excel', None, None
+    if compression is None and name.endswith(('.biom', '.h5', '.hdf5')):
+        return 'biom', None, None
+    return None, None, compression
+
+
+class ReadCancelled(Exception):
+    """
+    Raised from DataFile.read_file when the read is cancelled with cancel_read().
+    """
+
+
+class _ProgressReader(io.RawIOBase):
+    """
+    A binary file that reports the position read to the progress callback of
+    a DataFile and stops the read when it is cancelled.
+    """
+
+    def __init__(self, file_path, data_file):
+        super().__init__()
+        self.file = open(file_path, 'rb')
+        self.total_bytes = os.fstat(self.file.fileno()).st_size
+        self.data_file = data_file
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self.file.seek(offset, whence)
+
+    def tell(self):
+        return self.file.tell()
+
+    def readinto(self, buffer):
+        if self.data_file._cancel_requested:
+            raise ReadCancelled("The file read was cancelled")
+        n = self.file.readinto(buffer)
+        if self.data_file._read_progress_callback is not None:
+            self.data_file._read_progress_callback(self.file.tell(), self.total_bytes)
+        return n
+
+    def close(self):
+        self.file.close()
+        super().close()
 
 
 class DataFile:
@@ -18,31 +111,858 @@ class DataFile:
         self.feature_list_after_preprocessing = []
         self.preprocessed_abundance_dataframe = pd.DataFrame()
 
-    def read_file(self, file_path):
+        # Typed CSV ingest: abundance columns as float32, metadata as categoricals
+        self.typed_ingest = True
+        self.ingest_sample_rows = 50
+        self.ingest_block_rows = 256
+        self.last_read_stats = {}
+
+        # Binary cache of parsed files, keyed by content hash, size and mtime
+        self.use_cache = True
+        self.dataset_cache = DatasetCache()
+
+        # Streaming ingest: only packed presence bits and per-group statistics are kept
+        self.streaming_ingest = False
+        self.presence = None
+        self.preprocessed_presence = None
+        self.streamed_statistics = {}
+
+        # Sparse storage: the abundance columns are kept as a CSC matrix
+        self.sparse_storage = False
+        self.sparse_abundance = None
+        self.preprocessed_sparse_abundance = None
+
+        # Memory-mapped presence files shared by concurrent searches
+        self.presence_files = PresenceFile()
+
+        # Read-only presence of the current preprocessing result, built once
+        self._presence_view = None
+
+        # Search over one species per class of identical presence, or per
+        # cluster of species co-occurring with a Jaccard similarity of at least
+        # `co_occurrence_threshold` (the clusters include the identical classes)
+        self.collapse_identical_presence = False
+        self.cluster_co_occurring = False
+        self.co_occurrence_threshold = 0.8
+        self._species_classes = {}
+
+        # Memoized preprocessing stages, keyed by the dataset fingerprint and
+        # the stage parameters; the key of the current feature selection
+        self.preprocessing_pipeline = PreprocessingPipeline()
+        self.dataset_fingerprint = None
+        self._selection_key = None
+
+        # Normalization steps ((name, params) tuples of Normalization) applied
+        # to the abundance before the statistics and filters
+        self.normalization_steps = []
+        self._normalized_abundance = (None, None)
+
+        # Progress and cancellation of a read running in a worker thread
+        self._read_progress_callback = None
+        self._cancel_requested = False
+
+    def read_file(self, file_path, metadata_columns=None, progress_callback=None):
         """
-        Reads a CSV or Excel file (xls, xlsx) into self.input_dataframe.
+        Reads a CSV, TSV (both optionally gzip or zstd compressed), Excel (xls,
+        xlsx) or BIOM (HDF5) file into self.input_dataframe.
         Returns the resulting DataFrame.
+
+        With `typed_ingest`, CSV abundance columns are parsed as float32 and the
+        metadata columns as categoricals. The metadata columns are sniffed from
+        the first rows when `metadata_columns` is not given; a numeric label
+        column sniffed as abundance has to be read again as metadata (see
+        metadata_columns_for_labels). Parse time and memory are kept in
+        `last_read_stats`.
+
+        With `use_cache`, the parsed file is written to the dataset cache and
+        later loads of the same content are memory-mapped from there.
+
+        With `streaming_ingest`, a CSV file is read in row chunks and only the
+        packed presence bits (`presence`) and the per-group statistics needed by
+        preprocessing are kept; self.input_dataframe then holds the metadata
+        columns only.
+
+        With `sparse_storage`, the numeric (abundance) columns are moved into a
+        CSC matrix (`sparse_abundance`) and self.input_dataframe holds the
+        metadata columns only. A CSV file is then read in row chunks that are
+        made sparse one at a time, without the dataset cache; an Excel file is
+        parsed whole and converted.
+
+        A BIOM file is opened lazily as `sparse_abundance` (a BiomTable):
+        self.input_dataframe holds the sample metadata (`metadata_columns`, all
+        if None) and the abundance of a feature is only read when it is needed.
+
+        `progress_callback(bytes_read, total_bytes)` is called as the file is
+        read. A read can be stopped from another thread with cancel_read(), it
+        then raises ReadCancelled and leaves an empty input.
         """
         self.input_data_path = file_path
+        start_time = time.perf_counter()
+        if isinstance(self.sparse_abundance, BiomTable):
+            self.sparse_abundance.close()
+        self.input_dataframe = pd.DataFrame()
+        self.presence = None
+        self.preprocessed_presence = None
+        self.streamed_statistics = {}
+        self.sparse_abundance = None
+        self.preprocessed_sparse_abundance = None
+        self._presence_view = None
+        self._species_classes = {}
+        self._selection_key = None
+        self.dataset_fingerprint = None
+        self.normalization_steps = []
+        self._normalized_abundance = (None, None)
+
+        self._cancel_requested = False
+        self._read_progress_callback = progress_callback
+        try:
+            df, parser = self._parse_file(file_path, metadata_columns)
+        except ReadCancelled:
+            self.presence = None
+            self.sparse_abundance = None
+            raise
+        finally:
+            self._read_progress_callback = None
+
+        if df is not None:
+            self.input_dataframe = df
+            self.dataset_fingerprint = self._dataset_fingerprint(file_path, metadata_columns)
+
+        abundance_store = self._abundance_store()
+        self.last_read_stats = {
+            'parser': parser,
+            'seconds': time.perf_counter() - start_time,
+            'memory_bytes': int(self.input_dataframe.memory_usage(deep=True).sum())
+                            + (abundance_store.memory_bytes if abundance_store is not None else 0),
+        }
+        return self.input_dataframe
+
+    def cancel_read(self):
+        """
+        Asks a running read_file to stop, it raises ReadCancelled at its next read.
+        """
+        self._cancel_requested = True
+
+    def _progress_file(self, file_path):
+        """
+        Opens a file reporting progress and checking for cancellation.
+        """
+        return io.BufferedReader(_ProgressReader(file_path, self), 1 << 20)
 
-        if file_path.endswith('.csv'):
+    @contextlib.contextmanager
+    def _open_for_read(self, file_path, track_progress=True):
+        """
+        Opens a file for the parsers, decompressed when its name ends in .gz, .zst
+        or .zstd. The progress is the position in the (compressed) file.
+        """
+        compression = table_format(file_path)[2]
+        with (self._progress_file(file_path) if track_progress else open(file_path, 'rb')) as raw:
+            if compression == 'gzip':
+                with gzip.GzipFile(fileobj=raw) as f:
+                    yield f
+            elif compression == 'zstd':
+                if zstandard is not None:
+                    with io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=False), 1 << 20) as f:
+                        yield f
+                elif pa is not None:
+                    with io.BufferedReader(pa.input_stream(raw, compression='zstd'), 1 << 20) as f:
+                        yield f
+                else:
+                    raise ImportError("Reading zstd files requires the zstandard or pyarrow package.")
+            else:
+                yield raw
+
+    def _read_sample(self, file_path):
+        """
+        Reads the first `ingest_sample_rows` rows of a delimited file.
+        """
+        with self._open_for_read(file_path, track_progress=False) as f:
+            return pd.read_csv(f, sep=table_format(file_path)[1], index_col=0, nrows=self.ingest_sample_rows)
+
+    def _parse_file(self, file_path, metadata_columns=None):
+        """
+        Parses the file with the configured ingest mode.
+        Returns the DataFrame (None if parsing failed) and the name of the parser used.
+        """
+        parser = "pandas"
+        df = None
+        kind, delimiter, _ = table_format(file_path)
+
+        cache_key = None
+        if kind == 'biom':
+            try:
+                df = self._read_biom(file_path, metadata_columns)
+                parser = "biom"
+            except ReadCancelled:
+                raise
+            except Exception as e:
+                print("Error loading the BIOM file:", e)
+        elif self.streaming_ingest and kind == 'delimited':
             try:
-                self.input_dataframe = pd.read_csv(file_path, index_col=0)
+                df = self._read_csv_streaming(file_path, metadata_columns)
+                parser = "streaming"
+            except ReadCancelled:
+                raise
+            except Exception as e:
+                print("Error loading the CSV file:", e)
+        elif self.sparse_storage and kind == 'delimited':
+            try:
+                df = self._read_csv_sparse(file_path, metadata_columns)
+                parser = "chunked, sparse"
+            except ReadCancelled:
+                raise
+            except Exception as e:
+                print("Error loading the CSV file:", e)
+        elif self.use_cache and kind in ('delimited', 'excel'):
+            try:
+                cache_key = self.dataset_cache.fingerprint(file_path, self._cache_settings(file_path, metadata_columns),
+                                                           open_file=self._progress_file)
+                df = self.dataset_cache.load(cache_key)
+            except OSError as e:
+                print("Dataset cache not available:", e)
+            if df is not None:
+                parser = "cache"
+
+        if df is not None or parser in ("streaming", "biom", "chunked, sparse"):
+            pass
+        elif kind == 'delimited':
+            try:
+                if self.typed_ingest:
+                    df, parser = self._read_csv_typed(file_path, metadata_columns)
+                else:
+                    with self._open_for_read(file_path) as f:
+                        df = pd.read_csv(f, sep=delimiter, index_col=0)
+            except ReadCancelled:
+                raise
             except Exception as e:
                 print("Error loading the CSV file:", e)
 
-        elif file_path.endswith(('.xlsx', '.xls')):
+        elif kind == 'excel':
             try:
-                self.input_dataframe = pd.read_excel(file_path, sheet_name=0, index_col=0)
+                with self._open_for_read(file_path) as f:
+                    df = pd.read_excel(f, sheet_name=0, index_col=0)
+            except ReadCancelled:
+                raise
             except Exception as e:
                 print("Error loading the Excel file:", e)
         else:
             print("Error: Unrecognized file format.")
 
-        return self.input_dataframe
+        if df is not None:
+            if cache_key is not None and parser not in ("cache", "streaming"):
+                self.dataset_cache.store(cache_key, df)
+            if self.sparse_storage and parser not in ("streaming", "biom", "chunked, sparse"):
+                df = self._split_sparse_abundance(df, metadata_columns)
+                parser += ", sparse"
+        return df, parser
+
+    def _dataset_fingerprint(self, file_path, metadata_columns=None):
+        """
+        Identifies the loaded dataset for the preprocessing stages: the file
+        (path, size and mtime), the parse settings and the abundance storage.
+        """
+        stat = os.stat(file_path)
+        if self.presence is not None:
+            storage = "presence"
+        elif self.sparse_abundance is not None:
+            storage = "sparse"
+        else:
+            storage = "frame"
+        return (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns,
+                self._cache_settings(file_path, metadata_columns), storage)
+
+    def _cache_settings(self, file_path, metadata_columns=None):
+        """
+        The parse settings that change the parsed DataFrame, part of the cache key.
+        """
+        settings = "typed" if (self.typed_ingest and table_format(file_path)[0] == 'delimited') else "default"
+        if metadata_columns:
+            settings += "-" + hashlib.blake2b(",".join(metadata_columns).encode(), digest_size=4).hexdigest()
+        return settings
+
+    def _read_csv_typed(self, file_path, metadata_columns=None):
+        """
+        Reads a CSV file with float32 abundance and categorical metadata columns.
+        Uses the multi-threaded pyarrow parser when it is installed and falls back
+        to the default pandas parser if the typed parse fails.
+        Returns the DataFrame and the name of the parser used.
+        """
+        sample = self._read_sample(file_path)
+        if metadata_columns is None:
+            metadata_columns = [col for col in sample.columns if not pd.api.types.is_numeric_dtype(sample[col])]
+        delimiter = table_format(file_path)[1]
+
+        try:
+            if pa_csv is not None:
+                df = self._read_csv_pyarrow(file_path, sample, metadata_columns)
+                if df is not None:
+                    return df, "pyarrow (typed)"
+            dtypes = {col: ('category' if col in metadata_columns else 'float32') for col in sample.columns}
+            with self._open_for_read(file_path) as f:
+                return pd.read_csv(f, sep=delimiter, index_col=0, dtype=dtypes), "pandas (typed)"
+        except (ValueError, TypeError, pd.errors.ParserError) as e:
+            print("Typed CSV parsing failed, using the default parser:", e)
+            with self._open_for_read(file_path) as f:
+                return pd.read_csv(f, sep=delimiter, index_col=0), "pandas"
+
+    def _csv_block_size(self, file_path, minimum_bytes):
+        """
+        Size in bytes of a pyarrow block holding about `ingest_block_rows` rows.
+        """
+        with self._open_for_read(file_path, track_progress=False) as f:
+            lines = [f.readline() for _ in range(self.ingest_sample_rows + 1)]
+        row_bytes = max(1, sum(len(line) for line in lines[1:]) // max(1, len(lines) - 1))
+        return int(min(max(row_bytes * self.ingest_block_rows, minimum_bytes), 1 << 30))
+
+    @staticmethod
+    def _pyarrow_column_types(sample, metadata_columns):
+        return {
+            col: (pa.dictionary(pa.int32(), pa.string()) if col in metadata_columns else pa.float32())
+            for col in sample.columns
+        }
+
+    def _read_csv_pyarrow(self, file_path, sample, metadata_columns):
+        # Wide tables need large blocks, the default 1 MB block holds only a few rows
+        block_size = self._csv_block_size(file_path, 1 << 20)
+        with self._open_for_read(file_path) as f:
+            table = pa_csv.read_csv(
+                f,
+                read_options=pa_csv.ReadOptions(block_size=block_size, use_threads=True),
+                parse_options=pa_csv.ParseOptions(delimiter=table_format(file_path)[1]),
+                convert_options=pa_csv.ConvertOptions(column_types=self._pyarrow_column_types(sample, metadata_columns))
+            )
+        if table.column_names[1:] != [str(col) for col in sample.columns]:
+            # Duplicated or unusual headers, let pandas handle them
+            return None
+
+        # Fill all abundance columns into a single float32 block
+        abundance_columns = [col for col in sample.columns if col not in metadata_columns]
+        values = np.empty((table.num_rows, len(abundance_columns)), dtype=np.float32)
+        for i, col in enumerate(abundance_columns):
+            values[:, i] = table.column(str(col)).to_numpy()
+
+        index = pd.Index(table.column(0).to_numpy(zero_copy_only=False), name=sample.index.name)
+        df = pd.DataFrame(values, index=index, columns=abundance_columns, copy=False)
+        for col in metadata_columns:
+            df.insert(sample.columns.get_loc(col), col, table.column(str(col)).to_pandas().values)
+        return df
+
+    def _iter_csv_chunks(self, file_path, sample, metadata_columns):
+        """
+        Yields (index, float32 abundance block, metadata DataFrame) for chunks of
+        about `ingest_block_rows` rows, with the pyarrow streaming reader when it
+        is installed and with the chunked pandas parser otherwise.
+        """
+        abundance_columns = [col for col in sample.columns if col not in metadata_columns]
+        if pa_csv is not None:
+            with self._open_for_read(file_path) as f:
+                reader = pa_csv.open_csv(
+                    f,
+                    read_options=pa_csv.ReadOptions(block_size=self._csv_block_size(file_path, 1 << 16)),
+                    parse_options=pa_csv.ParseOptions(delimiter=table_format(file_path)[1]),
+                    convert_options=pa_csv.ConvertOptions(column_types=self._pyarrow_column_types(sample, metadata_columns))
+                )
+                if reader.schema.names[1:] == [str(col) for col in sample.columns]:
+                    positions = {col: i + 1 for i, col in enumerate(sample.columns)}
+                    for batch in reader:
+                        values = np.empty((batch.num_rows, len(abundance_columns)), dtype=np.float32)
+                        for i, col in enumerate(abundance_columns):
+                            values[:, i] = batch.column(positions[col]).to_numpy(zero_copy_only=False)
+                        index = pd.Index(batch.column(0).to_numpy(zero_copy_only=False), name=sample.index.name)
+                        metadata = pd.DataFrame(
+                            {col: batch.column(positions[col]).to_pandas().values for col in metadata_columns},
+                            index=index)
+                        yield index, values, metadata
+                    return
+
+        dtypes = {col: ('category' if col in metadata_columns else 'float32') for col in sample.columns}
+        with self._open_for_read(file_path) as f:
+            for chunk in pd.read_csv(f, sep=table_format(file_path)[1], index_col=0, dtype=dtypes,
+                                     chunksize=self.ingest_block_rows):
+                yield chunk.index, chunk[abundance_columns].to_numpy(dtype=np.float32), chunk[metadata_columns]
+
+    def _read_csv_streaming(self, file_path, metadata_columns=None):
+        """
+        Reads a CSV file in chunks of about `ingest_block_rows` rows. Each chunk
+        is binarized and packed into presence bits, and its abundance is added to
+        per-group sums, valid and nonzero counts for every metadata column, so
+        the memory used is bounded by the chunk instead of the whole table.
+        Sets self.presence and self.streamed_statistics and returns the metadata
+        DataFrame.
+        """
+        sample = self._read_sample(file_path)
+        if metadata_columns is None:
+            metadata_columns = [col for col in sample.columns if not pd.api.types.is_numeric_dtype(sample[col])]
+        abundance_columns = [col for col in sample.columns if col not in metadata_columns]
+
+        packed_chunks = []
+        metadata_chunks = []
+        statistics = {col: {} for col in metadata_columns}
+        for index, values, metadata in self._iter_csv_chunks(file_path, sample, metadata_columns):
+            nonzero = values > 0
+            packed_chunks.append(PresenceMatrix.pack_rows(nonzero))
+            metadata_chunks.append(metadata)
+
+            valid = (~np.isnan(values)).astype(np.float32)
+            nonzero = nonzero.astype(np.float32)
+            values = np.nan_to_num(values, nan=0.0, copy=False)
+            for col in metadata_columns:
+                labels = metadata[col].to_numpy()
+                categories = pd.unique(labels[pd.notna(labels)])
+                # One row per category, the group sums of the chunk are a single product
+                one_hot = np.array([labels == category for category in categories], dtype=np.float32)
+                sums, valid_counts, nonzero_counts = one_hot @ values, one_hot @ valid, one_hot @ nonzero
+                for i, category in enumerate(categories):
+                    if category not in statistics[col]:
+                        statistics[col][category] = {
+                            'sum': np.zeros(len(abundance_columns)),
+                            'valid': np.zeros(len(abundance_columns)),
+                            'nonzero': np.zeros(len(abundance_columns)),
+                        }
+                    statistics[col][category]['sum'] += sums[i]
+                    statistics[col][category]['valid'] += valid_counts[i]
+                    statistics[col][category]['nonzero'] += nonzero_counts[i]
+
+        metadata_df = pd.concat(metadata_chunks)
+        for col in metadata_columns:
+            metadata_df[col] = metadata_df[col].astype('category')
+
+        self.presence = PresenceMatrix(np.vstack(packed_chunks), abundance_columns, metadata_df.index)
+        self.streamed_statistics = statistics
+        return metadata_df
+
+    def _read_csv_sparse(self, file_path, metadata_columns=None):
+        """
+        Reads a CSV file in chunks of about `ingest_block_rows` rows into a
+        sparse matrix: only the nonzero (and NaN) values of a chunk are kept, so
+        the memory used scales with the nonzero values and one chunk instead of
+        samples x features. Sets self.sparse_abundance and returns the metadata
+        DataFrame.
+        """
+        sample = self._read_sample(file_path)
+        if metadata_columns is None:
+            metadata_columns = [col for col in sample.columns if not pd.api.types.is_numeric_dtype(sample[col])]
+        abundance_columns = [col for col in sample.columns if col not in metadata_columns]
+
+        sparse_chunks = []
+        metadata_chunks = []
+        for index, values, metadata in self._iter_csv_chunks(file_path, sample, metadata_columns):
+            sparse_chunks.append(sparse.csr_matrix(values))
+            metadata_chunks.append(metadata)
+
+        metadata_df = pd.concat(metadata_chunks)
+        for col in metadata_columns:
+            metadata_df[col] = metadata_df[col].astype('category')
+        matrix = sparse.vstack(sparse_chunks, format='csc', dtype=np.float32)
+        self.sparse_abundance = SparseAbundance(matrix, abundance_columns, metadata_df.index)
+        return metadata_df
+
+    def _read_biom(self, file_path, metadata_columns=None):
+        """
+        Opens a BIOM file lazily as self.sparse_abundance and returns its sample
+        metadata `metadata_columns` (all if None).
+        """
+        source = self._progress_file(file_path)
+        table = None
+        try:
+            table = BiomTable(source)
+            metadata_df = table.sample_metadata(metadata_columns)
+        except BaseException:
+            if table is not None:
+                table.close()
+            else:
+                source.close()
+            raise
+        self.sparse_abundance = table
+        return metadata_df
+
+    def _split_sparse_abundance(self, df, metadata_columns=None):
+        """
+        Moves the abundance columns of a parsed DataFrame into self.sparse_abundance
+        and returns the metadata columns. The metadata columns are the non-numeric
+        ones when `metadata_columns` is not given.
+        """
+        if metadata_columns is None:
+            metadata_columns = [col for col in df.columns if not pd.api.types.is_numeric_dtype(df[col])]
+        abundance_columns = [col for col in df.columns if col not in metadata_columns]
+        self.sparse_abundance = SparseAbundance.from_frame(df[abundance_columns])
+        return df[metadata_columns]
+
+    def _abundance_store(self):
+        """
+        The abundance kept outside of the DataFrames: streamed presence bits,
+        a sparse matrix, or None.
+        """
+        if self.presence is not None:
+            return self.presence
+        return self.sparse_abundance
+
+    def get_search_presence(self):
+        """
+        Returns the preprocessed presence for the searches when the abundance is
+        not kept as a DataFrame (streamed or sparse), otherwise None.
+        """
+        if self.preprocessed_presence is not None:
+            return self.preprocessed_presence
+        return self.preprocessed_sparse_abundance
+
+    def get_presence_view(self):
+        """
+        Returns the binarized presence of the current preprocessing result, in
+        the order of feature_list_after_preprocessing. It is built once per
+        preprocessing result, is read-only, and is shared by every search and
+        result view instead of each making its own binarized copy.
+        """
+        if self._presence_view is None:
+            _, self._presence_view = self.preprocessing_pipeline.run(
+                self._selection_key, 'binarize', (), self._binarize)
+        return self._presence_view
+
+    def _binarize(self):
+        features = list(self.feature_list_after_preprocessing)
+        presence = self.get_search_presence()
+        if self._fills_zeros():
+            # The presence is the nonzero pattern of the data, not of the CLR or standardized values
+            presence = self.get_presence_abundance()
+            if isinstance(presence, pd.DataFrame):
+                presence = PresenceMatrix.from_frame(presence, features)
+            else:
+                presence = presence.subset(features)
+        elif presence is None:
+            presence = PresenceMatrix.from_frame(self.preprocessed_abundance_dataframe, features)
+        elif presence.feature_names != features:
+            presence = presence.subset(features)
+        if not isinstance(presence, PresenceMatrix):
+            presence = PresenceMatrix(presence.packed, presence.feature_names, presence.sample_index)
+        samples = self.get_search_samples()
+        if samples is not None:
+            presence = PresenceMatrix(presence.packed[samples], presence.feature_names, presence.sample_index[samples])
+        presence.packed.flags.writeable = False
+        return presence
+
+    def get_search_samples(self):
+        """
+        Returns the mask of the samples searched over, leaving out those a
+        normalization step set to NaN in every feature (rarefied below the
+        depth), or None when every sample is kept. The presence view and
+        get_search_metadata have these samples only.
+        """
+        _, samples = self.preprocessing_pipeline.run(
+            self._abundance_key(), 'samples', (), self._measured_samples)
+        return samples
+
+    def _measured_samples(self):
+        if not self._normalizes():
+            return None
+        abundance = self.get_normalized_abundance()
+        if abundance.shape[1] == 0:
+            return None
+        if isinstance(abundance, pd.DataFrame):
+            measured = abundance.notna().any(axis=1).to_numpy()
+        else:
+            nan_samples = abundance.matrix.indices[np.isnan(abundance.matrix.data)]
+            measured = np.bincount(nan_samples, minlength=abundance.shape[0]) < abundance.shape[1]
+        return None if measured.all() else measured
+
+    def get_search_metadata(self):
+        """
+        Returns the label metadata of the searched samples (get_search_samples),
+        in the row order of the presence view.
+        """
+        samples = self.get_search_samples()
+        if samples is None:
+            return self.input_metadata_dataframe
+        return self.input_metadata_dataframe[samples]
+
+    def get_species_classes(self):
+        """
+        Returns {representative: species} of the classes of preprocessed species
+        searched together: the clusters of co-occurring species with
+        `cluster_co_occurring`, led by their most prevalent species, otherwise
+        the species with identical presence in every sample with
+        `collapse_identical_presence`, whose representative is the first
+        species of the class. None when neither is on.
+        """
+        if self.cluster_co_occurring:
+            stage, params = 'cluster', (float(self.co_occurrence_threshold),)
+        elif self.collapse_identical_presence:
+            stage, params = 'deduplicate', ()
+        else:
+            return None
+        if (stage, params) not in self._species_classes:
+            binarized_key = None
+            if self._selection_key is not None:
+                binarized_key = self.preprocessing_pipeline.stage_key(self._selection_key, 'binarize')
+            _, self._species_classes[(stage, params)] = self.preprocessing_pipeline.run(
+                binarized_key, stage, params, lambda: self._group_species(stage))
+        return self._species_classes[(stage, params)]
+
+    def _group_species(self, stage):
+        presence = self.get_presence_view()
+        if stage == 'cluster':
+            classes = presence.jaccard_clusters(self.co_occurrence_threshold)
+        else:
+            classes = presence.equivalence_classes()
+        return {members[0]: members for members in classes}
+
+    def get_search_feature_list(self):
+        """
+        Returns the species searched over: one representative per presence class
+        or co-occurrence cluster when grouping species, otherwise all
+        preprocessed species.
+        """
+        species_classes = self.get_species_classes()
+        if species_classes is None:
+            return self.feature_list_after_preprocessing
+        return list(species_classes)
+
+    def map_search_presence(self):
+        """
+        Writes the presence view to the presence file store and returns it
+        memory-mapped read-only. Identical data maps the same file, and the
+        file written earlier for this dataset is replaced.
+        """
+        presence = self.get_presence_view()
+        return self.presence_files.open(self.presence_files.write(presence, source=self.dataset_key()))
+
+    def get_input_shape(self):
+        """
+        Returns (samples, columns) of the input, including streamed or sparse features.
+        """
+        rows, columns = self.input_dataframe.shape
+        if self._abundance_store() is not None:
+            columns += self._abundance_store().shape[1]
+        return rows, columns
+
+    def get_preprocessed_shape(self):
+        if self.get_search_presence() is not None:
+            return self.get_search_presence().shape
+        return self.preprocessed_abundance_dataframe.shape
+
+    def preprocessing_engine(self, output_column):
+        """
+        Returns a PreprocessingEngine with the mean abundance and prevalence of
+        every feature in every group of `output_column`. A DataFrame is reduced
+        in one pass over its group codes; streamed and sparse abundance use
+        their per-group sums and nonzero counts. The engine is built once per
+        dataset and output column (a preprocessing stage) and then answers
+        every threshold query, and the association p-values used for screening
+        are scored once on it.
+        """
+        _, engine = self.preprocessing_pipeline.run(
+            self._abundance_key(), 'statistics', (output_column,),
+            lambda: self._fit_preprocessing_engine(output_column))
+        return engine
+
+    def dataset_key(self):
+        """
+        Key of the loaded dataset split by the output labels, the input of the
+        first preprocessing stages (None when no file is loaded).
+        """
+        if self.dataset_fingerprint is None:
+            return None
+        return self.dataset_fingerprint, tuple(self.output_labels)
+
+    def filter_features(self, output_column, settings):
+        """
+        Returns the sorted features selected by the threshold and screening
+        `settings` (the arguments of PreprocessingEngine.select_features) in the
+        groups of `output_column`.
+        """
+        _, features = self.preprocessing_pipeline.run(
+            self._abundance_key(), 'filter', (output_column,) + tuple(settings),
+            lambda: self.preprocessing_engine(output_column).select_features(*settings))
+        return features
+
+    def _fit_preprocessing_engine(self, output_column):
+        engine = PreprocessingEngine()
+        abundance = self.get_normalized_abundance()
+        if isinstance(abundance, pd.DataFrame) and self._fills_zeros():
+            # Mean abundance of the normalized values, prevalence of the nonzero data
+            labels = self.get_metadata_input_dataframe()[output_column]
+            codes, categories = engine.group_codes(labels)
+            sums, valid, _ = engine.group_sums(abundance, codes, len(categories))
+            nonzero = self._group_nonzero_counts(self.get_presence_abundance(), labels, categories)
+            return engine.fit(abundance.columns, categories, sums, valid, nonzero)
+        if isinstance(abundance, pd.DataFrame):
+            labels = self.get_metadata_input_dataframe()[output_column]
+            return engine.fit_frame(abundance, labels)
+
+        if self.presence is not None:
+            group_statistics = {
+                category: (stats['sum'], stats['valid'], stats['nonzero'])
+                for category, stats in self.streamed_statistics[output_column].items()
+            }
+        else:
+            labels = self.get_metadata_input_dataframe()[output_column].to_numpy()
+            group_statistics = abundance.group_statistics(labels)
+
+        categories = list(group_statistics)
+        sums, valid, nonzero = (
+            np.array([group_statistics[category][i] for category in categories]).reshape(len(categories), -1)
+            for i in range(3)
+        )
+        return engine.fit(abundance.feature_names, categories, sums, valid, nonzero)
+
+    def _abundance_key(self):
+        """
+        Key of the (normalized) abundance the statistics and selections are made on.
+        """
+        if self.dataset_key() is None or not self._normalizes():
+            return self.dataset_key()
+        return self.preprocessing_pipeline.stage_key(self.dataset_key(), 'normalize', self.normalization_steps)
+
+    @staticmethod
+    def _group_nonzero_counts(abundance, labels, categories):
+        """
+        Returns the (groups x features) nonzero counts of an abundance DataFrame
+        or store over the samples of each of the `categories` of `labels`.
+        """
+        if isinstance(abundance, pd.DataFrame):
+            codes = pd.Categorical(np.asarray(labels), categories=categories).codes.astype(np.int64)
+            return PreprocessingEngine.group_sums(abundance, codes, len(categories))[2]
+        group_statistics = abundance.group_statistics(np.asarray(labels))
+        return np.array([group_statistics[category][2] for category in categories]).reshape(len(categories), -1)
+
+    def _normalizes(self):
+        # Streamed ingest keeps no abundance values to normalize
+        return bool(self.normalization_steps) and self.presence is None
+
+    def _fills_zeros(self):
+        """
+        Whether a normalization step (CLR, standardization) fills in the zeros,
+        so the presence no longer follows from the normalized values.
+        """
+        return self._normalizes() and (Normalization.presence_steps(self.normalization_steps)
+                                       != tuple(self.normalization_steps))
+
+    def get_presence_abundance(self):
+        """
+        Returns the abundance whose nonzero values are the presence of the
+        features, for the prevalence and the binarized searches: the
+        normalized abundance, or when a step fills in the zeros the abundance
+        after the steps before it (the input abundance if there are none).
+        """
+        if not self._fills_zeros():
+            return self.get_normalized_abundance()
+        steps = Normalization.presence_steps(self.normalization_steps)
+        if not steps:
+            if self._abundance_store() is not None:
+                return self._abundance_store()
+            return self.input_abundance_dataframe
+        _, abundance = self.preprocessing_pipeline.run(
+            self.dataset_key(), 'normalize', steps, lambda: self._normalize(steps))
+        return abundance
+
+    def get_normalized_abundance(self):
+        """
+        Returns the abundance after `normalization_steps`: a float32 DataFrame,
+        or a SparseAbundance while the steps keep it sparse. Without steps (or
+        with streamed ingest, which keeps presence only) it is the input
+        abundance store or DataFrame. The result is a memoized stage.
+        """
+        if not self._normalizes():
+            if self._abundance_store() is not None:
+                return self._abundance_store()
+            return self.input_abundance_dataframe
+        key = self._abundance_key()
+        if self._normalized_abundance[0] != key:
+            _, normalized = self.preprocessing_pipeline.run(
+                self.dataset_key(), 'normalize', self.normalization_steps, self._normalize)
+            self._normalized_abundance = (key, normalized)
+        return self._normalized_abundance[1]
+
+    def _normalize(self, steps=None):
+        """
+        Applies the normalization `steps` (all of `normalization_steps` when
+        None) to one float32 copy of the abundance.
+        """
+        if steps is None:
+            steps = self.normalization_steps
+        if self.sparse_abundance is not None:
+            if isinstance(self.sparse_abundance, BiomTable):
+                source = self.sparse_abundance.subset(self.sparse_abundance.feature_names)
+                matrix = source.matrix
+            else:
+                source = self.sparse_abundance
+                matrix = source.matrix.astype(np.float32, copy=True)
+            feature_names, sample_index = source.feature_names, source.sample_index
+        else:
+            matrix = self.input_abundance_dataframe.to_numpy(dtype=np.float32, copy=True)
+            feature_names, sample_index = self.input_abundance_dataframe.columns, self.input_abundance_dataframe.index
+        normalized = Normalization.apply(matrix, steps)
+        if sparse.issparse(normalized):
+            return SparseAbundance(normalized, feature_names, sample_index)
+        return pd.DataFrame(normalized, index=sample_index, columns=feature_names, copy=False)
+
+    def category_statistics(self, output_column):
+        """
+        Returns {category: (mean abundance, prevalence)} of every group of
+        `output_column`, both as Series over the abundance features.
+        """
+        return self.preprocessing_engine(output_column).category_statistics()
+
+    def select_preprocessed_features(self, feature_list):
+        """
+        Keeps only `feature_list` in the preprocessed abundance (or presence).
+        The selection is a preprocessing stage keyed by the features, so
+        selecting the same features again reuses it and its binarized presence.
+        """
+        features_digest = hashlib.blake2b("\0".join(map(str, feature_list)).encode(), digest_size=16).hexdigest()
+        selection_key, selection = self.preprocessing_pipeline.run(
+            self._abundance_key(), 'select', (features_digest,), lambda: self._select_features(feature_list))
+        self.feature_list_after_preprocessing = feature_list
+        self.preprocessed_presence, self.preprocessed_sparse_abundance, df = selection
+        self.set_preprocessed_abundance_dataframe(df)
+        self._selection_key = selection_key
+        return self.preprocessed_abundance_dataframe
+
+    def _select_features(self, feature_list):
+        """
+        Returns the (presence, sparse abundance, DataFrame) subset of
+        `feature_list` of the (normalized) abundance.
+        """
+        if self.presence is not None:
+            return self.presence.subset(feature_list), None, None
+        abundance = self.get_normalized_abundance()
+        if isinstance(abundance, pd.DataFrame):
+            return None, None, abundance[feature_list]
+        return None, abundance.subset(feature_list), None
+
+    def _labels_read_as_abundance(self, labels):
+        """
+        The `labels` columns that a typed, streamed or sparse read sniffed as
+        numeric and stored as float32 abundance (a 0/1 condition or a study id).
+        """
+        store = self._abundance_store()
+        stored_features = set(store.feature_names) if isinstance(store, (PresenceMatrix, SparseAbundance)) else set()
+        return [
+            col for col in labels
+            if col in stored_features
+            or (col in self.input_dataframe.columns and self.input_dataframe[col].dtype == np.float32)
+        ]
+
+    def metadata_columns_for_labels(self, labels):
+        """
+        Returns the metadata columns to read the file again with (read_file)
+        so that the `labels` columns are parsed as metadata, or None when they
+        already are.
+        """
+        numeric_labels = self._labels_read_as_abundance(labels)
+        if not numeric_labels:
+            return None
+        metadata_columns = [col for col in self.input_dataframe.columns
+                            if col not in numeric_labels and self.input_dataframe[col].dtype != np.float32]
+        return metadata_columns + numeric_labels
+
+    @staticmethod
+    def parse_output_columns(output_cols_text):
+        return [col.strip() for col in output_cols_text.split(',')]
 
     def check_before_moving_to_preprocessing(self, output_cols_text):
-        output_cols = [col.strip() for col in output_cols_text.split(',')]
+        output_cols = self.parse_output_columns(output_cols_text)
+        if self._labels_read_as_abundance(output_cols):
+            return False, "The label columns were read as abundance, read the file again with them as metadata!"
         if not set(output_cols).issubset(self.input_dataframe.columns):
             # self.error_label.setText("Columns are not in the dataframe!")
             # self.error_label.setVisible(True)
@@ -59,6 +979,9 @@ class DataFile:
         return True, ""
 
     def set_preprocessed_abundance_dataframe(self, df=None):
+        self._presence_view = None
+        self._species_classes = {}
+        self._selection_key = None
         if df is None:
             self.preprocessed_abundance_dataframe = self.input_abundance_dataframe
         else:
@@ -80,8 +1003,22 @@ class DataFile:
         return self.input_metadata_dataframe[self.output_labels]
 
     def reset_the_processed_feature_list(self):
-        self.feature_list_after_preprocessing = sorted(self.input_abundance_dataframe.columns.to_list())
-        self.set_preprocessed_abundance_dataframe()
+        abundance = self.get_normalized_abundance()
+        if self.presence is not None:
+            self.feature_list_after_preprocessing = sorted(self.presence.feature_names)
+            self.preprocessed_presence = self.presence
+            self.set_preprocessed_abundance_dataframe()
+        elif isinstance(abundance, pd.DataFrame):
+            self.feature_list_after_preprocessing = sorted(abundance.columns.to_list())
+            self.preprocessed_sparse_abundance = None
+            self.set_preprocessed_abundance_dataframe(abundance)
+        else:
+            self.feature_list_after_preprocessing = sorted(abundance.feature_names)
+            self.preprocessed_sparse_abundance = abundance
+            self.set_preprocessed_abundance_dataframe()
+        # All features need no selection output, only the downstream stages are kept
+        if self._abundance_key() is not None:
+            self._selection_key = self.preprocessing_pipeline.stage_key(self._abundance_key(), 'select', ('all',))
 
     def set_output_labels(self, labels_list):
         """
@@ -98,10 +1035,14 @@ class DataFile:
 
         # Drop the output label columns from the abundance DataFrame
         # and keep only those labels for metadata.
-        self.input_abundance_dataframe = self.input_dataframe.drop(columns=self.output_labels)
+        if self._abundance_store() is not None:
+            # Streamed and sparse imports keep the abundance outside of the DataFrame
+            self.input_abundance_dataframe = pd.DataFrame(index=self.input_dataframe.index)
+        else:
+            self.input_abundance_dataframe = self.input_dataframe.drop(columns=self.output_labels)
         self.input_metadata_dataframe = self.input_dataframe[self.output_labels]
         # set the groups of the output label column
-        self.output_label_groups = self.input_dataframe[self.output_labels[0]].unique()  # We are considering only one
+        self.output_label_groups = pd.unique(self.input_dataframe[self.output_labels[0]].to_numpy())  # We are considering only one
         self.reset_the_processed_feature_list()
         # output column
 
@@ -130,7 +1071,8 @@ class DataFile:
         for col in self.output_labels:
             # Use is_categorical_dtype to check if the column is categorical
             try:
-                self.input_dataframe[col] = self.input_dataframe[col].astype('category')
+                if not isinstance(self.input_dataframe[col].dtype, CategoricalDtype):
+                    self.input_dataframe[col] = self.input_dataframe[col].astype('category')
             except Exception as e:
                 print("Columns can not be converted to categorical values!")
                 return False, "Columns can not be converted to categorical values!"
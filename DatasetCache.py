@@ -0,0 +1,209 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+
+class DatasetCache:
+    """
+    A local binary cache of imported datasets.
+
+    The numeric (abundance) columns of a parsed file are stored as a single
+    .npy block that is memory-mapped on later loads; the index and the other
+    (metadata) columns are stored in a small pickle. Entries are keyed by a
+    content hash of the source file and the parse settings. A manifest maps
+    every source path to its size, mtime and content hash, so an unchanged file
+    is never re-hashed, and a changed file is detected as stale, re-hashed and
+    its old entry rebuilt.
+
+    The manifest also records the size and last use of every entry; the least
+    recently used entries are removed once the cache exceeds `max_bytes`, and
+    a dataset larger than `max_bytes` is not cached.
+
+    Parameters
+    ----------
+    cache_directory : str
+        Directory holding the manifest and one sub-directory per entry.
+    max_bytes : int
+        Disk bound of the cached entries.
+    """
+
+    manifest_file_name = "manifest.json"
+    hash_chunk_bytes = 8 * 1024 * 1024
+    max_bytes = 4 * 1024 * 1024 * 1024
+
+    def __init__(self, cache_directory=None, max_bytes=None):
+        if cache_directory is None:
+            cache_directory = os.path.join(os.path.expanduser("~"), ".searchmi", "cache")
+        self.cache_directory = cache_directory
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    def _manifest_path(self):
+        return os.path.join(self.cache_directory, self.manifest_file_name)
+
+    def _read_manifest(self):
+        """
+        Returns the manifest, {'files': {path: size, mtime and hash},
+        'entries': {key: size and last use}}.
+        """
+        try:
+            with open(self._manifest_path(), 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            manifest = {}
+        if 'files' not in manifest:
+            # A manifest of the source files only, from before the size bound:
+            # the entries on disk are taken as last used when they were written
+            entries = {}
+            if os.path.isdir(self.cache_directory):
+                for entry in os.scandir(self.cache_directory):
+                    if entry.is_dir() and not entry.name.startswith('tmp'):
+                        entries[entry.name] = {'bytes': self._directory_bytes(entry.path),
+                                               'last_used': entry.stat().st_mtime}
+            manifest = {'files': manifest, 'entries': entries}
+        return manifest
+
+    def _write_manifest(self, manifest):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        with open(self._manifest_path(), 'w') as f:
+            json.dump(manifest, f)
+
+    @classmethod
+    def content_hash(cls, file_path, open_file=None):
+        """
+        Hashes the content of a file, opened with `open_file(file_path)` (a
+        binary file; `open` when None) so that the caller can track the read.
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        with (open(file_path, 'rb') if open_file is None else open_file(file_path)) as f:
+            for chunk in iter(lambda: f.read(cls.hash_chunk_bytes), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def fingerprint(self, file_path, settings="", open_file=None):
+        """
+        Returns the cache key of a file. The content is only hashed again, read
+        with `open_file`, when the size or mtime of the file changed since it
+        was last seen; the entry of the previous content is then removed.
+        """
+        file_path = os.path.abspath(file_path)
+        stat = os.stat(file_path)
+        manifest = self._read_manifest()
+        files = manifest['files']
+        known = files.get(file_path)
+
+        if known and known['size'] == stat.st_size and known['mtime_ns'] == stat.st_mtime_ns:
+            content_hash = known['hash']
+        else:
+            content_hash = self.content_hash(file_path, open_file)
+            if known and known['hash'] != content_hash and not any(
+                    entry['hash'] == known['hash'] for path, entry in files.items() if path != file_path):
+                # The file changed and no other file has its old content, the old entries are stale
+                self._remove_entries(known['hash'], manifest)
+            files[file_path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': content_hash}
+            self._write_manifest(manifest)
+
+        return f"{content_hash}-{settings}" if settings else content_hash
+
+    def _entry_directory(self, key):
+        return os.path.join(self.cache_directory, key)
+
+    def _remove_entries(self, content_hash, manifest):
+        if not os.path.isdir(self.cache_directory):
+            return
+        for name in os.listdir(self.cache_directory):
+            if name.startswith(content_hash):
+                shutil.rmtree(os.path.join(self.cache_directory, name), ignore_errors=True)
+                manifest['entries'].pop(name, None)
+
+    @staticmethod
+    def _directory_bytes(directory):
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _evict(self, manifest, keep=None):
+        """
+        Removes the least recently used entries, except `keep`, until the
+        entries fit in `max_bytes`.
+        """
+        entries = manifest['entries']
+        total_bytes = sum(entry['bytes'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['last_used']):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._entry_directory(key), ignore_errors=True)
+            total_bytes -= entries.pop(key)['bytes']
+
+    def load(self, key):
+        """
+        Loads a cached DataFrame, with the numeric block memory-mapped read-only.
+        Returns None when there is no (complete) entry for the key.
+        """
+        entry_directory = self._entry_directory(key)
+        try:
+            frame_info = pd.read_pickle(os.path.join(entry_directory, "frame.pkl"))
+            values = None
+            if frame_info['numeric_columns']:
+                values = np.load(os.path.join(entry_directory, "numeric.npy"), mmap_mode='r')
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        manifest = self._read_manifest()
+        if key not in manifest['entries']:
+            manifest['entries'][key] = {'bytes': self._directory_bytes(entry_directory)}
+        manifest['entries'][key]['last_used'] = time.time()
+        self._write_manifest(manifest)
+
+        other_columns = frame_info['other_columns']
+        df = pd.DataFrame(values, index=other_columns.index, columns=frame_info['numeric_columns'], copy=False)
+        for col in other_columns.columns:
+            df.insert(frame_info['columns'].index(col), col, other_columns[col])
+        return df
+
+    def store(self, key, df):
+        """
+        Writes a DataFrame into the cache. The numeric columns are stored as one
+        block when they share a dtype; otherwise the whole frame is pickled.
+        The least recently used entries are then removed to stay in `max_bytes`.
+        """
+        if int(df.memory_usage(index=True).sum()) > self.max_bytes:
+            # Would evict everything else, and itself on the next store
+            return
+        numeric_df = df.select_dtypes('number')
+        numeric_columns = list(numeric_df.columns)
+        if len(set(numeric_df.dtypes)) > 1:
+            numeric_columns = []
+
+        os.makedirs(self.cache_directory, exist_ok=True)
+        temporary_directory = tempfile.mkdtemp(dir=self.cache_directory)
+        try:
+            if numeric_columns:
+                np.save(os.path.join(temporary_directory, "numeric.npy"), numeric_df.to_numpy())
+            frame_info = {
+                'columns': list(df.columns),
+                'numeric_columns': numeric_columns,
+                'other_columns': df.drop(columns=numeric_columns),
+            }
+            pd.to_pickle(frame_info, os.path.join(temporary_directory, "frame.pkl"))
+
+            entry_directory = self._entry_directory(key)
+            shutil.rmtree(entry_directory, ignore_errors=True)
+            os.replace(temporary_directory, entry_directory)
+
+            manifest = self._read_manifest()
+            manifest['entries'][key] = {'bytes': self._directory_bytes(entry_directory), 'last_used': time.time()}
+            self._evict(manifest, keep=key)
+            self._write_manifest(manifest)
+        except OSError as e:
+            print("Could not write the dataset cache:", e)
+            shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.cache_directory, ignore_errors=True)
@@ -1,8 +1,9 @@
+import math
 import random
 import pickle
-from concurrent.futures import ThreadPoolExecutor
-from scipy.stats import mannwhitneyu, ttest_ind, f_oneway, kruskal
-import pandas as pd
+
+from CostEngine import CostEngine
+from SurrogateModel import SurrogateModel
 
 
 class GeneticAlgorithm:
@@ -16,18 +17,36 @@ class GeneticAlgorithm:
         Full abundance data with species as columns.
     search_abundance : pd.DataFrame
         Abundance data (subset or same as `abundance_data`) used for evaluation.
+    search_presence : PresenceMatrix
+        Packed presence bits used instead of `search_abundance` for streamed imports.
     metadata : pd.DataFrame
         Metadata including 'study_condition' column.
     search_disease : str
         Disease label to compare against 'control' in metadata.
     soi_list : list of str
         Species of interest (subset of columns in abundance_data).
+    species_classes : dict
+        {species: species with the same presence}, when `soi_list` holds one
+        representative per presence class; results are expanded to the classes.
     pop_size : int
         Size of the initial population in the GA.
     num_generations : int
         Number of generations to run the GA.
     num_parents : int
         Number of parents to be selected in each generation.
+    memetic_mode : bool
+        If True, the elites are polished with single-flip hill climbing.
+    memetic_interval : int
+        Polish the elites every `memetic_interval` generations.
+    memetic_rounds : int
+        Maximum hill climbing rounds per elite in one polishing step.
+    surrogate_mode : bool
+        If True, 1 / `surrogate_fraction` times the offspring needed are bred
+        and pre-screened with a surrogate model, and only the most promising
+        ones, enough to fill the population, are evaluated exactly.
+    surrogate_fraction : float
+        Share of the bred offspring that is evaluated, at least
+        `min_surrogate_fraction` so the breeding stays bounded.
     checkpoint_file : str
         Name of the file used to save/reload checkpoints.
     random_seed : int
@@ -38,16 +57,18 @@ class GeneticAlgorithm:
             self
     ):
         self.search_abundance = None
+        self.search_presence = None
         self.metadata = None
         # self.search_disease = search_disease
         self.positive_label = None
         self.soi_list = None
+        self.species_classes = None
         self.output_column = None
 
         self.pop_size = 300
         self.num_generations = 125
         self.num_parents = 50
-        self.objective_function = "Mann-Whitney"
+        self.objective_function = "Mann-Whitney U-test"
         self.hypothesis_selection = 'two-sided'
         self.signature_type = 'positive'
         self.output_label_categories = None
@@ -58,6 +79,14 @@ class GeneticAlgorithm:
         self.stop_strategy = True
         self.improvement_patience = 10
         self.random_seed = 42
+        self.memetic_mode = False
+        self.memetic_interval = 5
+        self.memetic_rounds = 3
+        self.surrogate_mode = False
+        self.surrogate_fraction = 0.3
+        self.min_surrogate_fraction = 0.01
+        self.surrogate = SurrogateModel()
+        self.cost_engine = CostEngine()
 
         self._cost_cache = {}
         self.current_population = []
@@ -67,6 +96,9 @@ class GeneticAlgorithm:
         self.no_improvement_counter = 0
         self.current_generation = -1
         self.tracking_generations = {}
+        self.memetic_evaluations = 0
+        self.surrogate_saved_evaluations = 0
+        self._surrogate_predictions = {}
         random.seed(42)
 
     def reinit_ga_data(self):
@@ -78,99 +110,27 @@ class GeneticAlgorithm:
         self.no_improvement_counter = 0
         self.current_generation = -1
         self.tracking_generations = {}
+        self.memetic_evaluations = 0
+        self.surrogate_saved_evaluations = 0
+        self._surrogate_predictions = {}
+        self.surrogate.reset()
 
     def set_random_seed(self):
         pass
         # random.seed(self.random_seed)
 
-    def _t_test_cost_function(self, GroupA_data, GroupB_data):
-        # Welch's T-test
-        if self.hypothesis_selection == 'one-sided':
-            if self.signature_type == 'positive':
-                stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='greater')
-            else:
-                stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='less')
-            return p_value
-        elif self.hypothesis_selection == 'two-sided':
-            stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='two-sided')
-            return p_value
-
-    def _mann_whitney_u_test(self, GroupA_data, GroupB_data):
-        if self.hypothesis_selection == 'one-sided':
-            if self.signature_type == 'positive':
-                stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='greater')
-            else:
-                stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='less')
-            return p_value
-
-        elif self.hypothesis_selection == 'two-sided':
-            stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='two-sided')
-            return p_value
-
-    def _calculate_cost_two_groups(self, species_list):
-        """
-        Calculates the p-value for the Mann-Whitney U test for the given set
-        of species, comparing disease vs control.
-        """
-        if not species_list:
-            # If no species selected, return a high p-value so that this solution
-            # is less likely to be considered the best.
-            return 1.0
-
-        current_abundance_df = self.search_abundance[species_list]
-        richness_df = current_abundance_df.apply(lambda x: x.sum(), axis=1)
-        data = pd.concat([richness_df.rename('richness'), self.metadata], axis=1)
-
-        if self.hypothesis_selection == 'one-sided':
-            positive_label = self.positive_label
-        else:
-            positive_label = self.output_label_categories[0]
-
-        GroupA_data = data[data[self.output_column] == positive_label]['richness']
-        GroupB_data = data[data[self.output_column] != positive_label]['richness']
-
-        if self.objective_function == 'Mann-Whitney U-test':
-            p_val = self._mann_whitney_u_test(GroupA_data=GroupA_data, GroupB_data=GroupB_data)
-            return p_val
-
-        if self.objective_function == "Welch's T-test":
-            p_val = self._t_test_cost_function(GroupA_data=GroupA_data, GroupB_data=GroupB_data)
-            return p_val
-
-    def _calculate_cost_three_groups(self, species_list):
-        """
-        Calculates the p-value for the Mann-Whitney U test for the given set
-        of species, comparing disease vs control.
-        """
-        if not species_list:
-            # If no species selected, return a high p-value so that this solution
-            # is less likely to be considered the best.
-            return 1.0
-
-        current_abundance_df = self.search_abundance[species_list]
-        richness_df = current_abundance_df.apply(lambda x: x.sum(), axis=1)
-        data = pd.concat([richness_df.rename('richness'), self.metadata], axis=1)
-
-        GroupA_data = data[data[self.output_column] == self.output_label_categories[0]]['richness']
-        GroupB_data = data[data[self.output_column] == self.output_label_categories[1]]['richness']
-        GroupC_data = data[data[self.output_column] == self.output_label_categories[2]]['richness']
-
-        if self.objective_function == "One Way-ANOVA":
-            _, p_value = f_oneway(GroupA_data, GroupB_data, GroupC_data)
-            return p_value
-
-        if self.objective_function == "Kruskal-Wallis H-test":
-            _, p_val = kruskal(GroupA_data, GroupB_data, GroupC_data)
-            return p_val
-
     def get_species_name(self, best_solution):
         """
         Given a binary combination list, returns the names of species selected (1s).
+        A species standing for a presence class is expanded to the whole class.
         """
         selected_species = []
         for i, bit in enumerate(best_solution):
             if bit == 1:
-                selected_species.append(self.soi_list[i])
+                if self.species_classes:
+                    selected_species.extend(self.species_classes[self.soi_list[i]])
+                else:
+                    selected_species.append(self.soi_list[i])
         return selected_species
 
     def _evaluate(self, combination):
@@ -181,22 +141,54 @@ class GeneticAlgorithm:
         if combination_key in self._cost_cache:
             return self._cost_cache[combination_key]
 
-        # Extract the selected species
-        combination_species = [
-            self.soi_list[i]
-            for i, bit in enumerate(combination)
-            if bit == 1
-        ]
+        p_val = float(self.cost_engine.evaluate_batch([combination])[0])
+        self._cost_cache[combination_key] = p_val
+        return p_val
+
+    def _evaluate_batch(self, combinations):
+        """
+        Evaluates a batch of combinations, the ones not in the cache are scored
+        together in a single cost engine call.
+        """
+        missing = {}
+        for combination in combinations:
+            combination_key = tuple(combination)
+            if combination_key not in self._cost_cache:
+                missing[combination_key] = combination
+        if missing:
+            p_values = self.cost_engine.evaluate_batch(list(missing.values()))
+            for combination_key, p_val in zip(missing, p_values):
+                self._cost_cache[combination_key] = float(p_val)
+        return [self._cost_cache[tuple(combination)] for combination in combinations]
+
+    def _polish_elites(self, elites):
+        """
+        Memetic step: batched single-flip hill climbing on each elite.
 
-        # Compute the p-value for two groups
-        if len(self.output_label_categories) == 2:
-            p_val = self._calculate_cost_two_groups(combination_species)
-            self._cost_cache[combination_key] = p_val
-            return p_val
-        elif len(self.output_label_categories) == 3:
-            p_val = self._calculate_cost_three_groups(combination_species)
-            self._cost_cache[combination_key] = p_val
-            return p_val
+        In every round all single-flip neighbours of an elite are scored in one
+        batch and the elite moves to the best neighbour if it lowers the p-value.
+        Returns the polished elites and the number of new cost evaluations used.
+        """
+        evaluated_before = len(self._cost_cache)
+        polished = []
+        for elite in elites:
+            current = list(elite)
+            current_score = self._evaluate(current)
+            for _ in range(self.memetic_rounds):
+                neighbours = []
+                for i in range(len(current)):
+                    neighbour = current.copy()
+                    neighbour[i] = 1 - neighbour[i]
+                    neighbours.append(neighbour)
+                scores = self._evaluate_batch(neighbours)
+                best_score = min(scores)
+                if not best_score < current_score:
+                    # Local optimum reached
+                    break
+                current = neighbours[scores.index(best_score)]
+                current_score = best_score
+            polished.append(current)
+        return polished, len(self._cost_cache) - evaluated_before
 
     def _create_population(self, pop_size, num_items):
         """
@@ -243,6 +235,39 @@ class GeneticAlgorithm:
             child[mutation_point] = 1 - child[mutation_point]
         return offspring
 
+    def _update_surrogate(self, new_genomes):
+        """
+        Feeds newly evaluated genomes to the surrogate and scores the predictions
+        made for them when they were screened.
+        Returns the mean absolute error and rank correlation of those predictions.
+        """
+        p_values = [self._cost_cache[tuple(genome)] for genome in new_genomes]
+        self.surrogate.update(new_genomes, p_values)
+
+        predicted, actual = [], []
+        for genome, p_val in zip(new_genomes, p_values):
+            key = tuple(genome)
+            if key in self._surrogate_predictions:
+                predicted.append(self._surrogate_predictions[key])
+                actual.append(p_val)
+        self._surrogate_predictions = {}
+        return SurrogateModel.accuracy(predicted, actual)
+
+    def _screen_offspring(self, offspring, keep_count):
+        """
+        Keeps the `keep_count` offspring with the best predicted fitness, the
+        rest are discarded without an exact evaluation.
+        Returns the kept offspring and the number of evaluations saved.
+        """
+        predicted = self.surrogate.predict(offspring)
+        order = sorted(range(len(offspring)), key=lambda i: predicted[i], reverse=True)
+
+        kept = [offspring[i] for i in order[:keep_count]]
+        for i in order[:keep_count]:
+            self._surrogate_predictions[tuple(offspring[i])] = predicted[i]
+        saved = len({tuple(offspring[i]) for i in order[keep_count:]} - set(self._cost_cache))
+        return kept, saved
+
     def _save_checkpoint(self, state, filename=None):
         """
         Saves current state (population, generation, etc.) to a pickle file.
@@ -269,6 +294,7 @@ class GeneticAlgorithm:
         self.current_generation += 1
 
         if self.current_generation == 0:
+            self.cost_engine.configure(self)
             self.current_population = [[1 for _ in range(num_items)]]
             # self.tracking_generations[self.current_generation] = {}
 
@@ -278,8 +304,18 @@ class GeneticAlgorithm:
         elif self.next_population is not None and self.current_generation > 1:
             self.current_population = self.next_population
 
-        with ThreadPoolExecutor() as executor:
-            fitness = list(executor.map(self._evaluate, self.current_population))
+        new_genomes = list({
+            tuple(combination): combination
+            for combination in self.current_population
+            if tuple(combination) not in self._cost_cache
+        }.values())
+
+        fitness = self._evaluate_batch(self.current_population)
+        evaluated_so_far = len(self._cost_cache)
+
+        surrogate_error, surrogate_correlation = float('nan'), float('nan')
+        if self.surrogate_mode and new_genomes:
+            surrogate_error, surrogate_correlation = self._update_surrogate(new_genomes)
 
         this_pop_best_score = min(fitness)
         this_pop_best_score_idx = fitness.index(this_pop_best_score)
@@ -288,7 +324,12 @@ class GeneticAlgorithm:
             #'population': self.current_population,
             'best_score': this_pop_best_score,
             'best_score_idx': this_pop_best_score_idx,
-            'best_solution': this_pop_best_solution
+            'best_solution': this_pop_best_solution,
+            'evaluations': evaluated_so_far,
+            'memetic_evaluations': 0,
+            'surrogate_saved_evaluations': 0,
+            'surrogate_error': surrogate_error,
+            'surrogate_correlation': surrogate_correlation
         }
 
         if this_pop_best_score < self.current_best_score:
@@ -300,8 +341,24 @@ class GeneticAlgorithm:
 
         if self.current_generation >= 1:
             elites, parents = self._select_parents(self.current_population, fitness, self.num_parents)
+            # Memetic polishing of the elites
+            if self.memetic_mode and self.current_generation % self.memetic_interval == 0:
+                elites, polishing_evaluations = self._polish_elites(elites)
+                self.memetic_evaluations += polishing_evaluations
+                self.tracking_generations[self.current_generation]['memetic_evaluations'] = polishing_evaluations
+            offspring_size = self.pop_size - self.num_parents
+            screening = self.surrogate_mode and self.surrogate.is_ready()
+            if screening:
+                # Breed 1 / surrogate_fraction times the offspring needed so the
+                # screened offspring still fill the population
+                offspring_size = math.ceil(offspring_size / max(self.surrogate_fraction, self.min_surrogate_fraction))
             # Crossover
-            offspring = self._crossover(parents, self.pop_size - self.num_parents)
+            offspring = self._crossover(parents, offspring_size)
             # Mutation
             offspring = self._mutate(offspring)
+            # Surrogate pre-screening of the offspring
+            if screening:
+                offspring, saved_evaluations = self._screen_offspring(offspring, self.pop_size - self.num_parents)
+                self.surrogate_saved_evaluations += saved_evaluations
+                self.tracking_generations[self.current_generation]['surrogate_saved_evaluations'] = saved_evaluations
             self.next_population = elites + parents + offspring
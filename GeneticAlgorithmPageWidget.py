@@ -1,24 +1,38 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout, QSizePolicy, QProgressBar, \
-    QListWidget, QFileDialog
+    QListWidget, QListView, QFileDialog
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, pyqtSlot, QObject, QTimer
 
 import DataProcessing
 from GeneticAlgorithm import GeneticAlgorithm
+from ConvergencePlotWidget import ConvergencePlotWidget
 from ResultVisualisationWidget import GroupedBarPlotPopUp
+from SearchHistoryModel import SearchHistoryModel
 from utils import create_search_result_track_output_genetic_algorithm
 import random
+import time
 
 
 class SearchWorker(QObject):
-    signal_to_update_progress = pyqtSignal(int, int, float, list, bool)
+    """
+    Runs the search in the worker thread. Every timer tick runs iterations for
+    up to `frame_interval` seconds and reports them in one progress signal, so
+    the page is updated at a fixed frame rate however fast the iterations are.
+    The signal carries the (generation, cost, species count, best score so far)
+    of every iteration of the tick, and the best solution only when it changed
+    since the last report (None otherwise).
+    """
+    signal_to_update_progress = pyqtSignal(int, list, object, bool)
     signal_to_pause_search = pyqtSignal()
     signal_to_stop_search = pyqtSignal(str)
 
+    frame_interval = 1 / 30
+
     def __init__(self, ga_data):
         super().__init__()
         self.ga_data = ga_data
         self.search_running = False
         self.timer = None  # Initialize timer as None
+        self.shown_solution = None
 
     @pyqtSlot()
     def init_timer(self):
@@ -57,33 +71,43 @@ class SearchWorker(QObject):
         self.signal_to_stop_search.emit("stop_pressed")
 
     def process_iteration(self):
-        """Process a single iteration of the genetic algorithm."""
+        """Run iterations of the search for one frame and report their progress."""
         if not self.search_running:
             return  # Do nothing if paused
 
-        # Run one iteration
-        self.ga_data.run_one_iteration()
-        generation_no = self.ga_data.current_generation
-        cost_value = self.ga_data.tracking_generations[generation_no].get('best_score')
-        best_solution = self.ga_data.tracking_generations[generation_no].get('best_solution')
-
+        history = []
         should_break = False
-        if self.ga_data.stop_strategy:
-            if (self.ga_data.improvement_patience - self.ga_data.no_improvement_counter) == 0:
-                should_break = True
-
-        current_gen = self.ga_data.current_generation
+        frame_end = time.perf_counter() + self.frame_interval
+        while True:
+            self.ga_data.run_one_iteration()
+            generation_no = self.ga_data.current_generation
+            tracking = self.ga_data.tracking_generations[generation_no]
+            best_solution = tracking.get('best_solution')
+            history.append((generation_no, tracking.get('best_score'), len(best_solution),
+                            self.ga_data.current_best_score))
+
+            if self.ga_data.stop_strategy:
+                if (self.ga_data.improvement_patience - self.ga_data.no_improvement_counter) == 0:
+                    should_break = True
+            finished = generation_no >= self.ga_data.num_generations
+            if finished or should_break or time.perf_counter() >= frame_end:
+                break
+
+        # Only send the solution when the species list has to change
+        changed_solution = None
+        if best_solution != self.shown_solution:
+            self.shown_solution = list(best_solution)
+            changed_solution = self.shown_solution
 
         # Emit progress signal
         self.signal_to_update_progress.emit(
-            current_gen,
             generation_no,
-            cost_value,
-            best_solution,
+            history,
+            changed_solution,
             should_break
         )
 
-        if current_gen >= self.ga_data.num_generations:
+        if finished:
             self.timer.stop()
             self.signal_to_stop_search.emit("finished")
             return
@@ -97,6 +121,13 @@ class GeneticAlgorithmPageWidget(QWidget):
     signal_to_search_selection_page = pyqtSignal()
     signal_to_visualisation_page = pyqtSignal()
 
+    page_title = 'Genetic Algorithm'
+    generations_label_text = "Generations:"
+    default_export_file_name = "genetic_algorithm_result.xlsx"
+
+    # Rows shown in the cost history, None to show every generation
+    max_history_rows = 10000
+
     def __init__(self, data: DataProcessing.DataFile, ga_data: GeneticAlgorithm, parent=None):
         super().__init__(parent)
         self.search_running_thread = None
@@ -111,7 +142,7 @@ class GeneticAlgorithmPageWidget(QWidget):
         main_layout = QVBoxLayout(self)
 
         # Title label
-        title_label = QLabel('Genetic Algorithm')
+        title_label = QLabel(self.page_title)
         title_label.setAlignment(Qt.AlignLeft)
         title_font = title_label.font()
         title_font.setPointSize(10)
@@ -123,7 +154,7 @@ class GeneticAlgorithmPageWidget(QWidget):
         shape_layout = QHBoxLayout()
         input_shape_label = QLabel("Data Shape:")
         self.input_shape_value = QLabel(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x {self.data_file.preprocessed_abundance_dataframe.shape[1]} features")  # Example shape text
+            f"{self.data_file.get_preprocessed_shape()[0]} rows x {self.data_file.get_preprocessed_shape()[1]} features")  # Example shape text
         shape_layout.addWidget(input_shape_label)
         shape_layout.addWidget(self.input_shape_value)
         shape_layout.addStretch()  # Add stretch to push contents to left
@@ -135,11 +166,13 @@ class GeneticAlgorithmPageWidget(QWidget):
 
         # Row for Generations
         gen_layout = QHBoxLayout()
-        generations_label = QLabel("Generations:")
+        generations_label = QLabel(self.generations_label_text)
         self.current_gen_label = QLabel(f"0/{self.ga_data.num_generations}")  # Example current generations text
         gen_layout.addWidget(generations_label)
         gen_layout.addWidget(self.current_gen_label)
         gen_layout.addStretch()
+        self.evaluations_label = QLabel("")
+        gen_layout.addWidget(self.evaluations_label)
         main_layout.addLayout(gen_layout)
 
         # Progress Bar for generation progress
@@ -149,6 +182,12 @@ class GeneticAlgorithmPageWidget(QWidget):
         self.progress_bar.setValue(0)  # Example current progress
         main_layout.addWidget(self.progress_bar)
 
+        # Convergence of the search
+        self.convergence_plot = ConvergencePlotWidget(show_temperature=False,
+                                                      generations=self.ga_data.num_generations)
+        self.convergence_plot.setMinimumHeight(180)
+        main_layout.addWidget(self.convergence_plot)
+
         self.info_text_label = QLabel("")
         main_layout.addWidget(self.info_text_label)
 
@@ -161,7 +200,10 @@ class GeneticAlgorithmPageWidget(QWidget):
         cost_function_label.setAlignment(Qt.AlignLeft)
         left_panel_layout.addWidget(cost_function_label)
 
-        self.results_list = QListWidget()
+        self.results_model = SearchHistoryModel(max_rows=self.max_history_rows)
+        self.results_list = QListView()
+        self.results_list.setUniformItemSizes(True)
+        self.results_list.setModel(self.results_model)
         self.results_list.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         left_panel_layout.addWidget(self.results_list)
 
@@ -177,7 +219,7 @@ class GeneticAlgorithmPageWidget(QWidget):
         self.species_list.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         right_panel_layout.addWidget(self.species_list)
 
-        self.results_list.itemClicked.connect(self.updateSpeciesList)
+        self.results_list.clicked.connect(self.updateSpeciesList)
 
         parallel_layout.addLayout(right_panel_layout)
 
@@ -249,14 +291,16 @@ class GeneticAlgorithmPageWidget(QWidget):
         self.export_button.setEnabled(False)
         self.visualise_button.setEnabled(False)
         self.input_shape_value.setText(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x "
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[1]} features")
+            f"{self.data_file.get_preprocessed_shape()[0]} rows x "
+            f"{self.data_file.get_preprocessed_shape()[1]} features")
         self.current_gen_label.setText(f"0/{self.ga_data.num_generations}")
         self.progress_bar.setMinimum(0)
         self.progress_bar.setMaximum(self.ga_data.num_generations)
         self.progress_bar.setValue(0)
         self.info_text_label.setText("")
-        self.results_list.clear()
+        self.evaluations_label.setText("")
+        self.results_model.clear()
+        self.convergence_plot.clear(self.ga_data.num_generations)
         self.species_list.clear()
 
     def back_to_search_selection_page(self):
@@ -271,8 +315,8 @@ class GeneticAlgorithmPageWidget(QWidget):
 
     def visualise_result_page(self):
         popup = GroupedBarPlotPopUp(
-            df=self.ga_data.search_abundance,
-            metadata=self.data_file.input_metadata_dataframe,
+            df=self.ga_data.search_presence.to_frame(self.ga_data.current_best_solution),
+            metadata=self.ga_data.metadata,
             features=self.ga_data.current_best_solution,
             score=self.ga_data.current_best_score,
             group_labels=self.data_file.output_label_groups,
@@ -283,6 +327,7 @@ class GeneticAlgorithmPageWidget(QWidget):
 
     def stop_the_search(self, flag):
         """Handle the stop signal from the worker."""
+        self.convergence_plot.flush()
         if flag == "stop_pressed":
             self.info_text_label.setText(
                 "INFO: Search stopped")
@@ -316,29 +361,30 @@ class GeneticAlgorithmPageWidget(QWidget):
         if not self.search_running_thread.isRunning():
             self.search_running_thread.start()
 
-    def updateSpeciesList(self, item):
+    def updateSpeciesList(self, index):
         # Clear the current species list
         self.species_list.clear()
-        index = self.results_list.row(item)
-        reverse_index = abs(max(self.ga_data.tracking_generations.keys()) - index)
-        this_solution = self.ga_data.tracking_generations[reverse_index].get('best_solution')
-        for spp in this_solution:
-            self.species_list.addItem(spp)
+        generation_no = self.results_model.generation(index.row())
+        this_solution = self.ga_data.tracking_generations[generation_no].get('best_solution')
+        self.species_list.addItems(this_solution)
         self.species_list.scrollToTop()
 
-    def update_search_progress(self, i, generation_no, cost_value, best_solution, should_break):
-        """Update the UI with the latest search progress."""
+    def update_search_progress(self, i, history, best_solution, should_break):
+        """Update the UI with the progress of the iterations run since the last update."""
+        generation_no = history[-1][0]
+        self.results_model.append(history)
+        columns = list(zip(*history))
+        self.convergence_plot.append(columns[0], columns[3], columns[1])
         self.results_list.scrollToTop()
-        self.results_list.insertItem(0,
-                                     f"Generation: {generation_no} | P-value: {cost_value} | Total: {len(best_solution)}")
 
-        self.species_list.clear()
-        for sp in best_solution:
-            self.species_list.addItem(sp)
-        self.species_list.scrollToTop()
+        if best_solution is not None:
+            self.species_list.clear()
+            self.species_list.addItems(best_solution)
+            self.species_list.scrollToTop()
 
         self.current_gen_label.setText(f"{generation_no}/{self.ga_data.num_generations}")
         self.progress_bar.setValue(i + 1)
+        self.evaluations_label.setText(self.evaluations_text())
 
         # Update the Info label
         if should_break:
@@ -360,12 +406,29 @@ class GeneticAlgorithmPageWidget(QWidget):
         else:
             self.info_text_label.setText("INFO:")
 
+    def evaluations_text(self):
+        """
+        Cost evaluations spent by the elite polishing and saved by the surrogate
+        screening, with the surrogate accuracy, shown next to the progress.
+        """
+        if not (self.ga_data.memetic_mode or self.ga_data.surrogate_mode):
+            return ""
+        details = self.ga_data.tracking_generations.get(self.ga_data.current_generation, {})
+        text = f"Evaluations: {details.get('evaluations', 0)}"
+        if self.ga_data.memetic_mode:
+            text += f" | Elite polishing: {self.ga_data.memetic_evaluations}"
+        if self.ga_data.surrogate_mode:
+            text += (f" | Saved by surrogate: {self.ga_data.surrogate_saved_evaluations}"
+                     f" | Surrogate MAE: {details.get('surrogate_error', float('nan')):.3g}"
+                     f" | Spearman: {details.get('surrogate_correlation', float('nan')):.3g}")
+        return text
+
     def export_search_result(self):
         if not self.ga_data.tracking_generations:
             return
 
         options = QFileDialog.Options()
-        default_file_name = "genetic_algorithm_result.xlsx"
+        default_file_name = self.default_export_file_name
         file_path, _ = QFileDialog.getSaveFileName(
             self,
             "Save Excel File",
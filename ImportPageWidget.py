@@ -2,12 +2,43 @@ import sys
 
 from PyQt5 import QtWidgets
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, pyqtSlot, QObject
 
 import DataProcessing
 from mainwindow import PandasModel
 
 
+class FileLoadWorker(QObject):
+    signal_to_update_progress = pyqtSignal(int, int)
+    signal_to_finish_loading = pyqtSignal(bool, str)
+
+    def __init__(self, data_file: DataProcessing.DataFile, file_path, metadata_columns=None):
+        super().__init__()
+        self.data_file = data_file
+        self.file_path = file_path
+        self.metadata_columns = metadata_columns
+        self.last_percent = -1
+
+    def report_progress(self, bytes_read, total_bytes):
+        """Emit the progress only when the percentage changes, not for every read."""
+        percent = int(100 * bytes_read / total_bytes) if total_bytes else 100
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.signal_to_update_progress.emit(min(bytes_read, total_bytes), total_bytes)
+
+    @pyqtSlot()
+    def load_file(self):
+        """Read the file in the worker thread; the DataFrame stays on the DataFile."""
+        try:
+            self.data_file.read_file(file_path=self.file_path, metadata_columns=self.metadata_columns,
+                                     progress_callback=self.report_progress)
+            self.signal_to_finish_loading.emit(True, "")
+        except DataProcessing.ReadCancelled:
+            self.signal_to_finish_loading.emit(False, "")
+        except Exception as e:
+            self.signal_to_finish_loading.emit(False, str(e))
+
+
 class ImportPageWidget(QWidget):
     signal_to_preprocessing_page = pyqtSignal()
 
@@ -19,6 +50,10 @@ class ImportPageWidget(QWidget):
         super().__init__(parent)
 
         self.data_file = data  # Keep a reference to the shared data
+        self.file_load_thread = None
+        self.file_load_worker = None
+        # Go on to preprocessing once the file is read again with the labels as metadata
+        self.continue_after_loading = False
         self.init_ui()
 
     def init_ui(self):
@@ -35,7 +70,15 @@ class ImportPageWidget(QWidget):
 
         # 1) Button to import CSV
         self.import_btn = QtWidgets.QPushButton("Import CSV")
+        self.streaming_checkbox = QtWidgets.QCheckBox("Streaming import (presence only, for tables larger than memory)")
+        self.streaming_checkbox.setChecked(self.data_file.streaming_ingest)
+        self.sparse_checkbox = QtWidgets.QCheckBox("Sparse storage (memory scales with the nonzero values)")
+        self.sparse_checkbox.setChecked(self.data_file.sparse_storage)
         self.path_label = QtWidgets.QLabel("Location: path")
+        self.load_progress_bar = QtWidgets.QProgressBar()
+        self.load_progress_bar.setVisible(False)
+        self.cancel_load_btn = QtWidgets.QPushButton("Cancel")
+        self.cancel_load_btn.setVisible(False)
         self.table_view = QtWidgets.QTableView()
         output_columns_label = QtWidgets.QLabel("Metadata Columns (comma-separated):")
         self.output_columns_edit = QtWidgets.QLineEdit()
@@ -48,7 +91,13 @@ class ImportPageWidget(QWidget):
         self.next_btn = QtWidgets.QPushButton("Next")
 
         layout.addWidget(self.import_btn)
+        layout.addWidget(self.streaming_checkbox)
+        layout.addWidget(self.sparse_checkbox)
         layout.addWidget(self.path_label)
+        progress_layout = QtWidgets.QHBoxLayout()
+        progress_layout.addWidget(self.load_progress_bar)
+        progress_layout.addWidget(self.cancel_load_btn)
+        layout.addLayout(progress_layout)
         layout.addWidget(self.table_view)
         layout.addWidget(output_columns_label)
         layout.addWidget(self.output_columns_edit)
@@ -57,29 +106,98 @@ class ImportPageWidget(QWidget):
 
         self.import_btn.clicked.connect(self.import_csv)
         self.next_btn.clicked.connect(self.go_to_preprocessing_page)
+        self.cancel_load_btn.clicked.connect(self.cancel_loading)
 
     def import_csv(self):
         filename, _ = QtWidgets.QFileDialog.getOpenFileName(
             self,
-            "Select CSV or Excel file",
+            "Select CSV, TSV, Excel or BIOM file",
             "",
-            "CSV/Excel files (*.csv *.xlsx *.xls)"
+            "Data files (*.csv *.tsv *.csv.gz *.tsv.gz *.csv.zst *.tsv.zst *.xlsx *.xls *.biom *.h5)"
         )
         if filename:
+            self.load_file(filename)
+
+    def load_file(self, filename, metadata_columns=None):
+        """Read the file in a worker thread, so the window stays responsive while it loads."""
+        if self.file_load_thread is not None and self.file_load_thread.isRunning():
+            return
+        self.path_label.setText(f"Location: {filename} | Loading...")
+        self.data_file.streaming_ingest = self.streaming_checkbox.isChecked()
+        self.data_file.sparse_storage = self.sparse_checkbox.isChecked()
+        # Releases the model of the previous frame
+        self.table_view.setModel(None)
+
+        self.file_load_worker = FileLoadWorker(self.data_file, filename, metadata_columns)
+        self.file_load_thread = QThread()
+        self.file_load_worker.moveToThread(self.file_load_thread)
+        self.file_load_thread.started.connect(self.file_load_worker.load_file)
+        self.file_load_worker.signal_to_update_progress.connect(self.update_load_progress)
+        self.file_load_worker.signal_to_finish_loading.connect(self.finish_loading)
+
+        self.load_progress_bar.setValue(0)
+        self.load_progress_bar.setVisible(True)
+        self.cancel_load_btn.setVisible(True)
+        self.cancel_load_btn.setEnabled(True)
+        self.import_btn.setEnabled(False)
+        self.next_btn.setEnabled(False)
+        self.file_load_thread.start()
+
+    def update_load_progress(self, bytes_read, total_bytes):
+        self.load_progress_bar.setValue(int(100 * bytes_read / total_bytes) if total_bytes else 100)
+        self.load_progress_bar.setFormat(f"%p% ({bytes_read / 1e6:.1f} / {total_bytes / 1e6:.1f} MB)")
+
+    def cancel_loading(self):
+        """Ask the running read to stop, it is checked between the reads of the file."""
+        self.data_file.cancel_read()
+        self.cancel_load_btn.setEnabled(False)
+
+    def finish_loading(self, loaded, message):
+        self.file_load_thread.quit()
+        self.file_load_thread.wait()
+        self.file_load_thread = None
+        self.file_load_worker = None
+
+        self.load_progress_bar.setVisible(False)
+        self.cancel_load_btn.setVisible(False)
+        self.import_btn.setEnabled(True)
+        self.next_btn.setEnabled(True)
+        if not loaded:
+            self.continue_after_loading = False
+
+        filename = self.data_file.input_data_path
+        if loaded:
+            read_stats = self.data_file.last_read_stats
+            self.path_label.setText(
+                f"Location: {filename} | Parsed in {read_stats['seconds']:.2f} s "
+                f"({read_stats['parser']}), {read_stats['memory_bytes'] / 1e6:.1f} MB in memory")
+            # The parsed DataFrame is shown as is, it is not copied back from the worker
+            model = PandasModel(self.data_file.get_input_dataframe())
+            self.table_view.setModel(model)
+            if self.continue_after_loading:
+                self.continue_after_loading = False
+                self.go_to_preprocessing_page()
+        elif not message:
+            self.path_label.setText(f"Location: {filename} | Loading cancelled")
+        else:
             self.path_label.setText(f"Location: {filename}")
-            try:
-                self.data_file.read_file(file_path=filename)
-                model = PandasModel(self.data_file.get_input_dataframe())
-                self.table_view.setModel(model)
-            except Exception as e:
-                QtWidgets.QMessageBox.critical(
-                    self,
-                    "Error",
-                    f"Could not load CSV file:\n{e}"
-                )
+            QtWidgets.QMessageBox.critical(
+                self,
+                "Error",
+                f"Could not load CSV file:\n{message}"
+            )
 
     def go_to_preprocessing_page(self):
         output_cols_text = self.output_columns_edit.text()
+        metadata_columns = self.data_file.metadata_columns_for_labels(
+            self.data_file.parse_output_columns(output_cols_text))
+        if metadata_columns is not None:
+            # Numeric label columns were read as abundance: read the file again
+            # in the worker with them as metadata, then go on from finish_loading
+            self.error_label.setVisible(False)
+            self.continue_after_loading = True
+            self.load_file(self.data_file.input_data_path, metadata_columns=metadata_columns)
+            return
         flag, message = self.data_file.check_before_moving_to_preprocessing(output_cols_text)
         if not flag:
             self.error_label.setVisible(True)
@@ -0,0 +1,168 @@
+"""
+Kernels for the search loops that do not vectorize well.
+
+Numba is an optional dependency. When it is installed the kernels are
+JIT-compiled with ``cache=True``, so the compile cost is paid once and the
+compiled code is reused from disk (``__pycache__`` next to this file, or the
+directory in the NUMBA_CACHE_DIR environment variable). Without Numba, or
+after ``set_backend('numpy')``, the pure NumPy versions are used. The backend
+can be switched at any time to compare the two.
+"""
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+NUMBA_AVAILABLE = numba is not None
+_backend = 'numba' if NUMBA_AVAILABLE else 'numpy'
+
+
+def set_backend(name):
+    """
+    Selects the kernel backend, 'numba' or 'numpy'.
+    Returns False if Numba was requested but is not installed.
+    """
+    global _backend
+    if name not in ('numba', 'numpy'):
+        raise ValueError(f"Unknown kernel backend: {name}")
+    if name == 'numba' and not NUMBA_AVAILABLE:
+        _backend = 'numpy'
+        return False
+    _backend = name
+    return True
+
+
+def get_backend():
+    return _backend
+
+
+# ------- Rank sums with tie correction (Mann-Whitney U) ------- #
+
+def _rank_sum_ties_numpy(richness, first_group):
+    # Richness values are counts, so the average ranks come from a per-row
+    # histogram instead of a sort
+    values = richness.astype(np.int64)
+    n_rows = values.shape[0]
+    width = int(values.max()) + 1 if values.size else 1
+    offsets = (np.arange(n_rows) * width)[:, None]
+    counts = np.bincount((values + offsets).ravel(), minlength=n_rows * width).reshape(n_rows, width)
+
+    below = np.cumsum(counts, axis=1) - counts
+    average_ranks = below + (counts + 1) / 2.0
+    ranks = np.take_along_axis(average_ranks, values, axis=1)
+
+    rank_sum = ranks[:, first_group].sum(axis=1)
+    counts = counts.astype(np.float64)
+    tie_term = (counts ** 3 - counts).sum(axis=1)
+    return rank_sum, tie_term
+
+
+def _rank_sum_ties_loop(richness, first_group):
+    n_rows, n = richness.shape
+    rank_sum = np.zeros(n_rows)
+    tie_term = np.zeros(n_rows)
+    for row in range(n_rows):
+        order = np.argsort(richness[row], kind='mergesort')
+        values = richness[row][order]
+        i = 0
+        while i < n:
+            j = i
+            while j + 1 < n and values[j + 1] == values[i]:
+                j += 1
+            average_rank = (i + j) / 2.0 + 1.0
+            for k in range(i, j + 1):
+                if first_group[order[k]]:
+                    rank_sum[row] += average_rank
+            t = j - i + 1.0
+            tie_term[row] += t ** 3 - t
+            i = j + 1
+    return rank_sum, tie_term
+
+
+# ------- Richness from packed presence bits ------- #
+
+def _packed_richness_numpy(packed_genomes, packed_presence):
+    richness = np.zeros((len(packed_genomes), len(packed_presence)), dtype=np.int32)
+    # One word at a time keeps the temporaries at (genomes x samples)
+    for word in range(packed_presence.shape[1]):
+        richness += np.bitwise_count(packed_genomes[:, word, None] & packed_presence[None, :, word])
+    return richness.astype(np.float64)
+
+
+def _popcount64(x):
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+def _packed_richness_loop(packed_genomes, packed_presence):
+    n_genomes, n_words = packed_genomes.shape
+    n_samples = packed_presence.shape[0]
+    richness = np.zeros((n_genomes, n_samples))
+    for g in range(n_genomes):
+        for s in range(n_samples):
+            total = 0
+            for w in range(n_words):
+                total += popcount64(packed_genomes[g, w] & packed_presence[s, w])
+            richness[g, s] = total
+    return richness
+
+
+# ------- Incremental richness update of a single flip (simulated annealing) ------- #
+
+def _flip_update_numpy(richness, packed_presence, index, sign):
+    bits = (packed_presence[:, index // 64] >> np.uint64(index % 64)) & np.uint64(1)
+    return richness + sign * bits.astype(np.float64)
+
+
+def _flip_update_loop(richness, packed_presence, index, sign):
+    word = index // 64
+    shift = np.uint64(index % 64)
+    updated = richness.copy()
+    for s in range(packed_presence.shape[0]):
+        if (packed_presence[s, word] >> shift) & np.uint64(1):
+            updated[s] += sign
+    return updated
+
+
+if NUMBA_AVAILABLE:
+    popcount64 = numba.njit(cache=True, inline='always')(_popcount64)
+    _rank_sum_ties_compiled = numba.njit(cache=True, nogil=True)(_rank_sum_ties_loop)
+    _packed_richness_compiled = numba.njit(cache=True, nogil=True)(_packed_richness_loop)
+    _flip_update_compiled = numba.njit(cache=True, nogil=True)(_flip_update_loop)
+else:
+    popcount64 = _popcount64
+
+
+def rank_sum_ties(richness, first_group):
+    """
+    Rank sum of the `first_group` samples and the tie term sum(t^3 - t) for
+    every row of a (genomes x samples) richness array, ranking all samples
+    together with average ranks for ties.
+    """
+    if _backend == 'numba':
+        return _rank_sum_ties_compiled(np.ascontiguousarray(richness, dtype=np.float64),
+                                       np.ascontiguousarray(first_group, dtype=np.bool_))
+    return _rank_sum_ties_numpy(richness, first_group)
+
+
+def packed_richness(packed_genomes, packed_presence):
+    """
+    Richness (genomes x samples) of packed genomes over packed sample presence.
+    """
+    if _backend == 'numba':
+        return _packed_richness_compiled(packed_genomes, packed_presence)
+    return _packed_richness_numpy(packed_genomes, packed_presence)
+
+
+def flip_update(richness, packed_presence, index, sign):
+    """
+    Richness of every sample after flipping species `index` of a genome,
+    sign is +1 when the species is added and -1 when it is removed.
+    """
+    if _backend == 'numba':
+        return _flip_update_compiled(richness, packed_presence, index, float(sign))
+    return _flip_update_numpy(richness, packed_presence, index, sign)
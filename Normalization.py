@@ -0,0 +1,227 @@
+import numpy as np
+from scipy import sparse
+
+
+class Normalization:
+    """
+    Normalizations and transformations of an abundance matrix, samples as rows
+    and features as columns.
+
+    Every step works in place on one float32 matrix, so a chain of steps
+    needs a single working copy of the abundance. A CSC matrix stays sparse
+    through the steps that keep zeros at zero (relative abundance,
+    rarefaction), whose work then scales with the nonzero values; the steps
+    that fill in the zeros (CLR, standardization) make it dense once and
+    continue in place on the dense array. NaN values are ignored by the row
+    and column reductions and stay NaN; the reductions of a dense array run a
+    block of `block_cells` values at a time, so no temporary copy of the
+    whole matrix is made.
+
+    A chain of steps is a sequence of (name, params) tuples, applied in order
+    by `apply`, e.g. [('rarefy', (10000, 0)), ('relative_abundance', (100.0,))].
+    """
+
+    step_names = ('rarefy', 'relative_abundance', 'clr', 'standardize')
+    zero_filling_steps = ('clr', 'standardize')
+    block_cells = 1 << 22
+
+    @classmethod
+    def presence_steps(cls, steps):
+        """
+        Returns the steps of a chain before the first step that fills in the
+        zeros: their result has the zeros (absences) of the whole chain.
+        """
+        for i, (name, _) in enumerate(steps):
+            if name in cls.zero_filling_steps:
+                return tuple(steps[:i])
+        return tuple(steps)
+
+    @classmethod
+    def apply(cls, values, steps):
+        """
+        Applies the chain of `steps` to `values`, a float32 array or CSC
+        matrix that is modified in place. Returns the result, a dense array
+        once a step fills in the zeros.
+        """
+        for name, params in steps:
+            if name not in cls.step_names:
+                raise ValueError(f"Unknown normalization step: {name}")
+            values = getattr(cls, name)(values, *params)
+        return values
+
+    @classmethod
+    def _row_blocks(cls, values):
+        """
+        Yields slices of rows with about `block_cells` values each.
+        """
+        block_rows = max(1, cls.block_cells // max(1, values.shape[1]))
+        for start in range(0, values.shape[0], block_rows):
+            yield slice(start, start + block_rows)
+
+    @classmethod
+    def _row_sums(cls, values):
+        """
+        Returns (sums, non-NaN counts) of every row.
+        """
+        if sparse.issparse(values):
+            is_nan = np.isnan(values.data)
+            sums = np.bincount(values.indices, weights=np.where(is_nan, 0.0, values.data), minlength=values.shape[0])
+            counts = values.shape[1] - np.bincount(values.indices[is_nan], minlength=values.shape[0])
+            return sums, counts
+        sums = np.zeros(values.shape[0])
+        counts = np.zeros(values.shape[0])
+        for rows in cls._row_blocks(values):
+            block = values[rows]
+            sums[rows] = np.nansum(block, axis=1, dtype=np.float64)
+            counts[rows] = values.shape[1] - np.isnan(block).sum(axis=1)
+        return sums, counts
+
+    @classmethod
+    def _column_moments(cls, values):
+        """
+        Returns the mean and (population) standard deviation of every column.
+        """
+        sums = np.zeros(values.shape[1])
+        squares = np.zeros(values.shape[1])
+        counts = np.zeros(values.shape[1])
+        for rows in cls._row_blocks(values):
+            block = values[rows].astype(np.float64)
+            is_nan = np.isnan(block)
+            block[is_nan] = 0.0
+            sums += block.sum(axis=0)
+            squares += (block * block).sum(axis=0)
+            counts += (~is_nan).sum(axis=0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / counts
+            variance = np.maximum(squares / counts - mean * mean, 0.0)
+        return mean, np.sqrt(variance)
+
+    @classmethod
+    def _smallest_positive(cls, values):
+        if sparse.issparse(values):
+            positive = values.data[values.data > 0]
+            return float(positive.min()) if positive.size else None
+        smallest = np.inf
+        for rows in cls._row_blocks(values):
+            block = values[rows]
+            smallest = min(smallest, float(np.min(block, where=block > 0, initial=np.inf)))
+        return smallest if np.isfinite(smallest) else None
+
+    @staticmethod
+    def _dense(values):
+        if sparse.issparse(values):
+            return values.toarray()
+        return values
+
+    @classmethod
+    def relative_abundance(cls, values, scale=100.0):
+        """
+        Scales every sample to a total of `scale` (percent by default), samples
+        without any abundance are left at zero.
+        """
+        sums, _ = cls._row_sums(values)
+        with np.errstate(divide='ignore'):
+            factors = np.where(sums > 0, scale / sums, 0.0).astype(np.float32)
+        if sparse.issparse(values):
+            values.data *= factors[values.indices]
+        else:
+            values *= factors[:, None]
+        return values
+
+    @classmethod
+    def clr(cls, values, pseudocount=None):
+        """
+        Centered log-ratio: log(x + pseudocount) minus its mean over the
+        sample. The pseudocount defaults to half the smallest positive value.
+        """
+        if pseudocount is None:
+            smallest = cls._smallest_positive(values)
+            pseudocount = smallest / 2 if smallest is not None else 1.0
+        values = cls._dense(values)
+        np.add(values, np.float32(pseudocount), out=values)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            np.log(values, out=values)
+        sums, counts = cls._row_sums(values)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values -= (sums / counts).astype(np.float32)[:, None]
+        return values
+
+    @classmethod
+    def rarefy(cls, values, depth, seed=0):
+        """
+        Subsamples every sample to `depth` counts without replacement, the
+        values are taken as counts (rounded). Samples with fewer than `depth`
+        counts are set to NaN, which leaves them out of the statistics and the
+        searches.
+        """
+        rng = np.random.default_rng(seed)
+        if sparse.issparse(values):
+            # The nonzero values grouped by sample, from the CSC columns
+            entries = np.argsort(values.indices, kind='stable')
+            entries = entries[values.data[entries] > 0]
+            deep = cls._rarefy_counts(values.data, entries, values.indices[entries], values.shape[0], depth, rng)
+            shallow = np.flatnonzero(~deep)
+            if len(shallow):
+                # The zeros of the shallow samples become NaN as well
+                nan_rows = sparse.csc_matrix(
+                    (np.full(len(shallow) * values.shape[1], np.nan, dtype=np.float32),
+                     (np.repeat(shallow, values.shape[1]), np.tile(np.arange(values.shape[1]), len(shallow)))),
+                    shape=values.shape)
+                values = sparse.csc_matrix(values + nan_rows)
+            return values
+
+        values = np.ascontiguousarray(values)
+        flat = values.reshape(-1)
+        entries = np.flatnonzero(flat > 0)
+        deep = cls._rarefy_counts(flat, entries, entries // values.shape[1], values.shape[0], depth, rng)
+        values[~deep] = np.nan
+        return values
+
+    @staticmethod
+    def _rarefy_counts(data, entries, samples, n_samples, depth, rng):
+        """
+        Replaces data[entries] by a subsample of `depth` of the counts of each
+        sample, `samples` (grouped, in increasing order) holding the sample of
+        every entry. The counts are drawn as sequential hypergeometric
+        marginals: the k-th entries of all samples at once, so the draws loop
+        over the richness of a sample instead of over the samples. Returns the
+        mask of the samples with at least `depth` counts, the others are left
+        unchanged.
+        """
+        counts = np.rint(data[entries]).astype(np.int64)
+        totals = np.bincount(samples, weights=counts, minlength=n_samples).astype(np.int64)
+        deep = totals >= depth
+        kept = deep[samples]
+        entries, samples, counts = entries[kept], samples[kept], counts[kept]
+
+        # Rank of every entry within its sample, and the entries by rank
+        first = np.searchsorted(samples, samples, side='left')
+        ranks = np.arange(len(samples)) - first
+        by_rank = np.argsort(ranks, kind='stable')
+        boundaries = np.concatenate(([0], np.cumsum(np.bincount(ranks))))
+        remaining = totals.copy()
+        left = np.full(n_samples, depth, dtype=np.int64)
+        drawn = np.empty_like(counts)
+        for rank in range(len(boundaries) - 1):
+            rank_entries = by_rank[boundaries[rank]:boundaries[rank + 1]]
+            rank_samples = samples[rank_entries]
+            rank_counts = counts[rank_entries]
+            remaining[rank_samples] -= rank_counts
+            draws = rng.hypergeometric(rank_counts, remaining[rank_samples], left[rank_samples])
+            left[rank_samples] -= draws
+            drawn[rank_entries] = draws
+        data[entries] = drawn
+        return deep
+
+    @classmethod
+    def standardize(cls, values):
+        """
+        Centers every feature to mean 0 and scales it to standard deviation 1,
+        constant features are left at 0.
+        """
+        values = cls._dense(values)
+        mean, std = cls._column_moments(values)
+        std[~(std > 0)] = 1.0
+        values -= mean.astype(np.float32)
+        values /= std.astype(np.float32)
+        return values
@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.special import chdtrc
+
+
+class PreprocessingEngine:
+    """
+    Per-group mean abundance and prevalence of every feature, and the
+    abundance/prevalence threshold filters of the preprocessing page.
+
+    The samples are labelled with an integer group code, and the statistics of
+    all groups are computed in a single pass over the abundance: one sparse
+    (groups x samples) one-hot product per block of features gives the sums,
+    the valid (non-NaN) counts and the nonzero counts of every group at once.
+    No per-group DataFrame or masked copy of the table is made, and at most one
+    block of `block_cells` values is converted at a time.
+
+    Once fitted, the mean abundance and prevalence of every group are kept
+    sorted with the matching feature order, so a threshold resolves to the
+    features above it with a binary search and the 'both'/'either' modes are
+    a count of passing groups per feature. Any combination of thresholds is
+    then answered in milliseconds, without going back to the abundance.
+
+    For screening, the association of every feature's presence with the groups
+    is scored from the same counts: the Kruskal-Wallis test (tie corrected) of
+    a 0/1 variable depends only on how many of the valid samples of each group
+    have the feature, so the p-values of all features are one vectorized
+    computation over the (groups x features) count arrays. With two groups it
+    equals the two-sided Mann-Whitney U test without continuity correction.
+
+    Parameters
+    ----------
+    feature_names : list
+        Feature (species) names, in column order of the statistics.
+    categories : list
+        Group names, in row order of the statistics.
+    mean_abundance : np.ndarray
+        (groups x features) mean abundance, NaN values excluded.
+    prevalence : np.ndarray
+        (groups x features) fraction of the (non-NaN) samples with abundance > 0.
+    valid_counts : np.ndarray
+        (groups x features) number of non-NaN samples.
+    nonzero_counts : np.ndarray
+        (groups x features) number of samples with abundance > 0.
+    """
+
+    block_cells = 1 << 20
+
+    def __init__(self):
+        self.feature_names = []
+        self.categories = []
+        self.mean_abundance = np.zeros((0, 0))
+        self.prevalence = np.zeros((0, 0))
+        self.valid_counts = np.zeros((0, 0))
+        self.nonzero_counts = np.zeros((0, 0))
+        self._association_p_values = None
+        self._abundance_index = ([], [])
+        self._prevalence_index = ([], [])
+
+    @property
+    def memory_bytes(self):
+        return int(self.mean_abundance.nbytes + self.prevalence.nbytes + self.valid_counts.nbytes
+                   + self.nonzero_counts.nbytes + 2 * 8 * self.mean_abundance.size)
+
+    @staticmethod
+    def group_codes(labels):
+        """
+        Returns (codes, categories) of the sample labels, samples without a
+        label get the code -1.
+        """
+        codes, categories = pd.factorize(pd.Series(labels), use_na_sentinel=True)
+        return codes, list(categories)
+
+    @staticmethod
+    def one_hot(codes, n_groups):
+        """
+        (groups x samples) sparse indicator matrix of the group codes.
+        """
+        samples = np.flatnonzero(codes >= 0)
+        return sparse.csr_matrix((np.ones(len(samples)), (codes[samples], samples)),
+                                 shape=(n_groups, len(codes)))
+
+    @classmethod
+    def group_sums(cls, df, codes, n_groups):
+        """
+        Returns (sums, valid counts, nonzero counts), each (groups x features),
+        of a numeric DataFrame, a block of columns at a time.
+        """
+        one_hot = cls.one_hot(codes, n_groups)
+        n_features = df.shape[1]
+        sums = np.zeros((n_groups, n_features))
+        valid = np.zeros((n_groups, n_features))
+        nonzero = np.zeros((n_groups, n_features))
+        block_features = max(1, cls.block_cells // max(1, len(df)))
+        for start in range(0, n_features, block_features):
+            end = min(start + block_features, n_features)
+            block = df.iloc[:, start:end].to_numpy(dtype=np.float64, copy=True)
+            is_nan = np.isnan(block)
+            valid[:, start:end] = one_hot @ ~is_nan
+            nonzero[:, start:end] = one_hot @ (block > 0)
+            block[is_nan] = 0.0
+            sums[:, start:end] = one_hot @ block
+        return sums, valid, nonzero
+
+    def fit(self, feature_names, categories, sums, valid, nonzero):
+        """
+        Sets the statistics from the per-group sums and counts.
+        """
+        self.feature_names = list(feature_names)
+        self.categories = list(categories)
+        self.valid_counts = np.asarray(valid, dtype=np.float64)
+        self.nonzero_counts = np.asarray(nonzero, dtype=np.float64)
+        self._association_p_values = None
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.mean_abundance = np.asarray(sums, dtype=np.float64) / valid
+            self.prevalence = np.asarray(nonzero, dtype=np.float64) / valid
+        self._abundance_index = self._sorted_index(self.mean_abundance)
+        self._prevalence_index = self._sorted_index(self.prevalence)
+        return self
+
+    def fit_frame(self, df, labels):
+        """
+        Computes the statistics of an abundance DataFrame grouped by `labels`.
+        """
+        codes, categories = self.group_codes(labels)
+        sums, valid, nonzero = self.group_sums(df, codes, len(categories))
+        return self.fit(df.columns, categories, sums, valid, nonzero)
+
+    def category_statistics(self):
+        """
+        Returns {category: (mean abundance, prevalence)}, both as Series over the features.
+        """
+        return {
+            category: (pd.Series(self.mean_abundance[i], index=self.feature_names),
+                       pd.Series(self.prevalence[i], index=self.feature_names))
+            for i, category in enumerate(self.categories)
+        }
+
+    def association_p_values(self):
+        """
+        Kruskal-Wallis p-value of the presence of every feature between the
+        groups, computed once from the per-group counts. Features present in
+        all or none of their samples get 1.0.
+        """
+        if self._association_p_values is None:
+            group_sizes = self.valid_counts
+            present = self.nonzero_counts
+            n = group_sizes.sum(axis=0)
+            n_present = present.sum(axis=0)
+            n_absent = n - n_present
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # Average ranks of the absent (0) and present (1) samples
+                absent_rank = (n_absent + 1) / 2
+                present_rank = n_absent + (n_present + 1) / 2
+                rank_sums = (group_sizes - present) * absent_rank + present * present_rank
+                h = (12 / (n * (n + 1)) * np.where(group_sizes > 0, rank_sums ** 2 / group_sizes, 0).sum(axis=0)
+                     - 3 * (n + 1))
+                ties = 1 - (n_absent ** 3 - n_absent + n_present ** 3 - n_present) / (n ** 3 - n)
+                degrees = (group_sizes > 0).sum(axis=0) - 1
+                p_values = chdtrc(degrees, h / ties)
+            self._association_p_values = np.where((ties > 0) & (degrees > 0), p_values, 1.0)
+        return self._association_p_values
+
+    def _screen(self, selected, top_n=None, p_value_cutoff=None):
+        """
+        Keeps the selected features with an association p-value under
+        `p_value_cutoff`, and of those the `top_n` with the lowest p-values.
+        """
+        if top_n is None and p_value_cutoff is None:
+            return selected
+        p_values = self.association_p_values()
+        if p_value_cutoff is not None:
+            selected = selected & (p_values < p_value_cutoff)
+        if top_n is not None:
+            candidates = np.flatnonzero(selected)
+            if len(candidates) > top_n:
+                kept = candidates[np.argsort(p_values[candidates], kind='stable')[:top_n]]
+                selected = np.zeros_like(selected)
+                selected[kept] = True
+        return selected
+
+    @staticmethod
+    def _sorted_index(statistics):
+        """
+        Returns (feature orders, sorted values) of every group, features with a
+        NaN statistic (no valid sample in the group) left out.
+        """
+        orders, sorted_values = [], []
+        for row in statistics:
+            defined = np.flatnonzero(~np.isnan(row))
+            order = defined[np.argsort(row[defined], kind='stable')]
+            orders.append(order)
+            sorted_values.append(row[order])
+        return orders, sorted_values
+
+    def _passing(self, index, threshold, mode):
+        """
+        Boolean mask of the features above `threshold` in all groups ('both')
+        or in any group ('either').
+        """
+        orders, sorted_values = index
+        passing_groups = np.zeros(len(self.feature_names), dtype=np.int32)
+        for order, values in zip(orders, sorted_values):
+            passing_groups[order[np.searchsorted(values, threshold, side='right'):]] += 1
+        if mode == 'both':
+            return passing_groups == len(orders)
+        return passing_groups > 0
+
+    def selected_mask(self, abundance_threshold=0.0, prevalence_threshold=0.0,
+                      abundance_mode='either', prevalence_mode='either', top_n=None, p_value_cutoff=None):
+        """
+        Boolean mask of the features whose mean abundance is above
+        `abundance_threshold` and whose prevalence (fraction) is above
+        `prevalence_threshold`, in both groups or either group as set by the
+        modes. With `top_n` or `p_value_cutoff`, the features passing the
+        thresholds are then screened by their association p-value.
+        """
+        selected = (self._passing(self._abundance_index, abundance_threshold, abundance_mode)
+                    & self._passing(self._prevalence_index, prevalence_threshold, prevalence_mode))
+        return self._screen(selected, top_n, p_value_cutoff)
+
+    def count_features(self, abundance_threshold=0.0, prevalence_threshold=0.0,
+                       abundance_mode='either', prevalence_mode='either', top_n=None, p_value_cutoff=None):
+        """
+        Number of features `select_features` returns for the same settings.
+        """
+        return int(np.count_nonzero(self.selected_mask(abundance_threshold, prevalence_threshold, abundance_mode,
+                                                       prevalence_mode, top_n, p_value_cutoff)))
+
+    def select_features(self, abundance_threshold=0.0, prevalence_threshold=0.0,
+                        abundance_mode='either', prevalence_mode='either', top_n=None, p_value_cutoff=None):
+        """
+        Returns the sorted features selected by the settings, see `selected_mask`.
+        """
+        selected = self.selected_mask(abundance_threshold, prevalence_threshold, abundance_mode, prevalence_mode,
+                                      top_n, p_value_cutoff)
+        return sorted(self.feature_names[i] for i in np.flatnonzero(selected))
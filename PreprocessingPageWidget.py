@@ -1,7 +1,7 @@
 import random
 
 from PyQt5 import QtWidgets
-from PyQt5.QtGui import QDoubleValidator
+from PyQt5.QtGui import QDoubleValidator, QIntValidator
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout, QSizePolicy, QTableView, QCheckBox, \
     QLineEdit, QGroupBox, QFrame
 from PyQt5.QtCore import Qt, pyqtSignal
@@ -23,6 +23,9 @@ class PreprocessingPageWidget(QWidget):
 
         self.data_file = data  # Keep a reference to the shared data
         self.init_ui()
+        # Dataset shown on the page and the settings of its applied preprocessing
+        self.shown_dataset_key = self.data_file.dataset_key()
+        self.applied_settings = None
 
     def init_ui(self):
         preprocessing_page_layout = QtWidgets.QVBoxLayout(self)
@@ -44,7 +47,7 @@ class PreprocessingPageWidget(QWidget):
         labelSizeShape.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Preferred)
 
         self.labelDFShapeValue = QLabel(
-            f"{self.data_file.input_dataframe.shape[0]} rows x {self.data_file.input_dataframe.shape[1]} features")
+            f"{self.data_file.get_input_shape()[0]} rows x {self.data_file.get_input_shape()[1]} features")
         self.labelDFShapeValue.setAlignment(Qt.AlignLeft)
         # self.labelDFShapeValue.setStyleSheet("border: 1px gray; padding: 4px;")
         self.labelDFShapeValue.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Preferred)
@@ -75,6 +78,33 @@ class PreprocessingPageWidget(QWidget):
         labelDataPreprocessing = QLabel("Data Preprocessing")
         preprocessing_page_layout.addWidget(labelDataPreprocessing)
 
+        # Normalization of the abundance, applied in this order before the filters
+        normalizationLayout = QHBoxLayout()
+        self.rarefy_checkbox = QCheckBox("Rarefy to depth")
+        normalizationLayout.addWidget(self.rarefy_checkbox)
+        self.rarefactionDepthInput = QLineEdit()
+        self.rarefactionDepthInput.setValidator(QIntValidator(1, 1000000000))
+        self.rarefactionDepthInput.setPlaceholderText("Counts per sample")
+        normalizationLayout.addWidget(self.rarefactionDepthInput)
+        self.relative_abundance_checkbox = QCheckBox("Relative abundance (%)")
+        normalizationLayout.addWidget(self.relative_abundance_checkbox)
+        self.clr_checkbox = QCheckBox("CLR")
+        normalizationLayout.addWidget(self.clr_checkbox)
+        self.standardize_checkbox = QCheckBox("Standardize features")
+        normalizationLayout.addWidget(self.standardize_checkbox)
+        self.normalizationGroup = QGroupBox("Normalization")
+        self.normalizationGroup.setToolTip(
+            "Applied from left to right before the abundance and prevalence filters. The abundance filter uses "
+            "the normalized values; the prevalence filter and the searches use the presence (value > 0) of the "
+            "abundance before CLR or standardization, which fill in the zeros. Not available with streaming import.")
+        self.normalizationGroup.setLayout(normalizationLayout)
+        self.normalizationGroup.setEnabled(self.data_file.presence is None)
+        preprocessing_page_layout.addWidget(self.normalizationGroup)
+        for normalization_checkbox in (self.rarefy_checkbox, self.relative_abundance_checkbox,
+                                       self.clr_checkbox, self.standardize_checkbox):
+            normalization_checkbox.toggled.connect(self.set_normalization_steps)
+        self.rarefactionDepthInput.editingFinished.connect(self.set_normalization_steps)
+
         parallelLayout = QHBoxLayout()
 
         threshold_validator = QDoubleValidator(0.0, 100.00, 4)
@@ -147,9 +177,62 @@ class PreprocessingPageWidget(QWidget):
         parallelLayout.addWidget(abundanceWidget)
         preprocessing_page_layout.addLayout(parallelLayout)
 
+        # Screening of the features passing the thresholds by their group association
+        screeningLayout = QHBoxLayout()
+        self.screeningTopNInput = QLineEdit()
+        self.screeningTopNInput.setValidator(QIntValidator(1, 1000000000))
+        self.screeningTopNInput.setPlaceholderText("Keep top N features")
+        screeningLayout.addWidget(self.screeningTopNInput)
+        self.screeningPValueInput = QLineEdit()
+        self.screeningPValueInput.setValidator(QDoubleValidator(0.0, 1.0, 10))
+        self.screeningPValueInput.setPlaceholderText("p-value cutoff (0-1)")
+        screeningLayout.addWidget(self.screeningPValueInput)
+        screeningGroup = QGroupBox("Screening")
+        screeningGroup.setToolTip(
+            "Ranks the species by the Kruskal-Wallis p-value of their presence between the groups "
+            "and keeps the top N, or those under the cutoff.")
+        screeningGroup.setLayout(screeningLayout)
+        preprocessing_page_layout.addWidget(screeningGroup)
+
+        self.collapse_presence_checkbox = QCheckBox("Collapse species with identical presence")
+        self.collapse_presence_checkbox.setToolTip(
+            "Species present in exactly the same samples are searched as one class, "
+            "results list every species of the selected classes.")
+        self.collapse_presence_checkbox.setChecked(self.data_file.collapse_identical_presence)
+        self.collapse_presence_checkbox.toggled.connect(self.set_collapse_identical_presence)
+        preprocessing_page_layout.addWidget(self.collapse_presence_checkbox)
+
+        coOccurrenceLayout = QHBoxLayout()
+        self.cluster_co_occurring_checkbox = QCheckBox("Cluster co-occurring species, Jaccard similarity at least")
+        self.cluster_co_occurring_checkbox.setToolTip(
+            "Species present in mostly the same samples are searched as one cluster, led by the most "
+            "prevalent one; results list every species of the selected clusters.")
+        self.cluster_co_occurring_checkbox.setChecked(self.data_file.cluster_co_occurring)
+        self.cluster_co_occurring_checkbox.toggled.connect(self.set_cluster_co_occurring)
+        coOccurrenceLayout.addWidget(self.cluster_co_occurring_checkbox)
+        self.coOccurrenceThresholdInput = QLineEdit(str(self.data_file.co_occurrence_threshold))
+        self.coOccurrenceThresholdInput.setValidator(QDoubleValidator(0.0, 1.0, 4))
+        self.coOccurrenceThresholdInput.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Preferred)
+        self.coOccurrenceThresholdInput.editingFinished.connect(self.set_co_occurrence_threshold)
+        coOccurrenceLayout.addWidget(self.coOccurrenceThresholdInput)
+        coOccurrenceLayout.addStretch()
+        preprocessing_page_layout.addLayout(coOccurrenceLayout)
+
         self.preprocess_button = QtWidgets.QPushButton("Preprocess")
         preprocessing_page_layout.addWidget(self.preprocess_button)
 
+        # Live number of features passing the thresholds, updated as they are typed
+        self.selected_features_count_label = QLabel("")
+        preprocessing_page_layout.addWidget(self.selected_features_count_label)
+        for threshold_input in (self.prevalenceThresholdInput, self.abundanceThresholdInput,
+                                self.screeningTopNInput, self.screeningPValueInput):
+            threshold_input.textChanged.connect(self.update_selected_features_count)
+        for mode_checkbox in (self.preprocessing_prevalence_either_checkbox,
+                              self.preprocessing_prevalence_both_checkbox,
+                              self.preprocessing_abundance_either_checkbox,
+                              self.preprocessing_abundance_both_checkbox):
+            mode_checkbox.toggled.connect(self.update_selected_features_count)
+
         # Preprocessing output dataframe
         # Output shape
         output_sizeShapeLayout = QHBoxLayout()
@@ -189,8 +272,24 @@ class PreprocessingPageWidget(QWidget):
         preprocessing_page_layout.addStretch()
 
     def refresh_ui(self):
+        # Back on the page with the same dataset and output labels: the applied
+        # preprocessing is restored from the memoized stages instead of reset
+        dataset_key = self.data_file.dataset_key()
+        if dataset_key is not None and dataset_key == self.shown_dataset_key:
+            if self.applied_settings is not None:
+                # Reading the file again reset the normalization of the data file
+                settings, normalization_steps = self.applied_settings
+                self.show_normalization_steps(normalization_steps)
+                self.data_file.normalization_steps = list(normalization_steps)
+                self.apply_preprocessing(settings)
+            else:
+                self.set_normalization_steps()
+            return
+        self.shown_dataset_key = dataset_key
+        self.applied_settings = None
+
         self.labelDFShapeValue = QLabel(
-            f"{self.data_file.input_dataframe.shape[0]} rows x {self.data_file.input_dataframe.shape[1]} features")
+            f"{self.data_file.get_input_shape()[0]} rows x {self.data_file.get_input_shape()[1]} features")
 
         input_abun_model = PandasModel(self.data_file.get_abundance_input_dataframe())
         self.tableView1.setModel(input_abun_model)
@@ -203,8 +302,18 @@ class PreprocessingPageWidget(QWidget):
         self.preprocessing_abundance_either_checkbox.setChecked(False)
         self.preprocessing_abundance_both_checkbox.setChecked(False)
         self.abundanceThresholdInput.setText("")
-
+        self.screeningTopNInput.setText("")
+        self.screeningPValueInput.setText("")
+
+        self.collapse_presence_checkbox.setChecked(False)
+        self.cluster_co_occurring_checkbox.setChecked(False)
+        for normalization_checkbox in (self.rarefy_checkbox, self.relative_abundance_checkbox,
+                                       self.clr_checkbox, self.standardize_checkbox):
+            normalization_checkbox.setChecked(False)
+        self.rarefactionDepthInput.setText("")
+        self.normalizationGroup.setEnabled(self.data_file.presence is None)
         self.outputlabelDFShapeValue.setText("")
+        self.selected_features_count_label.setText("")
         self.filteredTableView.setModel(PandasModel())
 
         # Reset the data changed
@@ -216,20 +325,12 @@ class PreprocessingPageWidget(QWidget):
     def go_to_search_algorithm_ui(self):
         self.signal_to_search_selection_page.emit()
 
-    def preprocess_with_thresholds(self):
+    def threshold_settings(self):
         """
-        Dynamically handle any number of categories, computing both abundance-
-        and prevalence-based filters. Then combine them (intersection) to get
-        a final list of species.
+        Returns the abundance threshold, the prevalence threshold (as a fraction),
+        the abundance and prevalence modes ('both' or 'either') and the screening
+        top N and p-value cutoff (None when empty) of the page.
         """
-
-        # 1. Load data
-        temporary_abundance_df = self.data_file.get_abundance_input_dataframe()
-        temporary_metadata_df = self.data_file.get_metadata_input_dataframe()
-        output_column = self.data_file.output_labels[0]  # Only one output column
-        unique_categories = temporary_metadata_df[output_column].unique()
-
-        # 2. Parse thresholds
         abundance_threshold = 0.0
         if self.abundanceThresholdInput.text():
             abundance_threshold = float(self.abundanceThresholdInput.text())
@@ -239,72 +340,123 @@ class PreprocessingPageWidget(QWidget):
             # Convert from percentage to fraction (e.g., 10 -> 0.1)
             prevalence_threshold = float(self.prevalenceThresholdInput.text()) / 100.0
 
-        # 3. Build a dict of category -> subset DataFrame
-        #    This way, if there are N categories, we create N DataFrames.
-        category_abundance_dfs = {
-            cat: temporary_abundance_df.loc[temporary_metadata_df[output_column] == cat]
-            for cat in unique_categories
-        }
-
-        # 4. Compute the abundance-based filter for each category
-        #    and store sets of species above the threshold.
-        category_abundance_species = {}
-        for cat, cat_df in category_abundance_dfs.items():
-            mean_abundance = cat_df.mean(axis=0)  # average across samples
-            # Filter species based on abundance threshold
-            abundance_species = mean_abundance[mean_abundance > abundance_threshold].index
-            category_abundance_species[cat] = set(abundance_species)
-
-        # 5. Combine all category sets based on 'both' or 'either' checkboxes
-        if self.preprocessing_abundance_both_checkbox.isChecked():
-            # Intersection across all categories
-            abundance_selected_species = set.intersection(*category_abundance_species.values())
-        elif self.preprocessing_abundance_either_checkbox.isChecked():
-            # Union across all categories
-            abundance_selected_species = set.union(*category_abundance_species.values())
-        else:
-            # If neither is checked, default to intersection or union, or do nothing
-            # (This depends on your specific requirements.)
-            abundance_selected_species = set.union(*category_abundance_species.values())
-
-        # 6. Compute the prevalence-based filter for each category
-        category_prevalence_species = {}
-        for cat, cat_df in category_abundance_dfs.items():
-            # Convert abundance to 1/0
-            masked_df = cat_df.mask(cat_df > 0, 1)
-            prevalence = masked_df.mean(axis=0)  # fraction of samples that have the species
-            # Filter species by prevalence threshold
-            prevalence_species = prevalence[prevalence > prevalence_threshold].index
-            category_prevalence_species[cat] = set(prevalence_species)
-
-        # 7. Combine all category sets for prevalence
-        if self.preprocessing_prevalence_both_checkbox.isChecked():
-            # Intersection across all categories
-            prevalence_selected_species = set.intersection(*category_prevalence_species.values())
-        elif self.preprocessing_prevalence_either_checkbox.isChecked():
-            # Union across all categories
-            prevalence_selected_species = set.union(*category_prevalence_species.values())
-        else:
-            # Default if neither is checked
-            prevalence_selected_species = set.union(*category_prevalence_species.values())
-
-        # 8. Final species = intersection of abundance filter & prevalence filter
-        final_processed_set_of_species = abundance_selected_species.intersection(prevalence_selected_species)
-        final_processed_list = sorted(final_processed_set_of_species)
-
-        # final_processed_list = list(final_processed_set_of_species)
-        # random.Random(42).shuffle(final_processed_list)
-
-
-        # 9. Save the final feature list and create a new DataFrame
-        self.data_file.feature_list_after_preprocessing = final_processed_list
-        output_abundance_dataframe = self.data_file.set_preprocessed_abundance_dataframe(
-            self.data_file.input_abundance_dataframe[final_processed_list]
-        )
+        # 'either' is also the default when neither checkbox is checked
+        abundance_mode = 'both' if self.preprocessing_abundance_both_checkbox.isChecked() else 'either'
+        prevalence_mode = 'both' if self.preprocessing_prevalence_both_checkbox.isChecked() else 'either'
 
-        # 10. Update UI labels, table, etc.
-        self.outputlabelDFShapeValue.setText(
-            f"{output_abundance_dataframe.shape[0]} rows x {output_abundance_dataframe.shape[1]} features"
-        )
+        top_n = int(self.screeningTopNInput.text()) if self.screeningTopNInput.text() else None
+        p_value_cutoff = float(self.screeningPValueInput.text()) if self.screeningPValueInput.text() else None
+        return abundance_threshold, prevalence_threshold, abundance_mode, prevalence_mode, top_n, p_value_cutoff
+
+    def set_normalization_steps(self):
+        """
+        Sets the normalization steps of the data file from the checked options.
+        """
+        steps = []
+        if self.rarefy_checkbox.isChecked() and self.rarefactionDepthInput.text():
+            steps.append(('rarefy', (int(self.rarefactionDepthInput.text()), 0)))
+        if self.relative_abundance_checkbox.isChecked():
+            steps.append(('relative_abundance', (100.0,)))
+        if self.clr_checkbox.isChecked():
+            steps.append(('clr', ()))
+        if self.standardize_checkbox.isChecked():
+            steps.append(('standardize', ()))
+        if steps != self.data_file.normalization_steps:
+            self.data_file.normalization_steps = steps
+            self.update_selected_features_count()
+
+    def show_normalization_steps(self, steps):
+        """
+        Checks the normalization options of `steps`, without applying them.
+        """
+        step_params = dict(steps)
+        for name, normalization_checkbox in (('rarefy', self.rarefy_checkbox),
+                                             ('relative_abundance', self.relative_abundance_checkbox),
+                                             ('clr', self.clr_checkbox), ('standardize', self.standardize_checkbox)):
+            normalization_checkbox.blockSignals(True)
+            normalization_checkbox.setChecked(name in step_params)
+            normalization_checkbox.blockSignals(False)
+        if 'rarefy' in step_params:
+            self.rarefactionDepthInput.setText(str(step_params['rarefy'][0]))
+
+    def set_collapse_identical_presence(self, checked):
+        self.data_file.collapse_identical_presence = checked
+        if self.outputlabelDFShapeValue.text():
+            self.update_output_shape_label()
+
+    def set_cluster_co_occurring(self, checked):
+        self.data_file.cluster_co_occurring = checked
+        if self.outputlabelDFShapeValue.text():
+            self.update_output_shape_label()
+
+    def set_co_occurrence_threshold(self):
+        try:
+            self.data_file.co_occurrence_threshold = float(self.coOccurrenceThresholdInput.text())
+        except ValueError:
+            return
+        if self.cluster_co_occurring_checkbox.isChecked() and self.outputlabelDFShapeValue.text():
+            self.update_output_shape_label()
+
+    def update_output_shape_label(self):
+        output_shape = self.data_file.get_preprocessed_shape()
+        output_text = f"{output_shape[0]} rows x {output_shape[1]} features"
+        species_classes = self.data_file.get_species_classes()
+        if species_classes is not None and self.data_file.cluster_co_occurring:
+            output_text += f" ({len(species_classes)} co-occurrence clusters)"
+        elif species_classes is not None:
+            output_text += f" ({len(species_classes)} presence classes)"
+        self.outputlabelDFShapeValue.setText(output_text)
+
+    def update_selected_features_count(self):
+        """
+        Show how many features the current thresholds and screening keep, from the threshold
+        index of the data file (built on the first call for a dataset).
+        """
+        if not self.data_file.output_labels:
+            return
+        try:
+            settings = self.threshold_settings()
+        except ValueError:
+            # Incomplete number while typing
+            return
+        preprocessing_engine = self.data_file.preprocessing_engine(self.data_file.output_labels[0])
+        feature_count = preprocessing_engine.count_features(*settings)
+        self.selected_features_count_label.setText(
+            f"{feature_count} of {len(preprocessing_engine.feature_names)} features selected")
+
+    def preprocess_with_thresholds(self):
+        """
+        Dynamically handle any number of categories, computing both abundance-
+        and prevalence-based filters. Then combine them (intersection) to get
+        a final list of species.
+        """
+
+        # 1. Parse thresholds and screening
+        try:
+            settings = self.threshold_settings()
+        except ValueError:
+            print("Invalid threshold or screening value.")
+            return
+        self.apply_preprocessing(settings)
+
+    def apply_preprocessing(self, settings):
+        """
+        Selects the features passing the threshold and screening `settings`
+        and shows the result. Every step is a memoized stage of the data file,
+        so settings applied before are restored without recomputing.
+        """
+        output_column = self.data_file.output_labels[0]  # Only one output column
+
+        # 2. Species above both thresholds, in all categories ('both') or in
+        #    any category ('either'), resolved from the threshold index of the
+        #    per category statistics, then screened by the association p-values.
+        final_processed_list = self.data_file.filter_features(output_column, settings)
+
+        # 3. Save the final feature list and create a new DataFrame
+        output_abundance_dataframe = self.data_file.select_preprocessed_features(final_processed_list)
+        self.applied_settings = (settings, tuple(self.data_file.normalization_steps))
+
+        # 4. Update UI labels, table, etc.
+        self.update_output_shape_label()
         self.filteredTableView.setModel(PandasModel(output_abundance_dataframe))
 
@@ -0,0 +1,105 @@
+import sys
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+
+class PreprocessingPipeline:
+    """
+    Memoized preprocessing stages.
+
+    Preprocessing is a chain of stages (feature statistics, filtering, feature
+    selection, binarization, deduplication), each run through `run` with the
+    key of its input (the upstream stage, or the dataset fingerprint for the
+    first stages) and its parameters. The output is kept under the combined
+    key, so running a stage again on the same input with the same parameters
+    returns the earlier output instead of recomputing it, and every stage
+    downstream of it is then found under the same keys as well.
+
+    The outputs are kept in least recently used order and the oldest are
+    dropped once their estimated size exceeds `max_bytes`; an output larger
+    than `max_bytes` is returned but not kept.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Memory bound of the kept stage outputs.
+    """
+
+    max_bytes = 512 * 1024 * 1024
+
+    def __init__(self, max_bytes=None):
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def stage_key(upstream, stage, params=()):
+        """
+        Key of the output of `stage` with `params` (hashable values) run on the
+        output keyed `upstream`.
+        """
+        return upstream, stage, tuple(params)
+
+    @property
+    def memory_bytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def run(self, upstream, stage, params, compute):
+        """
+        Returns (key, output) of a stage, calling `compute()` only when the
+        output for this input and these parameters is not kept. With `upstream`
+        None the input is not identified and the stage is always computed.
+        """
+        if upstream is None:
+            return None, compute()
+        key = self.stage_key(upstream, stage, params)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return key, self._entries[key][0]
+        self.misses += 1
+        output = compute()
+        self._store(key, output)
+        return key, output
+
+    def _store(self, key, output):
+        size = self.estimate_bytes(output)
+        if size > self.max_bytes:
+            return
+        self._entries[key] = (output, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, dropped_size) = self._entries.popitem(last=False)
+            self._bytes -= dropped_size
+
+    @classmethod
+    def estimate_bytes(cls, output):
+        """
+        Size of a stage output: DataFrames and arrays by their buffers, abundance
+        and presence stores by their `memory_bytes`, containers by their items.
+        """
+        if output is None:
+            return 0
+        if isinstance(output, pd.DataFrame):
+            return int(output.memory_usage(index=True, deep=False).sum())
+        if isinstance(output, np.ndarray):
+            return int(output.nbytes)
+        if hasattr(output, 'memory_bytes'):
+            return int(output.memory_bytes)
+        if isinstance(output, dict):
+            return sys.getsizeof(output) + sum(cls.estimate_bytes(value) for value in output.values())
+        if isinstance(output, (list, tuple)):
+            return sys.getsizeof(output) + sum(cls.estimate_bytes(item) for item in output)
+        return sys.getsizeof(output)
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
@@ -0,0 +1,274 @@
+import ctypes
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+import weakref
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from PresenceMatrix import PresenceMatrix
+
+
+class PresenceFile:
+    """
+    Binarized presence matrices stored on disk and memory-mapped read-only.
+
+    Every matrix is stored once under the content hash of its bits, so
+    searches on the same preprocessed data (in one process or several) map the
+    same files and share a single physical copy through the page cache. The
+    packed bits are written first; the float32 (matrix product) and CSC
+    (sparse) layouts of the evaluation backends are written on first use.
+
+    A matrix written for a source dataset replaces the earlier matrix of the
+    same dataset (its preprocessing changed), and the least recently opened
+    matrices are removed once the store, with the layouts, exceeds
+    `max_bytes`. Matrices still mapped are never removed: every open() leaves
+    a lock file, named after its process, in the matrix directory until the
+    mapped matrix is closed or garbage collected, and the lock files of
+    processes that no longer run are ignored.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding one sub-directory per matrix.
+    max_bytes : int
+        Disk bound of the stored matrices.
+    """
+
+    source_file_name = "source.txt"
+    max_bytes = 4 * 1024 * 1024 * 1024
+
+    def __init__(self, directory=None, max_bytes=None):
+        if directory is None:
+            directory = os.path.join(os.path.expanduser("~"), ".searchmi", "presence")
+        self.directory = directory
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+
+    @staticmethod
+    def _process_running(pid):
+        if pid == os.getpid():
+            return True
+        if os.name == 'nt':
+            # PROCESS_QUERY_LIMITED_INFORMATION; os.kill would terminate the process on Windows
+            handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+            if not handle:
+                return False
+            ctypes.windll.kernel32.CloseHandle(handle)
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @classmethod
+    def in_use(cls, entry_directory):
+        """
+        Whether a running process has the matrix in `entry_directory` mapped.
+        """
+        for entry in os.scandir(entry_directory):
+            if entry.name.endswith(".lock"):
+                try:
+                    pid = int(entry.name.split("-")[0])
+                except ValueError:
+                    continue
+                if cls._process_running(pid):
+                    return True
+        return False
+
+    @staticmethod
+    def _remove_entry(entry_directory):
+        """
+        Removes an entry, its info file last: when a file cannot be removed
+        (mapped elsewhere on Windows) the entry stays complete and bounded,
+        and is removed on a later try.
+        """
+        info_path = os.path.join(entry_directory, "info.pkl")
+        for entry in os.scandir(entry_directory):
+            if entry.path == info_path:
+                continue
+            try:
+                if entry.is_dir():
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except OSError:
+                return
+        shutil.rmtree(entry_directory, ignore_errors=True)
+
+    @staticmethod
+    def source_key(source):
+        return hashlib.blake2b(repr(source).encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def content_key(matrix):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.ascontiguousarray(matrix.packed).data)
+        digest.update("\0".join(map(str, matrix.feature_names)).encode())
+        digest.update("\0".join(map(str, matrix.sample_index)).encode())
+        return digest.hexdigest()
+
+    def write(self, matrix, source=None):
+        """
+        Writes a PresenceMatrix (unless it is already stored) and returns its
+        key. The stored matrices of the same `source` (a hashable key of the
+        dataset it was preprocessed from) are removed.
+        """
+        key = self.content_key(matrix)
+        entry_directory = os.path.join(self.directory, key)
+        if not os.path.exists(os.path.join(entry_directory, "info.pkl")):
+            os.makedirs(self.directory, exist_ok=True)
+            temporary_directory = tempfile.mkdtemp(dir=self.directory)
+            try:
+                np.save(os.path.join(temporary_directory, "packed.npy"), matrix.packed)
+                info = {'feature_names': matrix.feature_names, 'sample_index': matrix.sample_index}
+                pd.to_pickle(info, os.path.join(temporary_directory, "info.pkl"))
+                if source is not None:
+                    with open(os.path.join(temporary_directory, self.source_file_name), 'w') as f:
+                        f.write(self.source_key(source))
+                if os.path.exists(entry_directory):
+                    shutil.rmtree(temporary_directory, ignore_errors=True)
+                else:
+                    os.replace(temporary_directory, entry_directory)
+            except OSError:
+                shutil.rmtree(temporary_directory, ignore_errors=True)
+                raise
+
+        if source is not None:
+            self._remove_source(self.source_key(source), keep=key)
+        self._evict(keep=key)
+        return key
+
+    def _entries(self):
+        """
+        Returns the complete entries as (key, directory) pairs.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return [(entry.name, entry.path) for entry in os.scandir(self.directory)
+                if entry.is_dir() and os.path.exists(os.path.join(entry.path, "info.pkl"))]
+
+    def _remove_source(self, source_key, keep):
+        for key, entry_directory in self._entries():
+            if key == keep:
+                continue
+            try:
+                with open(os.path.join(entry_directory, self.source_file_name), 'r') as f:
+                    if f.read() != source_key:
+                        continue
+            except OSError:
+                continue
+            if not self.in_use(entry_directory):
+                self._remove_entry(entry_directory)
+
+    def _evict(self, keep):
+        """
+        Removes the least recently opened entries, except `keep`, until the
+        store fits in `max_bytes`.
+        """
+        entries = []
+        for key, entry_directory in self._entries():
+            files = [entry for entry in os.scandir(entry_directory) if entry.is_file()]
+            entries.append((os.stat(os.path.join(entry_directory, "info.pkl")).st_mtime,
+                            sum(entry.stat().st_size for entry in files), key, entry_directory))
+        total_bytes = sum(entry[1] for entry in entries)
+        for _, entry_bytes, key, entry_directory in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if key == keep or self.in_use(entry_directory):
+                continue
+            self._remove_entry(entry_directory)
+            total_bytes -= entry_bytes
+
+    def open(self, key):
+        """
+        Returns the stored matrix with its bits memory-mapped read-only. The
+        entry is kept while the matrix is open.
+        """
+        entry_directory = os.path.join(self.directory, key)
+        info_path = os.path.join(entry_directory, "info.pkl")
+        info = pd.read_pickle(info_path)
+        # The mtime of the info file is the last use of the entry
+        os.utime(info_path)
+        lock_path = os.path.join(entry_directory, f"{os.getpid()}-{uuid.uuid4().hex}.lock")
+        open(lock_path, 'w').close()
+        packed = np.load(os.path.join(entry_directory, "packed.npy"), mmap_mode='r')
+        return MappedPresenceMatrix(packed, info['feature_names'], info['sample_index'], entry_directory, lock_path)
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class MappedPresenceMatrix(PresenceMatrix):
+    """
+    A PresenceMatrix whose packed bits and backend layouts are read-only
+    memory-mapped files in `entry_directory`. The entry is locked by the
+    file `lock_path` until close() or garbage collection.
+    """
+
+    def __init__(self, packed, feature_names, sample_index, entry_directory, lock_path=None):
+        super().__init__(packed, feature_names, sample_index)
+        self.entry_directory = entry_directory
+        self._unlock = weakref.finalize(self, MappedPresenceMatrix._remove_lock, lock_path)
+
+    @staticmethod
+    def _remove_lock(lock_path):
+        if lock_path is None:
+            return
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+
+    def close(self):
+        """
+        Releases the entry, it may be removed from the store afterwards.
+        """
+        self._unlock()
+
+    def _layout(self, names, write):
+        """
+        Memory-maps the layout files `names`, calling `write(directory)` to
+        write them first when they do not exist yet.
+        """
+        paths = [os.path.join(self.entry_directory, name + ".npy") for name in names]
+        if not all(os.path.exists(path) for path in paths):
+            temporary_directory = tempfile.mkdtemp(dir=self.entry_directory)
+            try:
+                write(temporary_directory)
+                for name, path in zip(names, paths):
+                    os.replace(os.path.join(temporary_directory, name + ".npy"), path)
+            finally:
+                shutil.rmtree(temporary_directory, ignore_errors=True)
+        return [np.load(path, mmap_mode='r') for path in paths]
+
+    def float_presence(self):
+        def write(directory):
+            # Filled a block of features at a time, the dense layout is never fully in memory
+            out = np.lib.format.open_memmap(os.path.join(directory, "float32.npy"), mode='w+',
+                                            dtype=np.float32, shape=self.shape)
+            for start in range(0, self.shape[1], self.block_features):
+                block = self.feature_names[start:start + self.block_features]
+                out[:, start:start + len(block)] = self.dense(block)
+            out.flush()
+            del out
+
+        return self._layout(["float32"], write)[0]
+
+    def sparse_presence(self):
+        def write(directory):
+            matrix = super(MappedPresenceMatrix, self).sparse_presence()
+            self._sparse_presence = None  # Only the mapped copy is kept
+            for name, array in (("csc_data", matrix.data), ("csc_indices", matrix.indices),
+                                ("csc_indptr", matrix.indptr)):
+                np.save(os.path.join(directory, name + ".npy"), array)
+
+        data, indices, indptr = self._layout(["csc_data", "csc_indices", "csc_indptr"], write)
+        return sparse.csc_matrix((data, indices, indptr), shape=self.shape, copy=False)
@@ -0,0 +1,238 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import Kernels
+
+
+class PresenceMatrix:
+    """
+    Binarized abundance (presence/absence) of samples x features.
+
+    The presence bits of every sample are packed into uint64 words, feature j
+    of a sample is bit j % 64 of word j // 64 (the layout of
+    `CostEngine.pack_bits`), so a table needs 1 bit per value instead of the
+    4-8 bytes of a float DataFrame.
+
+    Parameters
+    ----------
+    packed : np.ndarray
+        (samples x words) uint64 presence bits.
+    feature_names : list
+        Feature (species) names, in bit order.
+    sample_index : pd.Index
+        Sample names, in row order.
+    """
+
+    block_cells = 1 << 24
+    pair_block_features = 256
+
+    def __init__(self, packed, feature_names, sample_index):
+        self.packed = packed
+        self.feature_names = list(feature_names)
+        self.sample_index = sample_index
+        self._feature_positions = {name: i for i, name in enumerate(self.feature_names)}
+        self._float_presence = None
+        self._sparse_presence = None
+
+    @property
+    def shape(self):
+        return len(self.sample_index), len(self.feature_names)
+
+    @property
+    def memory_bytes(self):
+        return int(self.packed.nbytes)
+
+    @property
+    def block_features(self):
+        """
+        Features unpacked at once, a multiple of 64 that keeps a block at about
+        `block_cells` values however many samples there are.
+        """
+        return max(64, self.block_cells // max(1, self.shape[0]) // 64 * 64)
+
+    @staticmethod
+    def pack_rows(bits):
+        """
+        Packs the rows of a binary (samples x features) matrix into uint64 words.
+        """
+        bits = np.atleast_2d(np.asarray(bits)) != 0
+        packed = np.packbits(bits, axis=1, bitorder='little')
+        padding = -packed.shape[1] % 8
+        if padding:
+            packed = np.pad(packed, ((0, 0), (0, padding)))
+        return np.ascontiguousarray(packed).view(np.uint64)
+
+    @classmethod
+    def from_dense(cls, values, feature_names, sample_index):
+        return cls(cls.pack_rows(np.asarray(values) > 0), feature_names, sample_index)
+
+    @classmethod
+    def from_frame(cls, df, features=None):
+        """
+        Binarizes and packs the `features` columns (all columns if None) of an
+        abundance DataFrame a block of columns at a time, without copying the
+        whole frame.
+        """
+        features = list(df.columns if features is None else features)
+        matrix = cls(np.zeros((len(df), max(1, -(-len(features) // 64))), dtype=np.uint64), features, df.index)
+        block_features = matrix.block_features
+        for start in range(0, len(features), block_features):
+            block = df[features[start:start + block_features]].to_numpy()
+            block_packed = cls.pack_rows(block > 0)
+            first_word = start // 64
+            matrix.packed[:, first_word:first_word + block_packed.shape[1]] = block_packed
+        return matrix
+
+    def feature_indices(self, features):
+        return np.array([self._feature_positions[name] for name in features], dtype=np.int64)
+
+    def dense(self, features=None, dtype=np.bool_):
+        """
+        Unpacks the presence of `features` (all features if None) into a
+        (samples x features) array, a block of features at a time.
+        """
+        indices = np.arange(self.shape[1]) if features is None else self.feature_indices(features)
+        out = np.empty((self.shape[0], len(indices)), dtype=dtype)
+        block_features = self.block_features
+        for start in range(0, len(indices), block_features):
+            block = indices[start:start + block_features]
+            words = self.packed[:, block // 64]
+            out[:, start:start + len(block)] = (words >> (block % 64).astype(np.uint64)) & np.uint64(1)
+        return out
+
+    def subset(self, features):
+        """
+        Returns a new PresenceMatrix with only `features`, in the given order.
+        """
+        features = list(features)
+        packed = np.zeros((self.shape[0], max(1, -(-len(features) // 64))), dtype=np.uint64)
+        block_features = self.block_features
+        for start in range(0, len(features), block_features):
+            block_packed = self.pack_rows(self.dense(features[start:start + block_features]))
+            first_word = start // 64
+            packed[:, first_word:first_word + block_packed.shape[1]] = block_packed
+        return PresenceMatrix(packed, features, self.sample_index)
+
+    def equivalence_classes(self):
+        """
+        Groups the features with the same presence in every sample. The presence
+        column of each feature is packed into bytes and hashed, a block of
+        features at a time. Returns the classes as lists of feature names, in
+        feature order, ordered by their first feature.
+        """
+        classes = {}
+        block_features = self.block_features
+        for start in range(0, self.shape[1], block_features):
+            block = self.feature_names[start:start + block_features]
+            columns = np.ascontiguousarray(np.packbits(self.dense(block), axis=0).T)
+            for name, column in zip(block, columns):
+                classes.setdefault(column.tobytes(), []).append(name)
+        return list(classes.values())
+
+    def feature_bits(self):
+        """
+        Presence of every feature packed along the samples: a (features x
+        sample words) uint64 array, sample i of a feature is bit i % 64 of word
+        i // 64.
+        """
+        bits = np.zeros((self.shape[1], max(1, -(-self.shape[0] // 64))), dtype=np.uint64)
+        block_features = self.block_features
+        for start in range(0, self.shape[1], block_features):
+            block = self.dense(self.feature_names[start:start + block_features])
+            bits[start:start + block.shape[1]] = self.pack_rows(block.T)
+        return bits
+
+    def jaccard_clusters(self, threshold):
+        """
+        Clusters co-occurring features by the Jaccard similarity |A & B| / |A | B|
+        of their presence.
+
+        Each cluster is led by the most prevalent feature not clustered yet
+        and holds the unclustered features at least `threshold` similar to it,
+        so every member co-occurs with its leader. Features that are never
+        present are similar (1.0) to each other.
+
+        The features are taken in decreasing prevalence, `pair_block_features`
+        candidate leaders at a time. The similarities of a block to the
+        features after it come from popcounts of their sample bits
+        (`feature_bits`), and the members are assigned before the next block,
+        so only one block of similarities is held whatever the threshold. As
+        the similarity of two features is at most the ratio of their
+        prevalences, the features too rare to reach `threshold` with any
+        leader of the block are not compared.
+
+        Returns the clusters as lists of feature names, the leader first and the
+        other members in feature order, ordered by their leader.
+        """
+        n_features = self.shape[1]
+        bits = self.feature_bits()
+        prevalence = np.bitwise_count(bits).sum(axis=1, dtype=np.int64)
+        order = np.argsort(-prevalence, kind='stable')
+        sorted_bits, sorted_prevalence = bits[order], prevalence[order]
+        # Clustered features, by position in `order`
+        clustered = np.zeros(n_features, dtype=np.bool_)
+        clusters = []
+        block = self.pair_block_features
+        for start in range(0, n_features, block):
+            end = min(start + block, n_features)
+            # The features more prevalent than the block are clustered already,
+            # those below threshold x the least prevalent leader cannot join
+            lowest = sorted_prevalence[end - 1] * threshold
+            stop = max(end, int(np.searchsorted(-sorted_prevalence, -lowest, side='right')))
+            bits_a, prevalence_a = sorted_bits[start:end], sorted_prevalence[start:end]
+            similar = np.zeros((end - start, stop - start), dtype=np.bool_)
+            for start_b in range(start, stop, block):
+                end_b = min(start_b + block, stop)
+                intersections = Kernels.packed_richness(bits_a, sorted_bits[start_b:end_b])
+                unions = prevalence_a[:, None] + sorted_prevalence[None, start_b:end_b] - intersections
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    similar[:, start_b - start:end_b - start] = np.where(
+                        unions > 0, intersections / unions, 1.0) >= threshold
+
+            for row in range(end - start):
+                leader = start + row
+                if clustered[leader]:
+                    continue
+                members = start + np.flatnonzero(similar[row] & ~clustered[start:stop])
+                clustered[members] = True
+                clustered[leader] = True
+                members = np.sort(order[members[members != leader]])
+                clusters.append([order[leader]] + members.tolist())
+        clusters.sort(key=lambda cluster: cluster[0])
+        return [[self.feature_names[i] for i in cluster] for cluster in clusters]
+
+    def float_presence(self):
+        """
+        Presence (1/0) of all features as a read-only float32 (samples x features)
+        array, built once and shared by every search using this matrix.
+        """
+        if self._float_presence is None:
+            self._float_presence = self.dense(dtype=np.float32)
+            self._float_presence.flags.writeable = False
+        return self._float_presence
+
+    def sparse_presence(self):
+        """
+        Presence (1/0) as a float32 CSC matrix, built once from the set bits of
+        a block of features at a time.
+        """
+        if self._sparse_presence is None:
+            rows, columns = [], []
+            block_features = self.block_features
+            for start in range(0, self.shape[1], block_features):
+                block_rows, block_columns = np.nonzero(self.dense(self.feature_names[start:start + block_features]))
+                rows.append(block_rows)
+                columns.append(block_columns + start)
+            rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+            columns = np.concatenate(columns) if columns else np.zeros(0, dtype=np.int64)
+            self._sparse_presence = sparse.csc_matrix(
+                (np.ones(len(rows), dtype=np.float32), (rows, columns)), shape=self.shape)
+        return self._sparse_presence
+
+    def to_frame(self, features=None):
+        """
+        Returns the presence of `features` (all features if None) as a 0/1 DataFrame.
+        """
+        features = self.feature_names if features is None else list(features)
+        return pd.DataFrame(self.dense(features, dtype=np.uint8), index=self.sample_index, columns=features)
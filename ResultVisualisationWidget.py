@@ -1,22 +1,59 @@
 import numpy as np
 import pandas as pd
-from PyQt5.QtWidgets import QDialog, QVBoxLayout
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QLabel
+from PyQt5.QtCore import Qt, pyqtSignal, QThread, pyqtSlot, QObject
 import seaborn as sns
 from PyQt5.QtWidgets import QApplication
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.collections import PolyCollection
 from matplotlib.figure import Figure
 
+from PreprocessingEngine import PreprocessingEngine
+
+
+class PlotAggregationWorker(QObject):
+    signal_to_finish_aggregation = pyqtSignal(object, object, str)
+
+    def __init__(self, df, groups, features, group_labels):
+        super().__init__()
+        self.df = df
+        self.groups = groups
+        self.features = features
+        self.group_labels = group_labels
+
+    @pyqtSlot()
+    def aggregate(self):
+        """Compute the plotted summaries in the worker thread."""
+        try:
+            presence_means, richness = GroupedBarPlotPopUp.aggregate(self.df, self.groups, self.features,
+                                                                     self.group_labels)
+            self.signal_to_finish_aggregation.emit(presence_means, richness, "")
+        except Exception as e:
+            self.signal_to_finish_aggregation.emit(None, None, str(e))
+
 
 class GroupedBarPlotPopUp(QDialog):
+    """
+    Mean presence of the selected species and mean richness (number of the
+    selected species present) per group.
+
+    The per-group summaries are computed in a worker thread with one sparse
+    (groups x samples) one-hot product over the presence array, so neither a
+    long-format copy of the table nor a per-sample aggregation by seaborn is
+    needed; the small (groups x features) result is then drawn as one
+    collection of bars per group.
+    """
+
     def __init__(self, df, metadata, features, score, group_labels, group_column, parent=None):
         super().__init__(parent)
         self.df = df
-        self.df = (self.df > 0).astype(int)
         self.metadata = metadata
         self.features = features
         self.score = score
-        self.group_labels = group_labels
+        self.group_labels = sorted(group_labels)
         self.group_column = group_column[0]
+        self.plot_thread = None
+        self.plot_worker = None
 
         # Configure dialog properties
         self.setWindowTitle("Best species combination")
@@ -26,76 +63,112 @@ class GroupedBarPlotPopUp(QDialog):
         layout = QVBoxLayout()
         self.setLayout(layout)
 
+        self.status_label = QLabel("Computing the group summaries...")
+        layout.addWidget(self.status_label)
+
         # Create a matplotlib Figure and embed it in the Qt Canvas
         self.figure = Figure()
         self.canvas = FigureCanvas(self.figure)
         layout.addWidget(self.canvas)
 
-        # Plot the grouped bar chart
-        self.plot_bar_chart()
-
-    def plot_bar_chart(self):
-        # Restrict df columns to features of interest
-        self.df = self.df[self.features]
-
-        # Calculate richness for each sample (sum across columns)
-        richness_series = self.df.sum(axis=1)
-
-        # Ensure we have sorted group labels
-        self.group_labels = sorted(self.group_labels)
-        palette = sns.color_palette("Set2", n_colors=len(self.group_labels))
+        # Aggregate in a worker thread, then plot the bar charts
+        self.start_aggregation()
+
+    @staticmethod
+    def aggregate(df, groups, features, group_labels):
+        """
+        Returns the mean presence of every feature per group, a (groups x
+        features) DataFrame, and the mean, standard deviation and number of
+        samples of the richness per group. Samples of a group not in
+        `group_labels` are left out.
+        """
+        presence = df[features].to_numpy() > 0
+        codes = pd.Categorical(np.asarray(groups), categories=group_labels).codes.astype(np.int64)
+        one_hot = PreprocessingEngine.one_hot(codes, len(group_labels))
+        counts = np.asarray(one_hot.sum(axis=1)).ravel()
+
+        richness = presence.sum(axis=1, dtype=np.float64)
+        richness_sums = one_hot @ richness
+        richness_squares = one_hot @ (richness * richness)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            presence_means = np.asarray(one_hot @ presence.astype(np.float64)) / counts[:, None]
+            richness_mean = richness_sums / counts
+            # Sample standard deviation, the 'sd' error bar of seaborn
+            richness_sd = np.sqrt(np.maximum(richness_squares - richness_sums * richness_mean, 0.0) / (counts - 1))
+        return (pd.DataFrame(presence_means, index=group_labels, columns=features),
+                pd.DataFrame({'Richness': richness_mean, 'sd': richness_sd, 'count': counts}, index=group_labels))
+
+    def start_aggregation(self):
+        self.plot_worker = PlotAggregationWorker(self.df, self.metadata[self.group_column].values, self.features,
+                                                 self.group_labels)
+        self.plot_thread = QThread()
+        self.plot_worker.moveToThread(self.plot_thread)
+        self.plot_thread.started.connect(self.plot_worker.aggregate)
+        self.plot_worker.signal_to_finish_aggregation.connect(self.finish_aggregation)
+        # The thread ends as soon as the result is sent, even without an event loop in the dialog
+        self.plot_worker.signal_to_finish_aggregation.connect(self.plot_thread.quit, Qt.DirectConnection)
+        self.plot_thread.start()
+
+    def stop_aggregation(self):
+        if self.plot_thread is not None:
+            self.plot_thread.quit()
+            self.plot_thread.wait()
+        self.plot_thread = None
+        self.plot_worker = None
+
+    def finish_aggregation(self, presence_means, richness, message):
+        self.stop_aggregation()
+        if presence_means is None:
+            self.status_label.setText(f"Could not plot the result: {message}")
+            return
+        self.status_label.setVisible(False)
+        self.plot_bar_chart(presence_means, richness)
+
+    def done(self, result):
+        # The worker thread must not outlive the dialog
+        self.stop_aggregation()
+        super().done(result)
+
+    def plot_bar_chart(self, presence_means, richness):
+        # Desaturated as seaborn draws its bars
+        palette = sns.color_palette("Set2", n_colors=len(self.group_labels), desat=0.75)
         color_map = dict(zip(self.group_labels, palette))
 
-        df_with_group = self.df.copy()
-        df_with_group['Group'] = self.metadata[self.group_column].values
-
-        df_melted = df_with_group.melt(
-            id_vars='Group',  # Keep the "Group" column as is
-            var_name='Feature',  # New column name for old columns
-            value_name='Presence'  # Values (the species presence/abundance)
-        )
-
-        richness_df = pd.DataFrame({
-            'Group': self.metadata[self.group_column].values,
-            'Richness': richness_series
-        })
-
         self.figure.clear()
         ax1 = self.figure.add_subplot(2, 1, 1)
         ax2 = self.figure.add_subplot(2, 1, 2)
 
-        plot1 = sns.barplot(
-            data=df_melted,
-            x='Feature',
-            y='Presence',
-            hue='Group',
-            order=self.features,
-            hue_order=self.group_labels,
-            palette=color_map,
-            errorbar=None,
-            ax=ax1
-        )
-        plot1.set_title('Presence of Selected Species by Group')
-        plot1.set_xlabel('Species')
-        plot1.set_ylabel('Mean Presence')
-        # Rotate x-ticks
-        plot1.set_xticklabels(plot1.get_xticklabels(), rotation=45, ha='right')
-        plot1.legend(loc='best')
-
-        plot2 = sns.barplot(
-            data=richness_df,
-            x='Group',
-            y='Richness',
-            order=self.group_labels,
-            hue='Group',
-            palette=color_map,
-            estimator=np.mean,
-            errorbar='sd',
-            ax=ax2
-        )
-        plot2.set_title('Richness by Group')
-        plot2.set_xlabel(self.group_column)
-        plot2.set_ylabel('Presence of selected species')
+        # The bars of a group are one collection instead of a patch per bar,
+        # dodged within a feature as seaborn does
+        positions = np.arange(len(self.features))
+        width = 0.8 / len(self.group_labels)
+        for i, group in enumerate(self.group_labels):
+            left = positions - 0.4 + width * i
+            heights = np.nan_to_num(presence_means.loc[group, self.features].to_numpy())
+            corners = np.stack([np.column_stack([left, np.zeros_like(heights)]),
+                                np.column_stack([left, heights]),
+                                np.column_stack([left + width, heights]),
+                                np.column_stack([left + width, np.zeros_like(heights)])], axis=1)
+            ax1.add_collection(PolyCollection(corners, facecolors=color_map[group], edgecolors='none', label=group))
+        ax1.set_xticks(positions, self.features, rotation=45, ha='right')
+        ax1.set_xlim(-0.5, len(self.features) - 0.5)
+        ax1.set_ylim(0, max(1e-9, float(np.nanmax(presence_means.to_numpy(), initial=0.0))) * 1.05)
+        ax1.set_title('Presence of Selected Species by Group')
+        ax1.set_xlabel('Species')
+        ax1.set_ylabel('Mean Presence')
+        ax1.legend(loc='best', title='Group')
+
+        # Mean richness with standard deviation error bars (seaborn's 'sd')
+        group_positions = np.arange(len(self.group_labels))
+        ax2.bar(group_positions, richness['Richness'].to_numpy(), width=0.8,
+                color=[color_map[group] for group in self.group_labels])
+        ax2.errorbar(x=group_positions, y=richness['Richness'].to_numpy(), yerr=richness['sd'].to_numpy(),
+                     fmt='none', ecolor='.26', elinewidth=2.4)
+        ax2.set_xticks(group_positions, self.group_labels)
+        ax2.set_xlim(-0.5, len(self.group_labels) - 0.5)
+        ax2.set_title('Richness by Group')
+        ax2.set_xlabel(self.group_column)
+        ax2.set_ylabel('Presence of selected species')
 
         # Adjust layout and reduce gap
         self.figure.tight_layout(pad=1.0)
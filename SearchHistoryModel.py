@@ -0,0 +1,110 @@
+import numpy as np
+from PyQt5 import QtCore
+
+
+class SearchHistoryModel(QtCore.QAbstractListModel):
+    """
+    List model of the cost history of a search, newest generation first.
+
+    The history is kept in three growing NumPy columns (generation, cost,
+    species count) instead of one list item per generation; the columns
+    double their capacity when full, so appending a progress update is
+    amortized O(1) whatever the length of the history. The row text is only
+    formatted for the rows a view paints.
+
+    With `max_rows` set, the list shows only the newest `max_rows`
+    generations and the older rows are removed from the view as new ones
+    arrive; the columns still hold the whole history.
+
+    Parameters
+    ----------
+    max_rows : int or None
+        Maximum number of rows shown, None to show the whole history.
+    """
+
+    initial_capacity = 1024
+
+    def __init__(self, max_rows=None, parent=None):
+        super().__init__(parent)
+        self.max_rows = max_rows
+        self._generations = np.zeros(self.initial_capacity, dtype=np.int64)
+        self._costs = np.zeros(self.initial_capacity, dtype=np.float64)
+        self._species_counts = np.zeros(self.initial_capacity, dtype=np.int32)
+        self._size = 0
+        self._rows = 0
+
+    def __len__(self):
+        return self._size
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rows
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < self._rows:
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            position = self._size - 1 - index.row()
+            return (f"Generation: {self._generations[position]} | P-value: {self._costs[position]} | "
+                    f"Total: {self._species_counts[position]}")
+        return None
+
+    def generation(self, row):
+        """
+        Generation number shown in `row`.
+        """
+        return int(self._generations[self._size - 1 - row])
+
+    def history(self):
+        """
+        Returns (generations, costs, species counts) of the whole history, oldest first.
+        """
+        return (self._generations[:self._size].copy(), self._costs[:self._size].copy(),
+                self._species_counts[:self._size].copy())
+
+    def _reserve(self, size):
+        capacity = len(self._generations)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        for name in ('_generations', '_costs', '_species_counts'):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self._size] = column[:self._size]
+            setattr(self, name, grown)
+
+    def append(self, entries):
+        """
+        Adds the (generation, cost, species count, ...) `entries`, oldest
+        first, at the top of the list; further values of an entry are ignored.
+        """
+        if not entries:
+            return
+        new_rows = len(entries)
+        shown_rows = self._rows + new_rows
+        if self.max_rows is not None and shown_rows > self.max_rows:
+            removed = min(self._rows, shown_rows - self.max_rows)
+            if removed:
+                self.beginRemoveRows(QtCore.QModelIndex(), self._rows - removed, self._rows - 1)
+                self._rows -= removed
+                self.endRemoveRows()
+            new_rows = min(new_rows, self.max_rows)
+
+        generations, costs, species_counts = list(zip(*entries))[:3]
+        self._reserve(self._size + len(entries))
+        self.beginInsertRows(QtCore.QModelIndex(), 0, new_rows - 1)
+        end = self._size + len(entries)
+        self._generations[self._size:end] = generations
+        self._costs[self._size:end] = costs
+        self._species_counts[self._size:end] = species_counts
+        self._size = end
+        self._rows += new_rows
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self._size = 0
+        self._rows = 0
+        self.endResetModel()
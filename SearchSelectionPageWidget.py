@@ -1,8 +1,11 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout, QSizePolicy, QTableView, QCheckBox, \
-    QLineEdit, QGroupBox, QFrame, QFormLayout, QComboBox, QRadioButton, QButtonGroup
+    QLineEdit, QGroupBox, QFrame, QFormLayout, QComboBox, QRadioButton, QButtonGroup, QMessageBox
 from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtGui import QIntValidator, QDoubleValidator
 
 import DataProcessing
+import Kernels
+from BeamSearch import BeamSearch
 from GeneticAlgorithm import GeneticAlgorithm
 from SimulatedAnnealing import SimulatedAnnealing
 from mainwindow import PandasModel
@@ -12,9 +15,12 @@ class SearchSelectionPageWidget(QWidget):
     signal_to_preprocessing_page = pyqtSignal()
     signal_to_ga_page = pyqtSignal()
     signal_to_sa_page = pyqtSignal()
+    signal_to_bs_page = pyqtSignal()
+
+    cost_backends = {"Matrix product": 'matmul', "Bit-packed popcount": 'packed', "Sparse matrix product": 'sparse'}
 
     def __init__(self, data: DataProcessing.DataFile, ga_data: GeneticAlgorithm, sa_data: SimulatedAnnealing,
-                 parent=None):
+                 bs_data: BeamSearch, parent=None):
         """
         :param data: Shared dictionary or object for application data
         :param parent: Parent widget (optional)
@@ -24,6 +30,7 @@ class SearchSelectionPageWidget(QWidget):
         self.data_file = data  # Keep a reference to the shared data
         self.genetic_algorithm_data = ga_data
         self.simulated_annealing_data = sa_data
+        self.beam_search_data = bs_data
         self.init_ui()
 
     def init_ui(self):
@@ -43,7 +50,7 @@ class SearchSelectionPageWidget(QWidget):
         data_shape_layout = QHBoxLayout()
         data_shape_label = QLabel("Data shape:")
         self.sa_shape_value_label = QLabel(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x {self.data_file.preprocessed_abundance_dataframe.shape[1]} features")
+            f"{self.data_file.get_preprocessed_shape()[0]} rows x {self.data_file.get_preprocessed_shape()[1]} features")
         data_shape_layout.addWidget(data_shape_label)
         data_shape_layout.addWidget(self.sa_shape_value_label)
         data_shape_layout.addStretch()
@@ -53,9 +60,11 @@ class SearchSelectionPageWidget(QWidget):
         algo_selection_layout = QHBoxLayout()
         self.genetic_checkbox = QCheckBox("Genetic Search")
         self.sa_checkbox = QCheckBox("Simulated Annealing")
+        self.bs_checkbox = QCheckBox("Beam Search")
 
         algo_selection_layout.addWidget(self.genetic_checkbox)
         algo_selection_layout.addWidget(self.sa_checkbox)
+        algo_selection_layout.addWidget(self.bs_checkbox)
         algo_selection_layout.addStretch()
         search_algorithm_layout.addLayout(algo_selection_layout)
 
@@ -75,7 +84,7 @@ class SearchSelectionPageWidget(QWidget):
         
         https://www.neuraldesigner.com/blog/genetic_algorithms_for_feature_selection/#:~:text=The%20number%20of%20individuals%2C%20or,be%20a%20multiple%20of%204 
         """
-        pop_begin = self.data_file.preprocessed_abundance_dataframe.shape[1] * 4
+        pop_begin = len(self.data_file.get_search_feature_list()) * 4
         self.genetic_pop_size = QLineEdit(str(pop_begin))
         """
         https://www.mdpi.com/2076-3417/12/3/1186#:~:text=performance,of%20the%20total%20population
@@ -141,6 +150,30 @@ class SearchSelectionPageWidget(QWidget):
         genetic_params_layout.addRow("Number of parents:", self.genetic_num_parents)
         genetic_params_layout.addRow("Seed:", self.genetic_seed)
 
+        # Optional memetic polishing of the elites
+        self.memetic_checkbox = QCheckBox("Every N generations")
+        self.memetic_interval_edit = QLineEdit("5")
+        self.memetic_interval_edit.setValidator(QIntValidator(1, 1000000000))
+        self.memetic_interval_edit.setEnabled(False)  # disabled initially
+        self.memetic_checkbox.toggled.connect(self.memetic_interval_edit.setEnabled)
+
+        memetic_layout = QHBoxLayout()
+        memetic_layout.addWidget(self.memetic_checkbox)
+        memetic_layout.addWidget(self.memetic_interval_edit)
+        genetic_params_layout.addRow("Elite polishing:", memetic_layout)
+
+        # Optional surrogate pre-screening of the offspring
+        self.surrogate_checkbox = QCheckBox("Evaluate only the best % of offspring")
+        self.surrogate_fraction_edit = QLineEdit("30")
+        self.surrogate_fraction_edit.setValidator(QDoubleValidator(1.0, 100.0, 4))
+        self.surrogate_fraction_edit.setEnabled(False)  # disabled initially
+        self.surrogate_checkbox.toggled.connect(self.surrogate_fraction_edit.setEnabled)
+
+        surrogate_layout = QHBoxLayout()
+        surrogate_layout.addWidget(self.surrogate_checkbox)
+        surrogate_layout.addWidget(self.surrogate_fraction_edit)
+        genetic_params_layout.addRow("Surrogate screening:", surrogate_layout)
+
         genetic_params_group.setLayout(genetic_params_layout)
 
         # ------- Simulated Annealing parameters ------- #
@@ -208,12 +241,34 @@ class SearchSelectionPageWidget(QWidget):
         sa_params_layout.addRow("Seed:", self.sa_seed)
         sa_params_group.setLayout(sa_params_layout)
 
-        # By default, hide both parameter groups (shown when checkbox is checked)
+        # ------- Beam Search parameters ------- #
+        bs_params_group = QGroupBox("Beam Search Parameters")
+        bs_params_layout = QFormLayout()
+
+        # Every signature size costs at most beam width x features evaluations
+        self.bs_beam_width = QLineEdit("10")
+        self.bs_max_signature_size = QLineEdit("50")
+        self.continue_checkbox_bs = QCheckBox("Stop when no improvement for sizes")
+        self.improvement_edit_bs = QLineEdit("3")
+        self.continue_checkbox_bs.setChecked(True)
+        self.continue_checkbox_bs.toggled.connect(self.improvement_edit_bs.setEnabled)
+
+        bs_params_layout.addRow("Beam width:", self.bs_beam_width)
+        bs_params_layout.addRow("Maximum signature size:", self.bs_max_signature_size)
+        continue_layout_bs = QHBoxLayout()
+        continue_layout_bs.addWidget(self.continue_checkbox_bs)
+        continue_layout_bs.addWidget(self.improvement_edit_bs)
+        bs_params_layout.addRow("", continue_layout_bs)
+        bs_params_group.setLayout(bs_params_layout)
+
+        # By default, hide all parameter groups (shown when checkbox is checked)
         genetic_params_group.setVisible(False)
         sa_params_group.setVisible(False)
+        bs_params_group.setVisible(False)
 
         search_algorithm_layout.addWidget(genetic_params_group)
         search_algorithm_layout.addWidget(sa_params_group)
+        search_algorithm_layout.addWidget(bs_params_group)
 
         # Look for the group numbers
         if len(self.data_file.output_label_groups) == 2:
@@ -221,29 +276,67 @@ class SearchSelectionPageWidget(QWidget):
         elif len(self.data_file.output_label_groups) == 3:
             self.populate_three_group_stats(search_algorithm_layout)
 
+        # --- Cost engine backend selection ---
+        backend_group = QGroupBox("Evaluation Backend")
+        backend_layout = QHBoxLayout()
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItems(list(self.cost_backends))
+        backend_layout.addWidget(QLabel("Richness kernel:"))
+        backend_layout.addWidget(self.backend_combo)
+        # Compiled kernels are only available when Numba is installed
+        self.numba_checkbox = QCheckBox("Numba kernels")
+        self.numba_checkbox.setChecked(Kernels.NUMBA_AVAILABLE)
+        self.numba_checkbox.setEnabled(Kernels.NUMBA_AVAILABLE)
+        backend_layout.addWidget(self.numba_checkbox)
+        # Out-of-core searches read the presence from a shared read-only file
+        self.mapped_presence_checkbox = QCheckBox("Memory-mapped presence file")
+        self.mapped_presence_checkbox.setToolTip(
+            "Writes the binarized presence matrix to disk and maps it read-only, "
+            "concurrent searches on the same data share one copy")
+        backend_layout.addWidget(self.mapped_presence_checkbox)
+        backend_group.setLayout(backend_layout)
+        search_algorithm_layout.addWidget(backend_group)
+
         # --- Logic to enable/disable parameter sections based on selection ---
         def on_genetic_toggled(checked):
             if checked:
-                # Uncheck the other checkbox
+                # Uncheck the other checkboxes
                 self.sa_checkbox.setChecked(False)
-                # Show genetic parameters, hide SA parameters
+                self.bs_checkbox.setChecked(False)
+                # Show genetic parameters, hide the others
                 genetic_params_group.setVisible(True)
                 sa_params_group.setVisible(False)
+                bs_params_group.setVisible(False)
             else:
                 genetic_params_group.setVisible(False)
 
         def on_sa_toggled(checked):
             if checked:
-                # Uncheck the other checkbox
+                # Uncheck the other checkboxes
                 self.genetic_checkbox.setChecked(False)
-                # Show SA parameters, hide Genetic parameters
+                self.bs_checkbox.setChecked(False)
+                # Show SA parameters, hide the others
                 sa_params_group.setVisible(True)
                 genetic_params_group.setVisible(False)
+                bs_params_group.setVisible(False)
             else:
                 sa_params_group.setVisible(False)
 
+        def on_bs_toggled(checked):
+            if checked:
+                # Uncheck the other checkboxes
+                self.genetic_checkbox.setChecked(False)
+                self.sa_checkbox.setChecked(False)
+                # Show beam search parameters, hide the others
+                bs_params_group.setVisible(True)
+                genetic_params_group.setVisible(False)
+                sa_params_group.setVisible(False)
+            else:
+                bs_params_group.setVisible(False)
+
         self.genetic_checkbox.toggled.connect(on_genetic_toggled)
         self.sa_checkbox.toggled.connect(on_sa_toggled)
+        self.bs_checkbox.toggled.connect(on_bs_toggled)
         self.genetic_checkbox.setChecked(True)
 
         # # Adjust stretching or spacing if needed
@@ -380,19 +473,46 @@ class SearchSelectionPageWidget(QWidget):
         search_algorithm_layout.addWidget(obj_func_group)
 
     def refresh_ui(self):
-        pop_begin = self.data_file.preprocessed_abundance_dataframe.shape[1] * 4
+        pop_begin = len(self.data_file.get_search_feature_list()) * 4
         self.genetic_pop_size.setText(str(pop_begin))
         parents_begin = int(pop_begin * 0.30)
         self.genetic_num_parents.setText(str(parents_begin))
 
-        self.sa_shape_value_label.setText(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x {self.data_file.preprocessed_abundance_dataframe.shape[1]} features")
+        # The searched samples, without those a normalization step left out
+        rows, features = self.data_file.get_presence_view().shape
+        self.sa_shape_value_label.setText(f"{rows} rows x {features} features")
 
     def go_to_preprocessing_page(self):
         self.signal_to_preprocessing_page.emit()
 
+    def set_search_abundance(self, search_data):
+        """
+        Gives a search instance the shared read-only presence of the preprocessed
+        data, or the memory-mapped presence file when that option is checked,
+        and the species to search over (one per presence class when collapsed).
+        """
+        search_data.search_abundance = None
+        search_data.soi_list = self.data_file.get_search_feature_list()
+        search_data.species_classes = self.data_file.get_species_classes()
+        if self.mapped_presence_checkbox.isChecked():
+            search_data.search_presence = self.data_file.map_search_presence()
+        else:
+            search_data.search_presence = self.data_file.get_presence_view()
+
     def choosing_search_algorithm_page(self):
+        Kernels.set_backend('numba' if self.numba_checkbox.isChecked() else 'numpy')
+
         if self.genetic_checkbox.isChecked():
+            if self.memetic_checkbox.isChecked() and not self.memetic_interval_edit.hasAcceptableInput():
+                QMessageBox.warning(self, "Invalid parameter",
+                                    "The elite polishing interval must be a whole number of generations (1 or more).")
+                return
+            if self.surrogate_checkbox.isChecked() and not self.surrogate_fraction_edit.hasAcceptableInput():
+                # Below 1 % the offspring bred for screening would grow over 100 times the population
+                QMessageBox.warning(self, "Invalid parameter",
+                                    "The evaluated share of the offspring must be a percentage from 1 to 100.")
+                return
+
             hypothesis_selection = 'two-sided'
             positive_category = "" # str(self.groupA_radio.text())
             signature_type = 'positive'
@@ -419,11 +539,9 @@ class SearchSelectionPageWidget(QWidget):
                     else:
                         positive_category = str(self.groupB_radio.text())
 
-            self.genetic_algorithm_data.search_abundance = self.data_file.preprocessed_abundance_dataframe.copy()
-            self.genetic_algorithm_data.search_abundance[self.genetic_algorithm_data.search_abundance > 0] = 1
-            self.genetic_algorithm_data.metadata = self.data_file.input_metadata_dataframe
+            self.set_search_abundance(self.genetic_algorithm_data)
+            self.genetic_algorithm_data.metadata = self.data_file.get_search_metadata()
             self.genetic_algorithm_data.output_column = self.data_file.output_labels[0]
-            self.genetic_algorithm_data.soi_list = self.data_file.feature_list_after_preprocessing
             self.genetic_algorithm_data.positive_label = positive_category
             self.genetic_algorithm_data.output_label_categories = self.data_file.output_label_groups
             self.genetic_algorithm_data.hypothesis_selection = hypothesis_selection
@@ -435,6 +553,13 @@ class SearchSelectionPageWidget(QWidget):
             self.genetic_algorithm_data.stop_strategy = stop_strategy
             self.genetic_algorithm_data.improvement_patience = improvement_patience
             self.genetic_algorithm_data.random_seed = int(self.genetic_seed.text())
+            self.genetic_algorithm_data.cost_engine.backend = self.cost_backends[self.backend_combo.currentText()]
+            self.genetic_algorithm_data.memetic_mode = self.memetic_checkbox.isChecked()
+            if self.memetic_checkbox.isChecked():
+                self.genetic_algorithm_data.memetic_interval = int(self.memetic_interval_edit.text())
+            self.genetic_algorithm_data.surrogate_mode = self.surrogate_checkbox.isChecked()
+            if self.surrogate_checkbox.isChecked():
+                self.genetic_algorithm_data.surrogate_fraction = float(self.surrogate_fraction_edit.text()) / 100.0
 
             self.signal_to_ga_page.emit()
 
@@ -465,11 +590,9 @@ class SearchSelectionPageWidget(QWidget):
                     else:
                         positive_category = str(self.groupB_radio.text())
 
-            self.simulated_annealing_data.search_abundance = self.data_file.preprocessed_abundance_dataframe.copy()
-            self.simulated_annealing_data.search_abundance[self.simulated_annealing_data.search_abundance > 0] = 1
-            self.simulated_annealing_data.metadata = self.data_file.input_metadata_dataframe
+            self.set_search_abundance(self.simulated_annealing_data)
+            self.simulated_annealing_data.metadata = self.data_file.get_search_metadata()
             self.simulated_annealing_data.output_column = self.data_file.output_labels[0]
-            self.simulated_annealing_data.soi_list = self.data_file.feature_list_after_preprocessing
             self.simulated_annealing_data.positive_label = positive_category
             self.simulated_annealing_data.output_label_categories = self.data_file.output_label_groups
             self.simulated_annealing_data.hypothesis_selection = hypothesis_selection
@@ -481,5 +604,40 @@ class SearchSelectionPageWidget(QWidget):
             self.simulated_annealing_data.stop_strategy = stop_strategy
             self.simulated_annealing_data.improvement_patience = improvement_patience
             self.simulated_annealing_data.random_seed = int(self.sa_seed.text())
+            self.simulated_annealing_data.cost_engine.backend = self.cost_backends[self.backend_combo.currentText()]
 
             self.signal_to_sa_page.emit()
+
+        elif self.bs_checkbox.isChecked():
+            hypothesis_selection = 'two-sided'
+            positive_category = ""
+            signature_type = 'positive'
+
+            if len(self.data_file.output_label_groups) == 2:
+                if self.one_sided_radio.isChecked():
+                    hypothesis_selection = 'one-sided'
+                    if self.negative_radio.isChecked():
+                        signature_type = 'negative'
+                    if self.groupA_radio.isChecked():
+                        positive_category = str(self.groupA_radio.text())
+                    else:
+                        positive_category = str(self.groupB_radio.text())
+
+            max_signature_size = min(int(self.bs_max_signature_size.text()),
+                                     len(self.data_file.get_search_feature_list()))
+
+            self.set_search_abundance(self.beam_search_data)
+            self.beam_search_data.metadata = self.data_file.get_search_metadata()
+            self.beam_search_data.output_column = self.data_file.output_labels[0]
+            self.beam_search_data.positive_label = positive_category
+            self.beam_search_data.output_label_categories = self.data_file.output_label_groups
+            self.beam_search_data.hypothesis_selection = hypothesis_selection
+            self.beam_search_data.signature_type = signature_type
+            self.beam_search_data.objective_function = str(self.obj_func_combo.currentText())
+            self.beam_search_data.beam_width = int(self.bs_beam_width.text())
+            self.beam_search_data.num_generations = max_signature_size
+            self.beam_search_data.stop_strategy = self.continue_checkbox_bs.isChecked()
+            self.beam_search_data.improvement_patience = int(self.improvement_edit_bs.text())
+            self.beam_search_data.cost_engine.backend = self.cost_backends[self.backend_combo.currentText()]
+
+            self.signal_to_bs_page.emit()
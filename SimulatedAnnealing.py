@@ -1,9 +1,8 @@
 import math
 import random
 import pickle
-from concurrent.futures import ThreadPoolExecutor
-from scipy.stats import mannwhitneyu, ttest_ind, f_oneway, kruskal
-import pandas as pd
+
+from CostEngine import CostEngine
 
 
 class SimulatedAnnealing:
@@ -19,17 +18,19 @@ class SimulatedAnnealing:
             self
     ):
         self.search_abundance = None
+        self.search_presence = None
         self.metadata = None
         # self.search_disease = search_disease
         self.positive_label = None
         self.soi_list = None
+        self.species_classes = None
         self.output_column = None
 
         self.no_iterations = 1000
         self.temp = 10000
         self.cooling_rate = 0.40
 
-        self.objective_function = "Mann-Whitney"
+        self.objective_function = "Mann-Whitney U-test"
         self.hypothesis_selection = 'two-sided'
         self.signature_type = 'positive'
         self.output_label_categories = None
@@ -40,12 +41,14 @@ class SimulatedAnnealing:
         self.stop_strategy = True
         self.improvement_patience = 10
         self.random_seed = 42
+        self.cost_engine = CostEngine()
 
         self._cost_cache = {}
         self.current_solution = []
         self.current_cost = float('inf')
         self.next_solution = []
         self.next_cost = float('inf')
+        self.current_richness = None
         self.current_best_solution = []
         self.current_best_score = float('inf')
         self.no_improvement_counter = 0
@@ -59,6 +62,7 @@ class SimulatedAnnealing:
         self.current_cost = float('inf')
         self.next_solution = []
         self.next_cost = float('inf')
+        self.current_richness = None
         self.current_best_solution = []
         self.current_best_score = float('inf')
         self.no_improvement_counter = 0
@@ -69,127 +73,44 @@ class SimulatedAnnealing:
         pass
         # random.seed(self.random_seed)
 
-    def _t_test_cost_function(self, GroupA_data, GroupB_data):
-        # Welch's T-test
-        if self.hypothesis_selection == 'one-sided':
-            if self.signature_type == 'positive':
-                stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='greater')
-            else:
-                stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='less')
-            return p_value
-
-        elif self.hypothesis_selection == 'two-sided':
-            stat, p_value = ttest_ind(a=GroupA_data, b=GroupB_data, equal_var=False, alternative='two-sided')
-            return p_value
-
-    def _mann_whitney_u_test(self, GroupA_data, GroupB_data):
-        if self.hypothesis_selection == 'one-sided':
-            if self.signature_type == 'positive':
-                stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='greater')
-            else:
-                stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='less')
-            return p_value
-
-        elif self.hypothesis_selection == 'two-sided':
-            stat, p_value = mannwhitneyu(GroupA_data, GroupB_data, alternative='two-sided')
-            return p_value
-
-    def _calculate_cost_two_groups(self, species_list):
-        """
-        Calculates the p-value for the Mann-Whitney U test for the given set
-        of species, comparing disease vs control.
-        """
-        if not species_list:
-            # If no species selected, return a high p-value so that this solution
-            # is less likely to be considered the best.
-            return 1.0
-
-        current_abundance_df = self.search_abundance[species_list]
-        richness_df = current_abundance_df.apply(lambda x: x.sum(), axis=1)
-        data = pd.concat([richness_df.rename('richness'), self.metadata], axis=1)
-
-        if self.hypothesis_selection == 'one-sided':
-            positive_label = self.positive_label
-        else:
-            positive_label = self.output_label_categories[0]
-
-        GroupA_data = data[data[self.output_column] == positive_label]['richness']
-        GroupB_data = data[data[self.output_column] != positive_label]['richness']
-
-        if self.objective_function == 'Mann-Whitney U-test':
-            p_val = self._mann_whitney_u_test(GroupA_data=GroupA_data, GroupB_data=GroupB_data)
-            return p_val
-
-        if self.objective_function == "Welch's T-test":
-            p_val = self._t_test_cost_function(GroupA_data=GroupA_data, GroupB_data=GroupB_data)
-            return p_val
-
-    def _calculate_cost_three_groups(self, species_list):
-        """
-        Calculates the p-value for the Mann-Whitney U test for the given set
-        of species, comparing disease vs control.
-        """
-        if not species_list:
-            # If no species selected, return a high p-value so that this solution
-            # is less likely to be considered the best.
-            return 1.0
-
-        current_abundance_df = self.search_abundance[species_list]
-        richness_df = current_abundance_df.apply(lambda x: x.sum(), axis=1)
-        data = pd.concat([richness_df.rename('richness'), self.metadata], axis=1)
-
-        GroupA_data = data[data[self.output_column] == self.output_label_categories[0]]['richness']
-        GroupB_data = data[data[self.output_column] == self.output_label_categories[1]]['richness']
-        GroupC_data = data[data[self.output_column] == self.output_label_categories[2]]['richness']
-
-        if self.objective_function == "One Way-ANOVA":
-            _, p_value = f_oneway(GroupA_data, GroupB_data, GroupC_data)
-            return p_value
-
-        if self.objective_function == "Kruskal-Wallis H-test":
-            _, p_val = kruskal(GroupA_data, GroupB_data, GroupC_data)
-            return p_val
-
     def get_species_name(self, best_solution):
         """
         Given a binary combination list, returns the names of species selected (1s).
+        A species standing for a presence class is expanded to the whole class.
         """
         selected_species = []
         for i, bit in enumerate(best_solution):
             if bit == 1:
-                selected_species.append(self.soi_list[i])
+                if self.species_classes:
+                    selected_species.extend(self.species_classes[self.soi_list[i]])
+                else:
+                    selected_species.append(self.soi_list[i])
         return selected_species
 
-    def _evaluate(self, combination):
+    def _evaluate(self, combination, richness=None):
         """
         Evaluates the combination by computing (or retrieving) the p-value from the cache.
+        The per-sample richness of the combination can be passed when it is already known.
         """
         combination_key = tuple(combination)
         if combination_key in self._cost_cache:
             return self._cost_cache[combination_key]
 
-        # Extract the selected species
-        combination_species = [
-            self.soi_list[i]
-            for i, bit in enumerate(combination)
-            if bit == 1
-        ]
-
-        # Compute the p-value for two groups
-        if len(self.output_label_categories) == 2:
-            p_val = self._calculate_cost_two_groups(combination_species)
-            self._cost_cache[combination_key] = p_val
-            return p_val
-        elif len(self.output_label_categories) == 3:
-            p_val = self._calculate_cost_three_groups(combination_species)
-            self._cost_cache[combination_key] = p_val
-            return p_val
+        if richness is not None and any(combination):
+            p_val = float(self.cost_engine.evaluate_richness(richness)[0])
+        else:
+            p_val = float(self.cost_engine.evaluate_batch([combination])[0])
+        self._cost_cache[combination_key] = p_val
+        return p_val
 
     def _generate_neighbour(self, solution):
+        """
+        Flips a random bit of the solution. Returns the neighbour and the flipped index.
+        """
         neighbour = solution.copy()
         idx = random.randint(0, len(solution) - 1)
         neighbour[idx] = 0 if neighbour[idx] == 1 else 1
-        return neighbour
+        return neighbour, idx
 
     def _acceptance_probability(self, old_cost, new_cost, temperature):
         if new_cost < old_cost:
@@ -223,18 +144,26 @@ class SimulatedAnnealing:
         self.current_iteration += 1
 
         if self.current_iteration == 0:
+            self.cost_engine.configure(self)
             self.current_solution = [1 for _ in range(num_items)]
 
         elif self.current_iteration == 1:
             self.current_solution = [random.choice([1, 0]) for _ in range(num_items)]
 
-        self.current_cost = self._evaluate(self.current_solution)
+        if self.current_iteration <= 1:
+            self.current_richness = self.cost_engine.richness(self.current_solution)[0]
+
+        self.current_cost = self._evaluate(self.current_solution, self.current_richness)
 
-        self.next_solution = self._generate_neighbour(self.current_solution)
-        self.next_cost = self._evaluate(self.next_solution)
+        self.next_solution, flipped_idx = self._generate_neighbour(self.current_solution)
+        # Only the flipped species changes the richness of the neighbour
+        sign = 1 if self.next_solution[flipped_idx] == 1 else -1
+        next_richness = self.cost_engine.flip_richness(self.current_richness, flipped_idx, sign)
+        self.next_cost = self._evaluate(self.next_solution, next_richness)
 
         if self._acceptance_probability(self.current_cost, self.next_cost, self.temp) > random.random():
             self.current_solution, self.current_cost = self.next_solution, self.next_cost
+            self.current_richness = next_richness
 
             self.temp *= self.cooling_rate
 
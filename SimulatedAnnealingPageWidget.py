@@ -1,24 +1,38 @@
 from PyQt5.QtWidgets import QWidget, QVBoxLayout, QPushButton, QLabel, QHBoxLayout, QSizePolicy, QProgressBar, \
-    QListWidget, QFileDialog
+    QListWidget, QListView, QFileDialog
 from PyQt5.QtCore import Qt, pyqtSignal, QThread, pyqtSlot, QObject, QTimer
 
 import DataProcessing
 from SimulatedAnnealing import SimulatedAnnealing
+from ConvergencePlotWidget import ConvergencePlotWidget
 from ResultVisualisationWidget import GroupedBarPlotPopUp
+from SearchHistoryModel import SearchHistoryModel
 from utils import create_search_result_track_output_simulated_annealing
 import random
+import time
 
 
 class SearchWorker(QObject):
-    signal_to_update_progress = pyqtSignal(int, int, float, list, bool)
+    """
+    Runs the search in the worker thread. Every timer tick runs iterations for
+    up to `frame_interval` seconds and reports them in one progress signal, so
+    the page is updated at a fixed frame rate however fast the iterations are.
+    The signal carries the (generation, cost, species count, best score so far,
+    temperature) of every iteration of the tick, and the best solution only
+    when it changed since the last report (None otherwise).
+    """
+    signal_to_update_progress = pyqtSignal(int, list, object, bool)
     signal_to_pause_search = pyqtSignal()
     signal_to_stop_search = pyqtSignal(str)
 
+    frame_interval = 1 / 30
+
     def __init__(self, ga_data:SimulatedAnnealing):
         super().__init__()
         self.ga_data = ga_data
         self.search_running = False
         self.timer = None  # Initialize timer as None
+        self.shown_solution = None
 
     @pyqtSlot()
     def init_timer(self):
@@ -57,33 +71,43 @@ class SearchWorker(QObject):
         self.signal_to_stop_search.emit("stop_pressed")
 
     def process_iteration(self):
-        """Process a single iteration of the genetic algorithm."""
+        """Run iterations of the search for one frame and report their progress."""
         if not self.search_running:
             return  # Do nothing if paused
 
-        # Run one iteration
-        self.ga_data.run_one_iteration()
-        generation_no = self.ga_data.current_iteration
-        cost_value = self.ga_data.tracking_generations[generation_no].get('best_score')
-        best_solution = self.ga_data.tracking_generations[generation_no].get('current_solution')
-
+        history = []
         should_break = False
-        if self.ga_data.stop_strategy:
-            if (self.ga_data.improvement_patience - self.ga_data.no_improvement_counter) == 0:
-                should_break = True
-
-        current_gen = self.ga_data.current_iteration
+        frame_end = time.perf_counter() + self.frame_interval
+        while True:
+            self.ga_data.run_one_iteration()
+            generation_no = self.ga_data.current_iteration
+            tracking = self.ga_data.tracking_generations[generation_no]
+            best_solution = tracking.get('current_solution')
+            history.append((generation_no, tracking.get('best_score'), len(best_solution),
+                            self.ga_data.current_best_score, self.ga_data.temp))
+
+            if self.ga_data.stop_strategy:
+                if (self.ga_data.improvement_patience - self.ga_data.no_improvement_counter) == 0:
+                    should_break = True
+            finished = generation_no >= self.ga_data.no_iterations
+            if finished or should_break or time.perf_counter() >= frame_end:
+                break
+
+        # Only send the solution when the species list has to change
+        changed_solution = None
+        if best_solution != self.shown_solution:
+            self.shown_solution = list(best_solution)
+            changed_solution = self.shown_solution
 
         # Emit progress signal
         self.signal_to_update_progress.emit(
-            current_gen,
             generation_no,
-            cost_value,
-            best_solution,
+            history,
+            changed_solution,
             should_break
         )
 
-        if current_gen >= self.ga_data.no_iterations:
+        if finished:
             self.timer.stop()
             self.signal_to_stop_search.emit("finished")
             return
@@ -97,6 +121,9 @@ class SimulatedAnnealingPageWidget(QWidget):
     signal_to_search_selection_page = pyqtSignal()
     signal_to_visualisation_page = pyqtSignal()
 
+    # Rows shown in the cost history, None to show every generation
+    max_history_rows = 10000
+
     def __init__(self, data: DataProcessing.DataFile, sa_data: SimulatedAnnealing, parent=None):
         super().__init__(parent)
         self.search_running_thread = None
@@ -123,7 +150,7 @@ class SimulatedAnnealingPageWidget(QWidget):
         shape_layout = QHBoxLayout()
         input_shape_label = QLabel("Data Shape:")
         self.input_shape_value = QLabel(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x {self.data_file.preprocessed_abundance_dataframe.shape[1]} features")  # Example shape text
+            f"{self.data_file.get_preprocessed_shape()[0]} rows x {self.data_file.get_preprocessed_shape()[1]} features")  # Example shape text
         shape_layout.addWidget(input_shape_label)
         shape_layout.addWidget(self.input_shape_value)
         shape_layout.addStretch()  # Add stretch to push contents to left
@@ -149,6 +176,12 @@ class SimulatedAnnealingPageWidget(QWidget):
         self.progress_bar.setValue(0)  # Example current progress
         main_layout.addWidget(self.progress_bar)
 
+        # Convergence of the search
+        self.convergence_plot = ConvergencePlotWidget(show_temperature=True,
+                                                      generations=self.ga_data.no_iterations)
+        self.convergence_plot.setMinimumHeight(180)
+        main_layout.addWidget(self.convergence_plot)
+
         self.info_text_label = QLabel("")
         main_layout.addWidget(self.info_text_label)
 
@@ -161,7 +194,10 @@ class SimulatedAnnealingPageWidget(QWidget):
         cost_function_label.setAlignment(Qt.AlignLeft)
         left_panel_layout.addWidget(cost_function_label)
 
-        self.results_list = QListWidget()
+        self.results_model = SearchHistoryModel(max_rows=self.max_history_rows)
+        self.results_list = QListView()
+        self.results_list.setUniformItemSizes(True)
+        self.results_list.setModel(self.results_model)
         self.results_list.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         left_panel_layout.addWidget(self.results_list)
 
@@ -177,7 +213,7 @@ class SimulatedAnnealingPageWidget(QWidget):
         self.species_list.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         right_panel_layout.addWidget(self.species_list)
 
-        self.results_list.itemClicked.connect(self.updateSpeciesList)
+        self.results_list.clicked.connect(self.updateSpeciesList)
 
         parallel_layout.addLayout(right_panel_layout)
 
@@ -249,14 +285,15 @@ class SimulatedAnnealingPageWidget(QWidget):
         self.visualise_button.setEnabled(False)
         self.export_button.setEnabled(False)
         self.input_shape_value.setText(
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[0]} rows x "
-            f"{self.data_file.preprocessed_abundance_dataframe.shape[1]} features")
+            f"{self.data_file.get_preprocessed_shape()[0]} rows x "
+            f"{self.data_file.get_preprocessed_shape()[1]} features")
         self.current_gen_label.setText(f"0/{self.ga_data.no_iterations}")
         self.progress_bar.setMinimum(0)
         self.progress_bar.setMaximum(self.ga_data.no_iterations)
         self.progress_bar.setValue(0)
         self.info_text_label.setText("")
-        self.results_list.clear()
+        self.results_model.clear()
+        self.convergence_plot.clear(self.ga_data.no_iterations)
         self.species_list.clear()
 
     def back_to_search_selection_page(self):
@@ -271,8 +308,8 @@ class SimulatedAnnealingPageWidget(QWidget):
 
     def visualise_result_page(self):
         popup = GroupedBarPlotPopUp(
-            df=self.ga_data.search_abundance,
-            metadata=self.data_file.input_metadata_dataframe,
+            df=self.ga_data.search_presence.to_frame(self.ga_data.current_best_solution),
+            metadata=self.ga_data.metadata,
             features=self.ga_data.current_best_solution,
             score=self.ga_data.current_best_score,
             group_labels=self.data_file.output_label_groups,
@@ -283,6 +320,7 @@ class SimulatedAnnealingPageWidget(QWidget):
 
     def stop_the_search(self, flag):
         """Handle the stop signal from the worker."""
+        self.convergence_plot.flush()
         if flag == "stop_pressed":
             self.info_text_label.setText(
                 "INFO: Search stopped")
@@ -316,26 +354,26 @@ class SimulatedAnnealingPageWidget(QWidget):
         if not self.search_running_thread.isRunning():
             self.search_running_thread.start()
 
-    def updateSpeciesList(self, item):
+    def updateSpeciesList(self, index):
         # Clear the current species list
         self.species_list.clear()
-        index = self.results_list.row(item)
-        reverse_index = abs(max(self.ga_data.tracking_generations.keys()) - index)
-        this_solution = self.ga_data.tracking_generations[reverse_index].get('current_solution')
-        for spp in this_solution:
-            self.species_list.addItem(spp)
+        generation_no = self.results_model.generation(index.row())
+        this_solution = self.ga_data.tracking_generations[generation_no].get('current_solution')
+        self.species_list.addItems(this_solution)
         self.species_list.scrollToTop()
 
-    def update_search_progress(self, i, generation_no, cost_value, best_solution, should_break):
-        """Update the UI with the latest search progress."""
+    def update_search_progress(self, i, history, best_solution, should_break):
+        """Update the UI with the progress of the iterations run since the last update."""
+        generation_no = history[-1][0]
+        self.results_model.append(history)
+        columns = list(zip(*history))
+        self.convergence_plot.append(columns[0], columns[3], columns[1], columns[4])
         self.results_list.scrollToTop()
-        self.results_list.insertItem(0,
-                                     f"Generation: {generation_no} | P-value: {cost_value} | Total: {len(best_solution)}")
 
-        self.species_list.clear()
-        for sp in best_solution:
-            self.species_list.addItem(sp)
-        self.species_list.scrollToTop()
+        if best_solution is not None:
+            self.species_list.clear()
+            self.species_list.addItems(best_solution)
+            self.species_list.scrollToTop()
 
         self.current_gen_label.setText(f"{generation_no}/{self.ga_data.no_iterations}")
         self.progress_bar.setValue(i + 1)
@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class SparseAbundance:
+    """
+    Abundance of samples x features stored as a CSC (compressed sparse column)
+    matrix, so memory and the work of selecting features, group statistics and
+    presence scale with the number of nonzero values instead of samples x features.
+
+    Parameters
+    ----------
+    matrix : scipy.sparse.csc_matrix
+        float32 abundance, samples as rows and features as columns.
+    feature_names : list
+        Feature (species) names, in column order.
+    sample_index : pd.Index
+        Sample names, in row order.
+    """
+
+    block_features = 4096
+
+    def __init__(self, matrix, feature_names, sample_index):
+        self.matrix = sparse.csc_matrix(matrix)
+        self.feature_names = list(feature_names)
+        self.sample_index = sample_index
+        self._feature_positions = {name: i for i, name in enumerate(self.feature_names)}
+        self._packed = None
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Converts a numeric DataFrame a block of columns at a time, so only one
+        dense block is copied at once.
+        """
+        blocks = []
+        for start in range(0, df.shape[1], cls.block_features):
+            block = df.iloc[:, start:start + cls.block_features].to_numpy(dtype=np.float32)
+            blocks.append(sparse.csc_matrix(block))
+        matrix = sparse.hstack(blocks, format='csc') if blocks else sparse.csc_matrix((len(df), 0), dtype=np.float32)
+        return cls(matrix, df.columns, df.index)
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    @property
+    def memory_bytes(self):
+        return int(self.matrix.data.nbytes + self.matrix.indices.nbytes + self.matrix.indptr.nbytes)
+
+    @property
+    def nnz(self):
+        return self.matrix.nnz
+
+    def feature_indices(self, features):
+        return np.array([self._feature_positions[name] for name in features], dtype=np.int64)
+
+    def subset(self, features):
+        """
+        Returns a new SparseAbundance with only `features`, in the given order.
+        """
+        features = list(features)
+        return SparseAbundance(self.matrix[:, self.feature_indices(features)], features, self.sample_index)
+
+    def group_statistics(self, labels):
+        """
+        Returns {category: (sum, valid count, nonzero count)} of every feature
+        over the samples of each category of `labels`, NaN values excluded.
+        """
+        labels = np.asarray(labels)
+        categories = pd.unique(labels[pd.notna(labels)])
+        one_hot = sparse.csr_matrix(np.array([labels == category for category in categories], dtype=np.float64))
+
+        values = self.matrix.astype(np.float64)
+        is_nan = np.isnan(values.data)
+        nan_values = values.copy()
+        nan_values.data = is_nan.astype(np.float64)
+        nan_values.eliminate_zeros()
+        values.data[is_nan] = 0.0
+        nonzero = values.copy()
+        nonzero.data = (values.data > 0).astype(np.float64)
+
+        sums = np.asarray((one_hot @ values).todense())
+        nan_counts = np.asarray((one_hot @ nan_values).todense())
+        nonzero_counts = np.asarray((one_hot @ nonzero).todense())
+        group_sizes = np.asarray(one_hot.sum(axis=1)).ravel()
+        return {
+            category: (sums[i], group_sizes[i] - nan_counts[i], nonzero_counts[i])
+            for i, category in enumerate(categories)
+        }
+
+    def float_presence(self):
+        """
+        Presence (1/0) of all features as a float32 (samples x features) array.
+        """
+        return self.dense(dtype=np.float32)
+
+    def sparse_presence(self):
+        """
+        Presence (1/0) as a float32 CSC matrix.
+        """
+        presence = self.matrix.copy()
+        presence.data = (presence.data > 0).astype(np.float32)
+        presence.eliminate_zeros()
+        return presence
+
+    @property
+    def packed(self):
+        """
+        Presence bits packed into uint64 words (the `PresenceMatrix` layout),
+        set from the nonzero entries only.
+        """
+        if self._packed is None:
+            presence = self.sparse_presence().tocoo()
+            packed = np.zeros((self.shape[0], max(1, -(-self.shape[1] // 64))), dtype=np.uint64)
+            bits = np.left_shift(np.uint64(1), (presence.col % 64).astype(np.uint64))
+            np.bitwise_or.at(packed, (presence.row, presence.col // 64), bits)
+            self._packed = packed
+        return self._packed
+
+    def dense(self, features=None, dtype=np.bool_):
+        """
+        Unpacks the presence of `features` (all features if None) into a
+        (samples x features) array.
+        """
+        matrix = self.matrix if features is None else self.matrix[:, self.feature_indices(features)]
+        presence = matrix.toarray() > 0
+        return presence.astype(dtype, copy=False)
+
+    def to_frame(self, features=None):
+        """
+        Returns the abundance of `features` (all features if None) as a dense DataFrame.
+        """
+        features = self.feature_names if features is None else list(features)
+        return pd.DataFrame(self.matrix[:, self.feature_indices(features)].toarray(),
+                            index=self.sample_index, columns=features)
@@ -0,0 +1,96 @@
+import numpy as np
+from scipy.stats import spearmanr
+
+
+class SurrogateModel:
+    """
+    A cheap linear surrogate of the cost function, fitted online.
+
+    The model predicts -log10(p-value) of a binary genome with ridge regression
+    on the genome bits. Only the sufficient statistics (X'X and X'y) are kept,
+    so adding newly evaluated genomes costs O(features^2) per genome and the
+    evaluated genomes themselves do not need to be stored.
+
+    Parameters
+    ----------
+    ridge : float
+        L2 penalty of the regression.
+    min_samples : int
+        Number of evaluated genomes needed before the model is used.
+    """
+
+    def __init__(self, ridge=1.0, min_samples=100):
+        self.ridge = ridge
+        self.min_samples = min_samples
+        self.reset()
+
+    def reset(self):
+        self.n_samples = 0
+        self._xtx = None
+        self._xty = None
+        self._weights = None
+
+    @staticmethod
+    def _design_matrix(genomes):
+        genomes = np.atleast_2d(np.asarray(genomes, dtype=np.float64))
+        # The last column is the intercept
+        return np.hstack([genomes, np.ones((len(genomes), 1))])
+
+    @staticmethod
+    def to_target(p_values):
+        """
+        Converts p-values to the regression target, -log10(p).
+        """
+        p_values = np.asarray(p_values, dtype=np.float64)
+        return -np.log10(np.clip(p_values, 1e-300, 1.0))
+
+    def update(self, genomes, p_values):
+        """
+        Adds evaluated genomes to the model. Genomes with NaN p-values are skipped.
+        """
+        p_values = np.asarray(p_values, dtype=np.float64)
+        valid = ~np.isnan(p_values)
+        if not valid.any():
+            return
+        x = self._design_matrix(np.asarray(genomes)[valid])
+        y = self.to_target(p_values[valid])
+
+        if self._xtx is None:
+            self._xtx = np.zeros((x.shape[1], x.shape[1]))
+            self._xty = np.zeros(x.shape[1])
+        self._xtx += x.T @ x
+        self._xty += x.T @ y
+        self.n_samples += len(y)
+        self._weights = None
+
+    def is_ready(self):
+        return self.n_samples >= self.min_samples
+
+    def _fit(self):
+        penalty = self.ridge * np.eye(self._xtx.shape[0])
+        penalty[-1, -1] = 0.0  # Do not penalise the intercept
+        self._weights = np.linalg.solve(self._xtx + penalty, self._xty)
+
+    def predict(self, genomes):
+        """
+        Predicted -log10(p-value) of every genome, higher is better.
+        """
+        if self._weights is None:
+            self._fit()
+        return self._design_matrix(genomes) @ self._weights
+
+    @classmethod
+    def accuracy(cls, predicted, p_values):
+        """
+        Mean absolute error (in -log10 p) and Spearman rank correlation of
+        predictions against the exact p-values.
+        """
+        predicted = np.asarray(predicted, dtype=np.float64)
+        p_values = np.asarray(p_values, dtype=np.float64)
+        valid = ~np.isnan(p_values)
+        if valid.sum() < 2:
+            return float('nan'), float('nan')
+        actual = cls.to_target(p_values[valid])
+        error = float(np.mean(np.abs(predicted[valid] - actual)))
+        correlation = float(spearmanr(predicted[valid], actual).correlation)
+        return error, correlation
@@ -7,6 +7,8 @@ from PyQt5.QtWidgets import (
     QVBoxLayout, QWidget, QStackedWidget, QPushButton
 )
 
+from BeamSearch import BeamSearch
+from BeamSearchPageWidget import BeamSearchPageWidget
 from DataProcessing import DataFile
 from GeneticAlgorithm import GeneticAlgorithm
 from GeneticAlgorithmPageWidget import GeneticAlgorithmPageWidget
@@ -16,6 +18,10 @@ from SearchSelectionPageWidget import SearchSelectionPageWidget
 from SimulatedAnnealing import SimulatedAnnealing
 from SimulatedAnnealingPageWidget import SimulatedAnnealingPageWidget
 
+# Column selections (metadata/abundance splits, feature subsets) share the
+# parsed data until they are written to, instead of copying it
+pd.options.mode.copy_on_write = True
+
 
 class MainWindow(QtWidgets.QMainWindow):
     def __init__(self):
@@ -28,6 +34,7 @@ class MainWindow(QtWidgets.QMainWindow):
         self.data_file = DataFile()
         self.ga_run_instance = GeneticAlgorithm()
         self.sa_run_instance = SimulatedAnnealing()
+        self.bs_run_instance = BeamSearch()
 
         self.stacked_widget = QStackedWidget()
         self.setCentralWidget(self.stacked_widget)
@@ -82,10 +89,12 @@ class MainWindow(QtWidgets.QMainWindow):
         if 'search_selection_page' not in self.pages:
             self.pages['search_selection_page'] = SearchSelectionPageWidget(data=self.data_file,
                                                                             ga_data=self.ga_run_instance,
-                                                                            sa_data=self.sa_run_instance)
+                                                                            sa_data=self.sa_run_instance,
+                                                                            bs_data=self.bs_run_instance)
             self.pages['search_selection_page'].signal_to_preprocessing_page.connect(self.show_preprocessing_page)
             self.pages['search_selection_page'].signal_to_ga_page.connect(self.show_genetic_algorithm_page)
             self.pages['search_selection_page'].signal_to_sa_page.connect(self.show_simulated_annealing_page)
+            self.pages['search_selection_page'].signal_to_bs_page.connect(self.show_beam_search_page)
             self.stacked_widget.addWidget(self.pages['search_selection_page'])
 
         else:
@@ -121,6 +130,19 @@ class MainWindow(QtWidgets.QMainWindow):
 
         self.stacked_widget.setCurrentWidget(self.pages['simulated_annealing'])
 
+    def show_beam_search_page(self):
+        if 'beam_search' not in self.pages:
+            self.pages['beam_search'] = BeamSearchPageWidget(data=self.data_file, bs_data=self.bs_run_instance)
+
+            self.pages['beam_search'].signal_to_search_selection_page.connect(
+                self.show_search_algorithm_selection_page)
+            self.stacked_widget.addWidget(self.pages['beam_search'])
+
+        else:
+            self.pages['beam_search'].refresh_ui()
+
+        self.stacked_widget.setCurrentWidget(self.pages['beam_search'])
+
     # def create_nav_bar(self):
     #     """
     #     Example 'navigation bar' widget with two buttons:
@@ -1,36 +1,91 @@
 import sys
+from collections import OrderedDict
+
 import pandas as pd
 from PyQt5 import QtCore
 
 
 class PandasModel(QtCore.QAbstractTableModel):
     """
-    A basic model to interface a Pandas DataFrame with a QTableView.
+    A model to interface a Pandas DataFrame with a QTableView.
+
+    The values are read from NumPy arrays (the single array of a frame with
+    one dtype, otherwise one array per column) and are formatted a block of
+    `block_rows` rows of a column at a time, when a cell of the block is first
+    painted; the formatted blocks are kept in a bounded cache, so repainting
+    and scrolling only format cells that were not shown yet. Header labels
+    are formatted once. Columns are made available `column_batch` at a time
+    through canFetchMore/fetchMore, so a view of a very wide frame only lays
+    out the columns scrolled to.
     """
 
-    def __init__(self, df=pd.DataFrame(), parent=None):
+    block_rows = 256
+    column_batch = 256
+    cache_blocks = 4096
+
+    def __init__(self, df=None, parent=None):
         super().__init__(parent)
-        self._df = df
+        self._df = pd.DataFrame() if df is None else df
+        self._values = None
+        if self._df.shape[1] and len(set(self._df.dtypes)) == 1 and self._df.dtypes.iloc[0] != object:
+            # One dtype: a single array, a view of the frame where possible
+            self._values = self._df.to_numpy()
+        self._columns = {}
+        self._formatted = OrderedDict()
+        self._column_labels = [str(label) for label in self._df.columns]
+        self._row_labels = [str(label) for label in self._df.index]
+        self._loaded_columns = min(len(self._column_labels), self.column_batch)
 
     def rowCount(self, parent=None):
-        return len(self._df.index)
+        return len(self._row_labels)
 
     def columnCount(self, parent=None):
-        return len(self._df.columns)
+        return self._loaded_columns
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        return self._loaded_columns < len(self._column_labels)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        loaded = min(len(self._column_labels), self._loaded_columns + self.column_batch)
+        if loaded > self._loaded_columns:
+            self.beginInsertColumns(QtCore.QModelIndex(), self._loaded_columns, loaded - 1)
+            self._loaded_columns = loaded
+            self.endInsertColumns()
+
+    def _column_values(self, column):
+        if self._values is not None:
+            return self._values[:, column]
+        if column not in self._columns:
+            self._columns[column] = self._df.iloc[:, column].to_numpy()
+        return self._columns[column]
+
+    def _formatted_block(self, column, block):
+        key = (column, block)
+        formatted = self._formatted.get(key)
+        if formatted is None:
+            start = block * self.block_rows
+            values = self._column_values(column)[start:start + self.block_rows]
+            formatted = [str(value) for value in values]
+            self._formatted[key] = formatted
+            if len(self._formatted) > self.cache_blocks:
+                self._formatted.popitem(last=False)
+        else:
+            self._formatted.move_to_end(key)
+        return formatted
 
     def data(self, index, role=QtCore.Qt.DisplayRole):
         if not index.isValid():
             return None
         if role == QtCore.Qt.DisplayRole:
-            return str(self._df.iat[index.row(), index.column()])
+            row = index.row()
+            return self._formatted_block(index.column(), row // self.block_rows)[row % self.block_rows]
         return None
 
     def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
         if role == QtCore.Qt.DisplayRole:
-            if orientation == QtCore.Qt.Horizontal:
-                return self._df.columns[section]
-            else:
-                return str(self._df.index[section])
+            labels = self._column_labels if orientation == QtCore.Qt.Horizontal else self._row_labels
+            if 0 <= section < len(labels):
+                return labels[section]
         return None
 
 
@@ -37,6 +37,25 @@ def create_search_result_track_output_genetic_algorithm(sa_tracking_dict, file_p
 
         row_index += 1
 
+    # Cost evaluations and surrogate accuracy of the genetic algorithm (not of the beam search)
+    if 'surrogate_error' in best_solution:
+        sheet3 = wb.create_sheet(title="Evaluations")
+        headers = ["Generation", "Evaluations", "Elite polishing evaluations", "Surrogate saved evaluations",
+                   "Surrogate MAE (-log10 p)", "Surrogate Spearman"]
+        keys = ['evaluations', 'memetic_evaluations', 'surrogate_saved_evaluations', 'surrogate_error',
+                'surrogate_correlation']
+        for col_index, header in enumerate(headers, start=1):
+            sheet3.cell(row=1, column=col_index).value = header
+
+        for row_index, gen in enumerate(sorted(sa_tracking_dict.keys()), start=2):
+            details = sa_tracking_dict.get(gen)
+            sheet3.cell(row=row_index, column=1).value = gen
+            for col_index, key in enumerate(keys, start=2):
+                value = details.get(key)
+                # Generations without surrogate predictions have no accuracy
+                if value is not None and value == value:
+                    sheet3.cell(row=row_index, column=col_index).value = value
+
     wb.save(file_path)
 
 